@@ -2,8 +2,19 @@ import spidev
 
 from max11617.max11617 import MAX11617
 from mlx90640.mlx90640 import MLX90640
+from mlx90640.frame_ring import RawFrameRing
+from mlx90640.frame_slot import FrameSlot
+from mlx90640.roi import RoiEngine
+from mlx90640.raw_log import RawFrameLog
+from mlx90640.emulator import MLX90640Emulator
 from vl530l0x.vl530lx import VL53L0X
 from mcp2515.mcp2515 import MCP2515
+from mcp2515.tx_scheduler import TxScheduler
+from mcp2515.rx_listener import RxListener
+from mcp2515.can_dispatch import CanDispatcher
+from mcp2515.periodic_scheduler import PeriodicScheduler
+from mcp2515.can_codec import CanCodec
+from mcp2515.freshness import SensorReading, FreshSender
 
 from multiprocessing import Process, Queue, Value, Array
 from smbus2 import SMBus
@@ -13,6 +24,8 @@ from random import randint
 
 import os
 
+import numpy as np
+
 import busio
 import board
 
@@ -26,9 +39,23 @@ if "DAQ_PI_ID" in os.environ:
 else:
     DAQ_PI_ID = 4
 
-MLX_CAN_ID = 0x660 + 16 * DAQ_PI_ID # 16 bc we do 660 for pi0, 670 for pi1... (in hex, 16 apart)
-ADC_CAN_ID = 0x661 + 16 * DAQ_PI_ID
-VL_CAN_ID = 0x662 + 16 * DAQ_PI_ID
+# CAN messages and signals, the DAQ IDs are 16 apart per Pi (0x660 for pi0, 0x670 for pi1...)
+CAN_SIGNALS_FILE = str(Path(__file__).parent.absolute()) + "/can_signals.json"
+# Every message is polled twice per sensor period and sent only for a reading it has not sent yet, so a reading is on
+# the bus at most half a period after its acquisition and never twice
+CAN_POLL_DIVIDER = 2
+# The distance is only sent when it moves by more than the deadband [mm], and at least every heartbeat period [s]
+VL530_DEADBAND = 2
+CAN_HEARTBEAT_PERIOD = 0.5
+# Readings older than this are not sent, e.g. those of a sensor that stopped answering [s]
+CAN_MAX_AGE = 1.0
+
+# Tire temperature zones over the 32x24 frame: (name, row start, row stop, column start, column stop)
+TIRE_ZONES = [
+    ("inner", 0, 24, 0, 11),
+    ("middle", 0, 24, 11, 21),
+    ("outer", 0, 24, 21, 32),
+]
 
 MLX90640_TASK_PERIOD = 0.125
 
@@ -36,7 +63,13 @@ VL530_TASK_PERIOD = 0.05
 MAX11617_TASK_PERIOD = 0.005
 
 MLX90640_ADDRESS = 0x33
-MLX90640_FRAME_RATE = 8.0
+MLX90640_FRAME_RATE = float(os.getenv("MLX90640_FRAME_RATE", 8.0))
+MLX90640_ENGINE = MLX90640.ENGINE_NUMPY
+MLX90640_SUBPAGE_INCREMENTAL = True
+MLX90640_RING_SLOTS = 8
+# Log raw frames (replayable with mlx90640/replay.py) instead of the compensated temperatures
+MLX90640_LOG_RAW_FRAMES = True
+MLX90640_LOG_RING_SLOTS = 16
 
 VL53L0X_ADDRESS = 0x29
 
@@ -45,43 +78,84 @@ MAX11617_CHANNEL_COUNT = 3
 
 TIME_1MS = 0.001
 SPI_MAX_SPEED_HZ = 100000
-MCP_CS_PIN = 5 # this is the chip select pin (designated by the chosen GPIO on PI)
+# this is the chip select pin (designated by the chosen GPIO on PI), None if CS is wired to CE0: the SPI controller
+# then drives it and command sequences go out as single ioctls
+MCP_CS_PIN = 5
+MCP_INT_PIN = 25 # interrupt output of the MCP2515, low while a received frame waits
 
 LOG_DIRECTORY = str(Path(__file__).parent.absolute()) + "/../log/"
+CALIBRATION_CACHE_DIRECTORY = str(Path(__file__).parent.absolute()) + "/../cache/"
 
 
-def i2c0_process(i2c_handle, avg_temp_value, ir_frame_update, ir_frame_array):
+def i2c0_process(i2c_handle, avg_temp_reading, ir_frame_slot, zone_stats_reading, mlx_log_ring,
+                 eeprom_array):
     
     mlx_enabled = False
     
     try:    
-        mlx = MLX90640(i2c_handle, i2c_addr=MLX90640_ADDRESS, frame_rate=MLX90640_FRAME_RATE)
+        mlx = MLX90640(i2c_handle, i2c_addr=MLX90640_ADDRESS, frame_rate=MLX90640_FRAME_RATE, engine=MLX90640_ENGINE,
+                       calibration_cache=CALIBRATION_CACHE_DIRECTORY, subpage_incremental=MLX90640_SUBPAGE_INCREMENTAL)
+        eeprom_array[:] = mlx.eeprom.eeprom
         mlx_enabled = True
     except Exception as e:
         print("MLX not detected")
 
-    def mlx90640_task():
+    # Acquisition only polls the sensor and hands raw frames to the compensation process, so compensation
+    # never makes it miss a new data flag
+    def mlx90640_task(mlx_ring):
+        frame_period = 1.0 / MLX90640_FRAME_RATE
+        last_timestamp = None
         while True:
-            avg_temp, frame = mlx.read_frame()
+            raw_frame = mlx.hw.read_frame_into()
 
-            if avg_temp is not None:
-                avg_temp_value.value = avg_temp
-                
-                if ir_frame_update.value == 0:
-                    ir_frame_update.value = 1
-                else:
-                    ir_frame_update.value = 0
-                
-                for i, value in enumerate(frame):
-                    ir_frame_array[i] = value
-                    
-    mlx90640_thread = Thread(target=mlx90640_task)
+            if raw_frame is not None:
+                timestamp = time.time()
+                mlx_ring.push(mlx.hw.frame_buffer, timestamp)
+
+                if last_timestamp is not None and timestamp - last_timestamp > 1.5 * frame_period:
+                    mlx_ring.record_missed(round((timestamp - last_timestamp) / frame_period) - 1)
+                last_timestamp = timestamp
+            else:
+                time.sleep(TIME_1MS)
     
     if mlx_enabled:
+        mlx_ring = RawFrameRing(slots=MLX90640_RING_SLOTS)
+
+        compensation_process = Process(target=mlx90640_compensation_process,
+                                       args=(mlx, mlx_ring, avg_temp_reading, ir_frame_slot, zone_stats_reading,
+                                             mlx_log_ring,))
+        compensation_process.start()
+
+        mlx90640_thread = Thread(target=mlx90640_task, args=(mlx_ring,))
         mlx90640_thread.start()
 
+
+def mlx90640_compensation_process(mlx, mlx_ring, avg_temp_reading, ir_frame_slot, zone_stats_reading, mlx_log_ring):
+
+    roi = RoiEngine()
+    for zone in TIRE_ZONES:
+        roi.add_rect_zone(*zone)
+    roi.compile(mlx.eeprom.bad_pixels)
+
+    raw_buffer = bytearray(mlx_ring.frame_bytes)
+    raw_frame = np.frombuffer(raw_buffer, dtype=">i2")
+
+    while True:
+        timestamp = mlx_ring.pop_into(raw_buffer, timeout=1.0)
+
+        if timestamp is not None:
+            if MLX90640_LOG_RAW_FRAMES:
+                mlx_log_ring.push(raw_buffer, timestamp)
+
+            avg_temp, frame = mlx.process_frame(raw_frame)
+            avg_temp_reading.publish((avg_temp,), timestamp)
+            ir_frame_slot.write(frame, timestamp)
+
+            zone_stats = roi.compute(frame)
+            zone_stats_reading.publish([int(value) for value in zone_stats.ravel()], timestamp)
+
         
-def i2c1_process(i2c_handle, distance_value, linpot_value, adc1_value, adc2_value):
+def i2c1_process(i2c_handle, distance_reading, adc_reading):
     
     vl530_enabled = False
     max11617_enabled = False
@@ -103,7 +177,7 @@ def i2c1_process(i2c_handle, distance_value, linpot_value, adc1_value, adc2_valu
         while True:
             current_time = time.time()
             if current_time - start_time > VL530_TASK_PERIOD:
-                distance_value.value = vl530.read_distance()
+                distance_reading.publish((vl530.read_distance(),))
                 
                 start_time = current_time
             else:
@@ -114,7 +188,7 @@ def i2c1_process(i2c_handle, distance_value, linpot_value, adc1_value, adc2_valu
         while True:
             current_time = time.time()
             if current_time - start_time > MAX11617_TASK_PERIOD: 
-                linpot_value.value, adc1_value.value, adc2_value.value = max11617.read_adc()
+                adc_reading.publish(max11617.read_adc())
                 
                 start_time = current_time  
             else:
@@ -130,13 +204,14 @@ def i2c1_process(i2c_handle, distance_value, linpot_value, adc1_value, adc2_valu
         max11617_thread.start()
 
 
-def log_process(ir_frame_update, ir_frame_array, test_id_value):
+def log_process(ir_frame_slot, test_id_value, mlx_log_ring, eeprom_array):
     
     os.makedirs(LOG_DIRECTORY, exist_ok=True)
 
     file_handle = None
     current_test_id = 0
-    last_update_value = 0
+    last_frame_count = 0
+    raw_buffer = bytearray(mlx_log_ring.frame_bytes)
    
     def _test_active(test_id):
         return test_id >= 2 ** 15 
@@ -158,112 +233,93 @@ def log_process(ir_frame_update, ir_frame_array, test_id_value):
             
             if test_active:
                 time_in_min = datetime.now().strftime("%Y-%m-%d_%H:%M")
-                file_handle = open(f"{LOG_DIRECTORY}/{time_in_min}_{test_id}.log", "w")
+                if MLX90640_LOG_RAW_FRAMES:
+                    file_handle = RawFrameLog(f"{LOG_DIRECTORY}/{time_in_min}_{test_id}.mlxraw", eeprom_array[:],
+                                              test_id)
+                else:
+                    file_handle = open(f"{LOG_DIRECTORY}/{time_in_min}_{test_id}.log", "w")
         
-        if test_active:
+        if MLX90640_LOG_RAW_FRAMES:
+            # Log raw MLX90640 frames, the ring is drained between tests as well
+            timestamp = mlx_log_ring.pop_into(raw_buffer, timeout=0)
+            while timestamp is not None:
+                if test_active:
+                    file_handle.write(raw_buffer, timestamp)
+                timestamp = mlx_log_ring.pop_into(raw_buffer, timeout=0)
+        elif test_active:
             # Log MLX90640 data
-            if (ir_frame_update.value != last_update_value):
+            frame_count, _, frame = ir_frame_slot.read()
+            if frame_count != last_frame_count:
                 timestamp_str = datetime.now().strftime("%H:%M:%S.%f")
-                file_handle.write(timestamp_str + " ; ")
-                
-                file_handle.write(f"{test_id_value.value & 0x7FFF} ; ")
-                
-                for value in ir_frame_array:
-                    file_handle.write(f"{value},")
-                file_handle.write("\n")
-                                
-                last_update_value = ir_frame_update.value
+                line = timestamp_str + " ; " + f"{test_id_value.value & 0x7FFF} ; " + \
+                    "".join(f"{value}," for value in frame.tolist()) + "\n"
+
+                # the frame is read in place, it is only logged if the compensation did not overwrite it meanwhile
+                if ir_frame_slot.is_valid(frame_count):
+                    file_handle.write(line)
+                    last_frame_count = frame_count
         
         time.sleep(TIME_1MS)
     
 
-def can_process(spi_handle, avg_temp_value, distance_value, linpot_value, adc1_value, adc2_value, test_id_value):
+def can_process(spi_handle, avg_temp_reading, zone_stats_reading, distance_reading, adc_reading, test_id_value):
+
+    codec = CanCodec.load(CAN_SIGNALS_FILE, pi_id=DAQ_PI_ID)
+    avg_temp_message = codec["MLX_AVG_TEMP"]
+    adc_message = codec["ADC"]
+    distance_message = codec["DISTANCE"]
+    zone_messages = [codec["TIRE_ZONE_" + zone[0].upper()] for zone in TIRE_ZONES]
+    # Received: test ID of the current test, 0 when no test is running
+    test_id_message = codec["TEST_ID"]
+
+    def on_test_id(can_data, can_length):
+        if can_length == test_id_message.length:
+            test_id, test_active = test_id_message.decode_raw(can_data)
+            test_id_value.value = (test_active << 15) | test_id
+
+    # the masks and filters only let the registered IDs through
+    dispatcher = CanDispatcher()
+    dispatcher.register(test_id_message.can_id, on_test_id)
 
     mcp = MCP2515(spi_handle, cs_pin=MCP_CS_PIN)
     mcp.set_config_mode()
-    mcp.enable_filters(0, True) 
-    mcp.enable_filters(1, False)
-    mcp.set_acceptance_mask(0, 0x7FF)
-    mcp.set_acceptance_filter(0, 0x777)  
+    dispatcher.configure(mcp)
     mcp.set_normal_mode()
 
     mcp_lock = Lock()
+    # the tasks only queue their frames, the scheduler keeps the three TX buffers busy
+    tx_scheduler = TxScheduler(mcp, mcp_lock)
+    tx_scheduler.start()
 
-    def uint16_to_bytes(value):
-        return [value & 0xFF, value >> 8]
-
-    def max11617_task():
-        start_time = time.time()
-        while True:
-            current_time = time.time()
-            if current_time - start_time > MAX11617_TASK_PERIOD: 
-                linpot_bytes = uint16_to_bytes(linpot_value.value)
-                adc1_bytes = uint16_to_bytes(adc1_value.value)
-                adc2_bytes = uint16_to_bytes(adc2_value.value)
-
-                can_data = linpot_bytes + adc1_bytes + adc2_bytes
-
-                with mcp_lock:
-                    mcp.send_message(can_id=ADC_CAN_ID, data=can_data)
-                
-                start_time = current_time  
-            else:
-                time.sleep(TIME_1MS)
-
-    def vl530_task():
-        start_time = time.time()
-        while True:
-            current_time = time.time()
-            if current_time - start_time > VL530_TASK_PERIOD:
-                distance_bytes = uint16_to_bytes(distance_value.value)
+    # the payloads are packed into the bytearray of their message, copied into the TX buffer when queued
+    adc_sender = FreshSender(adc_reading, adc_message, max_age=CAN_MAX_AGE)
+    distance_sender = FreshSender(distance_reading, distance_message, mode=FreshSender.DEADBAND,
+                                  deadband=VL530_DEADBAND, heartbeat=CAN_HEARTBEAT_PERIOD, max_age=CAN_MAX_AGE)
+    avg_temp_sender = FreshSender(avg_temp_reading, avg_temp_message, max_age=CAN_MAX_AGE)
+    zone_senders = [FreshSender(zone_stats_reading, zone_message, fields=slice(3 * i, 3 * i + 3), max_age=CAN_MAX_AGE)
+                    for i, zone_message in enumerate(zone_messages)]
 
-                with mcp_lock:
-                    mcp.send_message(can_id=VL_CAN_ID, data=distance_bytes)
-                
-                start_time = current_time
-            else:
-                time.sleep(TIME_1MS)
+    # one thread sends every periodic message, those due together go out in one TX batch
+    periodic_scheduler = PeriodicScheduler(tx_scheduler)
+    periodic_scheduler.add(adc_message.can_id, MAX11617_TASK_PERIOD / CAN_POLL_DIVIDER, adc_sender.encode)
+    periodic_scheduler.add(distance_message.can_id, VL530_TASK_PERIOD / CAN_POLL_DIVIDER, distance_sender.encode)
+    periodic_scheduler.add(avg_temp_message.can_id, MLX90640_TASK_PERIOD / CAN_POLL_DIVIDER, avg_temp_sender.encode)
+    for zone_message, zone_sender in zip(zone_messages, zone_senders):
+        periodic_scheduler.add(zone_message.can_id, MLX90640_TASK_PERIOD / CAN_POLL_DIVIDER, zone_sender.encode)
 
-    def mlx90640_task():
-        start_time = time.time()    
-        while True:
-            current_time = time.time()
-            if current_time - start_time > MLX90640_TASK_PERIOD:
-                avg_temp_bytes = uint16_to_bytes(avg_temp_value.value)
-
-                with mcp_lock:
-                    mcp.send_message(can_id=MLX_CAN_ID, data=avg_temp_bytes)
-                
-                start_time = current_time
-            else:
-                time.sleep(TIME_1MS)
-                
-    def read_task():
-        while True:
-            with mcp_lock:
-                can_id, can_data, can_length = mcp.read_message()
-            
-            if can_id is not None:
-                if can_id == 0x777 and can_length == 2:
-                    test_id_value.value = (can_data[1] << 8) + can_data[0]
-            
-            time.sleep(TIME_1MS)
-
-
-    mlx90640_thread = Thread(target=mlx90640_task)
-    vl530_thread = Thread(target=vl530_task)
-    max11617_thread = Thread(target=max11617_task)
-    read_thread = Thread(target=read_task)
+    rx_listener = RxListener(mcp, MCP_INT_PIN, dispatcher.dispatch, lock=mcp_lock)
 
-    mlx90640_thread.start()
-    vl530_thread.start()
-    max11617_thread.start()
-    read_thread.start()   
+    periodic_scheduler.start()
+    rx_listener.start()
 
 
 if __name__ == "__main__":
 
-    i2c0_handle = SMBus(0)
+    if "MLX90640_EMULATOR" in os.environ:
+        # Emulated MLX90640, the value is the simulated I2C bus speed [Hz], 0 for instant transfers
+        i2c0_handle = MLX90640Emulator(i2c_addr=MLX90640_ADDRESS, i2c_speed=int(os.getenv("MLX90640_EMULATOR")) or None)
+    else:
+        i2c0_handle = SMBus(0)
 
     i2c1_handle = busio.I2C(board.SCL, board.SDA)
 
@@ -271,22 +327,23 @@ if __name__ == "__main__":
     spi_handle.open(0, 0)
     spi_handle.max_speed_hz = SPI_MAX_SPEED_HZ
 
-    avg_temp_value = Value("i", 0)
-    ir_frame_array = Array("i", 32 * 24)
-    ir_frame_update = Value("b", 0)
+    avg_temp_reading = SensorReading()
+    ir_frame_slot = FrameSlot()
+    zone_stats_reading = SensorReading(3 * len(TIRE_ZONES))
+    mlx_log_ring = RawFrameRing(slots=MLX90640_LOG_RING_SLOTS)
+    eeprom_array = Array("H", RawFrameLog.EEPROM_WORDS)
     
-    distance_value = Value("i", 0)
+    distance_reading = SensorReading()
     
-    linpot_value = Value("i", 0)
-    adc1_value = Value("i", 0)
-    adc2_value = Value("i", 0)
+    # linpot, adc1, adc2
+    adc_reading = SensorReading(3)
     
     test_id_value = Value("i", 0)
 
-    i2c0_process = Process(target=i2c0_process, args=(i2c0_handle, avg_temp_value, ir_frame_update, ir_frame_array, ))
-    i2c1_process = Process(target=i2c1_process, args=(i2c1_handle, distance_value, linpot_value, adc1_value, adc2_value,))
-    can_process = Process(target=can_process, args=(spi_handle, avg_temp_value, distance_value, linpot_value, adc1_value, adc2_value,test_id_value,))
-    log_process = Process(target=log_process, args=(ir_frame_update, ir_frame_array,test_id_value,))
+    i2c0_process = Process(target=i2c0_process, args=(i2c0_handle, avg_temp_reading, ir_frame_slot, zone_stats_reading, mlx_log_ring, eeprom_array, ))
+    i2c1_process = Process(target=i2c1_process, args=(i2c1_handle, distance_reading, adc_reading,))
+    can_process = Process(target=can_process, args=(spi_handle, avg_temp_reading, zone_stats_reading, distance_reading, adc_reading, test_id_value,))
+    log_process = Process(target=log_process, args=(ir_frame_slot, test_id_value, mlx_log_ring, eeprom_array,))
     
     i2c0_process.start()
     i2c1_process.start()
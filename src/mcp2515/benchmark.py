@@ -0,0 +1,185 @@
+"""
+Hardware free benchmark of the MCP2515 driver: two emulated controllers on a virtual bus, the Pi side sending and
+receiving through the driver, the other side standing for the rest of the car.
+
+Run from the src directory:
+
+    python -m mcp2515.benchmark -o bench_can.json
+    python -m mcp2515.benchmark --compare bench_can.json
+
+Every path reports frames per second and, per frame, the SPI transactions (chip select cycles), SPI bytes and GPIO
+writes (chip select toggles) it costs. The bus timing is not simulated, so the frame rates are those of the driver.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+from mcp2515.emulator import FakeGpio, MCP2515Emulator, VirtualCanBus
+from mcp2515.mcp2515 import MCP2515
+from mcp2515.spi_transport import HardwareCsTransport
+from mcp2515.tx_scheduler import TxScheduler
+
+CS_PIN = 5
+INT_PIN = 25
+DATA = [0x11, 0x22, 0x33, 0x44, 0x55, 0x66]
+
+
+def make_setup(hardware_cs):
+    """
+    :param bool hardware_cs: chip select driven by the SPI controller instead of a GPIO
+    :return: tuple (mcp, emulator, gpio, remote emulator), both controllers in normal mode and accepting every frame
+    """
+    bus = VirtualCanBus()
+    gpio = FakeGpio()
+    emulator = MCP2515Emulator(bus, gpio=gpio, int_pin=INT_PIN)
+    remote = MCP2515Emulator(bus)
+    # the other node of the bus, programmed directly: normal mode
+    remote.xfer([0x02, 0x0F, 0x00])
+
+    transport = HardwareCsTransport(emulator) if hardware_cs else None
+    mcp = MCP2515(emulator, cs_pin=None if hardware_cs else CS_PIN, gpio=gpio, transport=transport)
+    mcp.set_config_mode()
+    mcp.enable_filters(0, False)
+    mcp.enable_filters(1, False)
+    mcp.enable_rollover(True)
+    mcp.set_normal_mode()
+    return mcp, emulator, gpio, remote
+
+
+def remote_send(remote, can_id, data):
+    """
+    Frame sent by the other node, straight into its registers (not counted for the Pi)
+    """
+    remote.xfer([0x40] + [(can_id >> 3) & 0xFF, (can_id << 5) & 0xE0, 0, 0, len(data)] + list(data))
+    remote.xfer([0x81])
+    remote.update()
+
+
+def measure(run_frame, emulator, gpio, frames, setup=None):
+    """
+    :param run_frame: processes one frame through the driver
+    :param setup: called before every frame, not timed and not counted
+    :return: dict of the rate and the per frame costs
+    """
+    elapsed = 0.0
+    transactions = 0
+    spi_bytes = 0
+    gpio_writes = 0
+    for _ in range(frames):
+        if setup is not None:
+            setup()
+        before = (emulator.stats["transactions"], emulator.stats["bytes"], gpio.writes)
+        start = time.perf_counter()
+        run_frame()
+        elapsed += time.perf_counter() - start
+        transactions += emulator.stats["transactions"] - before[0]
+        spi_bytes += emulator.stats["bytes"] - before[1]
+        gpio_writes += gpio.writes - before[2]
+    return {
+        "frames": frames,
+        "fps": frames / elapsed,
+        "spi_transactions_per_frame": transactions / frames,
+        "spi_bytes_per_frame": spi_bytes / frames,
+        "gpio_writes_per_frame": gpio_writes / frames,
+    }
+
+
+def benchmark_paths(hardware_cs, frames):
+    results = {}
+
+    mcp, emulator, gpio, remote = make_setup(hardware_cs)
+    results["send_message"] = measure(lambda: mcp.send_message(0x123, DATA), emulator, gpio, frames)
+    results["send_message_wait"] = measure(lambda: mcp.send_message(0x123, DATA, wait=True), emulator, gpio,
+                                           frames)
+
+    buffers = [bytearray(8), bytearray(8)]
+    results["read_message"] = measure(mcp.read_message, emulator, gpio, frames,
+                                      setup=lambda: remote_send(remote, 0x777, [1, 2]))
+    results["read_message_into"] = measure(lambda: mcp.read_message_into(buffers[0]), emulator, gpio, frames,
+                                           setup=lambda: remote_send(remote, 0x777, [1, 2]))
+
+    def two_frames():
+        remote_send(remote, 0x777, [1, 2])
+        remote_send(remote, 0x778, [3, 4])
+    drained = measure(lambda: mcp.read_messages_into(buffers), emulator, gpio, frames, setup=two_frames)
+    # two frames per call
+    drained["fps"] *= 2
+    for key in ("spi_transactions_per_frame", "spi_bytes_per_frame", "gpio_writes_per_frame"):
+        drained[key] /= 2
+    results["read_messages_into_both"] = drained
+
+    # scheduler steps run in this thread, three frames per step like the tire zones
+    scheduler = TxScheduler(mcp)
+
+    def scheduled_frames():
+        for can_id in (0x663, 0x664, 0x665):
+            scheduler.send(can_id, DATA)
+        while scheduler.queue or scheduler.busy():
+            scheduler.service()
+    scheduled = measure(scheduled_frames, emulator, gpio, max(frames // 3, 1))
+    scheduled["frames"] *= 3
+    scheduled["fps"] *= 3
+    for key in ("spi_transactions_per_frame", "spi_bytes_per_frame", "gpio_writes_per_frame"):
+        scheduled[key] /= 3
+    results["tx_scheduler"] = scheduled
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(frames=2000):
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "machine": platform.machine(),
+            "platform": platform.platform(),
+            "frames": frames,
+        },
+        "results": {},
+    }
+    for transport, hardware_cs in (("gpio_cs", False), ("hardware_cs", True)):
+        results["results"][transport] = benchmark_paths(hardware_cs, frames)
+    return results
+
+
+def print_results(results, baseline=None):
+    print("{:<12} {:<26} {:>10} {:>10} {:>10} {:>10} {:>9}".format(
+        "transport", "path", "fps", "spi/frame", "bytes", "gpio", "vs base"))
+    for transport, paths in results["results"].items():
+        for name, result in paths.items():
+            ratio = ""
+            if baseline is not None and name in baseline["results"].get(transport, {}):
+                ratio = "{:.2f}x".format(result["fps"] / baseline["results"][transport][name]["fps"])
+            print("{:<12} {:<26} {:>10.0f} {:>10.2f} {:>10.1f} {:>10.1f} {:>9}".format(
+                transport, name, result["fps"], result["spi_transactions_per_frame"],
+                result["spi_bytes_per_frame"], result["gpio_writes_per_frame"], ratio))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the MCP2515 driver on emulated controllers")
+    parser.add_argument("-o", "--output", help="JSON file receiving the results")
+    parser.add_argument("--frames", type=int, default=2000)
+    parser.add_argument("--compare", help="JSON results of a previous run to compare the frame rates against")
+    args = parser.parse_args()
+
+    results = run(frames=args.frames)
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as file_handle:
+            baseline = json.load(file_handle)
+    print_results(results, baseline)
+
+    if args.output is not None:
+        with open(args.output, "w") as file_handle:
+            json.dump(results, file_handle, indent=2)
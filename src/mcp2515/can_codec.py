@@ -0,0 +1,211 @@
+import json
+import struct
+
+
+class CanSignal:
+    """
+    A signal of a message: raw = (physical - offset) / scale, stored on length bits from start_bit.
+
+    Bits are numbered from the least significant bit of the first byte (bit 0) to the most significant bit of the
+    last one. A little endian signal has its least significant bit at start_bit. A big endian signal must be byte
+    aligned and start_bit is the first bit of its most significant byte.
+    """
+
+    LITTLE_ENDIAN = "little_endian"
+    BIG_ENDIAN = "big_endian"
+
+    def __init__(self, name, start_bit, length, signed=False, scale=1.0, offset=0.0, byte_order=LITTLE_ENDIAN,
+                 unit=""):
+        if byte_order not in (CanSignal.LITTLE_ENDIAN, CanSignal.BIG_ENDIAN):
+            raise ValueError("Signal {}: unknown byte order {}".format(name, byte_order))
+        if byte_order == CanSignal.BIG_ENDIAN and (start_bit % 8 or length % 8):
+            raise ValueError("Signal {}: big endian signals must be byte aligned".format(name))
+        self.name = name
+        self.start_bit = start_bit
+        self.length = length
+        self.signed = signed
+        self.scale = scale
+        self.offset = offset
+        self.byte_order = byte_order
+        self.unit = unit
+        self.mask = (1 << length) - 1
+        self.minimum = -(1 << (length - 1)) if signed else 0
+        self.maximum = (1 << (length - 1)) - 1 if signed else self.mask
+
+    def to_raw(self, value):
+        """
+        :return: the raw value of a physical one, saturated to the range of the signal
+        """
+        raw = int(round((value - self.offset) / self.scale))
+        return min(max(raw, self.minimum), self.maximum)
+
+    def to_physical(self, raw):
+        return raw * self.scale + self.offset
+
+
+class CanMessage:
+    """
+    A message compiled once for its signals: a struct.Struct if every signal is a byte aligned 8, 16, 32 or 64 bit
+    field (or an unsigned field shorter than a byte, alone in it) of the same byte order, a precomputed shift / mask
+    routine otherwise. Both encode into one bytearray owned by the message, reused by every call.
+    """
+
+    STRUCT_FORMATS = {(8, False): "B", (8, True): "b", (16, False): "H", (16, True): "h",
+                      (32, False): "I", (32, True): "i", (64, False): "Q", (64, True): "q"}
+
+    def __init__(self, name, can_id, length, signals):
+        """
+        :param str name: message name
+        :param can_id: 11 bit identifier
+        :param int length: data length code, 0 to 8 bytes
+        :param signals: CanSignal list, in the order of the values of encode / decode
+        """
+        for signal in signals:
+            if signal.start_bit + signal.length > 8 * length:
+                raise ValueError("Signal {} does not fit in the {} bytes of {}".format(signal.name, length, name))
+        self.name = name
+        self.can_id = can_id
+        self.length = length
+        self.signals = signals
+        self.buffer = bytearray(length)
+        self.struct = self.compile_struct()
+        # (index, maximum) of the signals of the struct path packed in a wider field
+        self.narrow_signals = [(index, signal.maximum) for index, signal in enumerate(signals) if signal.length % 8]
+
+    def compile_struct(self):
+        """
+        :return: struct.Struct packing the raw values in signal order, None if the layout needs bit packing
+        """
+        byte_orders = {signal.byte_order for signal in self.signals}
+        if len(byte_orders) > 1:
+            return None
+        fields = []
+        for signal in self.signals:
+            code = CanMessage.STRUCT_FORMATS.get((signal.length, signal.signed))
+            if code is None and signal.length < 8 and not signal.signed:
+                # e.g. a rolling counter: a whole byte whose upper bits stay 0, as no other field may share it
+                code = "B"
+            if code is None or signal.start_bit % 8:
+                return None
+            fields.append((signal.start_bit // 8, (signal.length + 7) // 8, code))
+
+        # the struct takes the values in signal order, so the fields must follow each other in that order
+        fmt = "<" if CanSignal.BIG_ENDIAN not in byte_orders else ">"
+        position = 0
+        for first_byte, size, code in fields:
+            if first_byte < position:
+                return None
+            fmt += "x" * (first_byte - position) + code
+            position = first_byte + size
+        fmt += "x" * (self.length - position)
+        return struct.Struct(fmt)
+
+    def encode_raw(self, *values):
+        """
+        :param values: raw values, one per signal in order, saturated to the range of their signal
+        :return: the payload, the bytearray of the message overwritten by the next call
+        """
+        if self.struct is not None:
+            try:
+                self.struct.pack_into(self.buffer, 0, *values)
+            except struct.error:
+                # out of the range of the field: saturated rather than raised, it would stop the periodic scheduler
+                self.struct.pack_into(self.buffer, 0, *self.saturate(values))
+            else:
+                # a field wider than its signal (rolling counter in a byte) accepts values too large for the signal
+                for index, maximum in self.narrow_signals:
+                    if values[index] > maximum:
+                        self.struct.pack_into(self.buffer, 0, *self.saturate(values))
+                        break
+            return self.buffer
+
+        packed = 0
+        for signal, raw in zip(self.signals, self.saturate(values)):
+            raw &= signal.mask
+            if signal.byte_order == CanSignal.BIG_ENDIAN:
+                raw = int.from_bytes(raw.to_bytes(signal.length // 8, "big"), "little")
+            packed |= raw << signal.start_bit
+        self.buffer[:] = packed.to_bytes(self.length, "little")
+        return self.buffer
+
+    def saturate(self, values):
+        """
+        :return: list of the raw values saturated to the range of their signal
+        """
+        return [min(max(raw, signal.minimum), signal.maximum) for signal, raw in zip(self.signals, values)]
+
+    def encode(self, *values):
+        """
+        :param values: physical values, one per signal in order, saturated to the range of their signal
+        :return: the payload, see encode_raw
+        """
+        return self.encode_raw(*[signal.to_raw(value) for signal, value in zip(self.signals, values)])
+
+    def decode_raw(self, data):
+        """
+        :param data: payload of at least length bytes
+        :return: tuple of the raw values in signal order
+        """
+        if self.struct is not None:
+            return self.struct.unpack_from(data, 0)
+
+        packed = int.from_bytes(bytes(data[:self.length]), "little")
+        values = []
+        for signal in self.signals:
+            raw = (packed >> signal.start_bit) & signal.mask
+            if signal.byte_order == CanSignal.BIG_ENDIAN:
+                raw = int.from_bytes(raw.to_bytes(signal.length // 8, "little"), "big")
+            if signal.signed and raw > signal.maximum:
+                raw -= 1 << signal.length
+            values.append(raw)
+        return tuple(values)
+
+    def decode(self, data):
+        """
+        :return: tuple of the physical values in signal order
+        """
+        return tuple(signal.to_physical(raw) for signal, raw in zip(self.signals, self.decode_raw(data)))
+
+
+class CanCodec:
+    """
+    The messages of a signal definition file, by name and by CAN ID.
+
+    File format (JSON): {"pi_id_stride": 16, "messages": [{"name", "id", "length", "per_pi", "signals": [{"name",
+    "start_bit", "length", "signed", "scale", "offset", "byte_order", "unit"}]}]}. IDs may be written as hex strings,
+    a message with "per_pi" gets pi_id * pi_id_stride added to its ID, so every DAQ Pi sends on its own IDs.
+    """
+
+    def __init__(self, messages):
+        self.messages = {message.name: message for message in messages}
+        self.by_id = {message.can_id: message for message in messages}
+
+    def __getitem__(self, name):
+        return self.messages[name]
+
+    @classmethod
+    def load(cls, path, pi_id=0):
+        """
+        :param str path: signal definition file
+        :param int pi_id: DAQ_PI_ID of this Pi
+        :raises: ValueError - invalid definition
+        """
+        with open(path) as file_handle:
+            definition = json.load(file_handle)
+
+        stride = definition.get("pi_id_stride", 0)
+        messages = []
+        for message in definition["messages"]:
+            can_id = int(message["id"], 0) if isinstance(message["id"], str) else message["id"]
+            if message.get("per_pi", False):
+                can_id += pi_id * stride
+            if not 0 <= can_id <= 0x7FF:
+                raise ValueError("Message {}: CAN ID must be 11 bits".format(message["name"]))
+            signals = [CanSignal(signal["name"], signal["start_bit"], signal["length"],
+                                 signed=signal.get("signed", False), scale=signal.get("scale", 1.0),
+                                 offset=signal.get("offset", 0.0),
+                                 byte_order=signal.get("byte_order", CanSignal.LITTLE_ENDIAN),
+                                 unit=signal.get("unit", ""))
+                       for signal in message["signals"]]
+            messages.append(CanMessage(message["name"], can_id, message["length"], signals))
+        return cls(messages)
@@ -0,0 +1,78 @@
+class CanDispatcher:
+    """
+    Dispatch table of received frames: handlers are registered per standard CAN ID, then compile() builds a table
+    indexed by the ID so dispatching is one list lookup.
+
+    configure() derives the acceptance masks and filters of the MCP2515 from the registered IDs, so the controller
+    only accepts (and raises its interrupt for) the frames that have a handler. Up to six IDs are matched exactly.
+    Beyond that, the mask bits where the IDs differ most are cleared until six filters cover them all, and the few
+    extra IDs the hardware then accepts are counted as unhandled.
+    """
+
+    ID_COUNT = 0x800
+    FILTER_COUNT = 6
+
+    def __init__(self):
+        self.handlers = {}
+        self.table = [None] * CanDispatcher.ID_COUNT
+        self.stats = {"dispatched": 0, "unhandled": 0}
+
+    def register(self, can_id, handler):
+        """
+        :param can_id: 11 bit identifier
+        :param handler: called as handler(data, length) from the receive thread, data is reused for the next frame
+        """
+        if not 0 <= can_id <= 0x7FF:
+            raise ValueError("CAN ID must be 11 bits (0x000 to 0x7FF)")
+        self.handlers[can_id] = handler
+        self.compile()
+
+    def compile(self):
+        self.table = [self.handlers.get(can_id) for can_id in range(CanDispatcher.ID_COUNT)]
+
+    def dispatch(self, can_id, data, length):
+        handler = self.table[can_id]
+        if handler is None:
+            self.stats["unhandled"] += 1
+            return
+        self.stats["dispatched"] += 1
+        handler(data, length)
+
+    def acceptance(self):
+        """
+        :return: tuple (mask, filters): the mask shared by both RX buffers and six filter values
+        """
+        if not self.handlers:
+            raise ValueError("No CAN ID registered")
+        can_ids = sorted(self.handlers)
+        mask = 0x7FF
+        while len({can_id & mask for can_id in can_ids}) > CanDispatcher.FILTER_COUNT:
+            # clear the bit leaving the fewest distinct patterns, the lowest one on a tie
+            mask = min((mask & ~(1 << bit) for bit in range(11) if mask & (1 << bit)),
+                       key=lambda candidate: len({can_id & candidate for can_id in can_ids}))
+        patterns = sorted({can_id & mask for can_id in can_ids})
+        # unused filters repeat a pattern, they must not accept anything else
+        filters = [patterns[index % len(patterns)] for index in range(CanDispatcher.FILTER_COUNT)]
+        return mask, filters
+
+    def accepted_ids(self):
+        """
+        :return: every ID the hardware accepts with the configuration of acceptance()
+        """
+        mask, filters = self.acceptance()
+        return [can_id for can_id in range(CanDispatcher.ID_COUNT) if can_id & mask in filters]
+
+    def configure(self, mcp):
+        """
+        Writes the masks and filters, enables filtering on both RX buffers and the RXB0 to RXB1 rollover
+        :param MCP2515 mcp: controller, in configuration mode
+        """
+        mask, filters = self.acceptance()
+        # RXB0 has filters 0 and 1 behind mask 0, RXB1 filters 2 to 5 behind mask 1
+        mcp.set_acceptance_mask(0, mask)
+        mcp.set_acceptance_mask(1, mask)
+        for filter_id, value in enumerate(filters):
+            mcp.set_acceptance_filter(filter_id, value)
+        mcp.enable_filters(0, True)
+        mcp.enable_filters(1, True)
+        mcp.enable_rollover(True)
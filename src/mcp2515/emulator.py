@@ -0,0 +1,374 @@
+"""
+Register level MCP2515 emulator with the interface of spidev.SpiDev, a fake RPi.GPIO and a virtual CAN bus shared by
+several emulated controllers, to run the driver, the transmit scheduler and the receive listener without hardware.
+
+Benchmark, run from the src directory:
+
+    python -m mcp2515.benchmark
+"""
+import time
+from threading import RLock
+
+from mcp2515.mcp2515 import MCP2515_RESET, MCP2515_READ, MCP2515_WRITE, MCP2515_BIT_MODIFY, MCP2515_READ_STATUS, \
+    MCP2515_LOAD_TX_BUFFER, MCP2515_RTS, MCP2515_READ_RX_BUFFER, MODE_NORMAL, MODE_LOOPBACK, MODE_CONFIG, \
+    TXB0CTRL, TXBCTRL_ABTF, TXBCTRL_MLOA, TXBCTRL_TXERR, TXBCTRL_TXREQ, TXBCTRL_TXP, RXBCTRL_RXM, RXBCTRL_BUKT, \
+    CANINTE, CANINTF, CANINTF_RX0IF, CANINTF_RX1IF, CANINTF_TX0IF, CANINTF_ERRIF, CANINTF_MERRF, EFLG, EFLG_EWARN, \
+    EFLG_TXEP, EFLG_RXOVR
+
+
+class FakeGpio:
+    """
+    The part of RPi.GPIO used by the driver, as an object to pass where the module is expected. Pins read HIGH
+    unless a device drives them (e.g. the INT line of an emulator), a falling edge calls the add_event_detect
+    callback of the pin.
+    """
+
+    BCM = 11
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_UP = 22
+    FALLING = 32
+
+    def __init__(self):
+        self.levels = {}
+        self.callbacks = {}
+        # output calls, i.e. the cost of a GPIO chip select
+        self.writes = 0
+
+    def setwarnings(self, enable):
+        pass
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, pin, direction, pull_up_down=None):
+        self.levels.setdefault(pin, FakeGpio.HIGH)
+
+    def output(self, pin, level):
+        self.writes += 1
+        self.levels[pin] = level
+
+    def input(self, pin):
+        return self.levels.get(pin, FakeGpio.HIGH)
+
+    def add_event_detect(self, pin, edge, callback=None):
+        self.callbacks[pin] = callback
+
+    def remove_event_detect(self, pin):
+        self.callbacks.pop(pin, None)
+
+    def cleanup(self, pin=None):
+        pass
+
+    def drive(self, pin, level):
+        """
+        Sets the level of an input pin from the device side
+        """
+        previous = self.levels.get(pin, FakeGpio.HIGH)
+        self.levels[pin] = level
+        callback = self.callbacks.get(pin)
+        if previous == FakeGpio.HIGH and level == FakeGpio.LOW and callback is not None:
+            callback(pin)
+
+
+class VirtualCanBus:
+    """
+    Frames sent by one controller in normal mode are received by every other controller on the bus, and are only
+    acknowledged if another controller in normal mode is attached. Without a bit rate a frame is on the bus as soon
+    as it is requested, otherwise the bus is busy for the duration of every frame.
+    """
+
+    def __init__(self, bitrate=None, clock=time.monotonic):
+        """
+        :param bitrate: bit rate [bit/s] whose frame durations are simulated, e.g. 250000, None for none
+        :param clock: time source [s]
+        """
+        self.bitrate = bitrate
+        self.clock = clock
+        self.nodes = []
+        self.busy_until = 0.0
+        # held for every SPI transfer of every controller, the deliveries cross controllers
+        self.lock = RLock()
+        self.stats = {"frames": 0, "ack_errors": 0}
+
+    def attach(self, node):
+        self.nodes.append(node)
+
+    def frame_time(self, dlc):
+        # standard frame without stuff bits: 47 bits of overhead and the data
+        return (47 + 8 * dlc) / self.bitrate if self.bitrate else 0.0
+
+    def acknowledged(self, sender):
+        return any(node is not sender and node.mode == MODE_NORMAL for node in self.nodes)
+
+    def transmit(self, sender, can_id, data):
+        self.stats["frames"] += 1
+        for node in self.nodes:
+            if node is not sender:
+                node.receive(can_id, data)
+
+
+class MCP2515Emulator:
+    """
+    Emulates the register map of the MCP2515 behind spidev's xfer / xfer2, one call being one chip select cycle:
+    RESET, READ, WRITE, BIT MODIFY, READ STATUS, LOAD TX BUFFER, RTS and READ RX BUFFER.
+
+    - CANCTRL requests the mode (configuration, normal, loopback, listen only), CANSTAT follows at once, ABAT aborts
+      every pending buffer
+    - TX buffers are sent highest TXP first, then highest buffer number, set TXnIF when done and can be aborted by
+      clearing TXREQ. In normal mode a frame nobody acknowledges sets TXERR / MERRF and is retried, the transmit
+      error counter drives EFLG (warning, error passive) and ERRIF.
+    - Received frames go through the masks and filters (RXM, BUKT rollover), an overflow sets RXnOVR
+    - The INT pin follows CANINTF & CANINTE on a FakeGpio
+    """
+
+    # LOAD TX BUFFER / READ RX BUFFER start addresses
+    TX_LOAD_ADDRESS = [0x31, 0x36, 0x41, 0x46, 0x51, 0x56]
+    RX_READ_ADDRESS = [0x61, 0x66, 0x71, 0x76]
+    FILTER_ADDRESS = [0x00, 0x04, 0x08, 0x10, 0x14, 0x18]
+    MASK_ADDRESS = [0x20, 0x24]
+    RXB_FILTERS = [(0, 1), (2, 3, 4, 5)]
+    CANSTAT = 0x0E
+    CANCTRL = 0x0F
+    CANCTRL_ABAT = 0x10
+    TEC = 0x1C
+
+    def __init__(self, bus=None, gpio=None, int_pin=None):
+        """
+        :param VirtualCanBus bus: bus shared with the other emulated controllers, a new one if None
+        :param FakeGpio gpio: GPIO whose int_pin follows the INT output
+        :param int_pin: pin number of INT on gpio
+        """
+        self.bus = bus if bus is not None else VirtualCanBus()
+        self.bus.attach(self)
+        self.gpio = gpio
+        self.int_pin = int_pin
+        self.max_speed_hz = 10000000
+        self.mode = MODE_CONFIG
+        self.registers = [0] * 0x80
+        # (buffer_id, end time) of the frame on the bus
+        self.transmitting = None
+        self.stats = {"transactions": 0, "bytes": 0, "sent": 0, "received": 0, "overflows": 0}
+        self.reset()
+
+    def open(self, bus, device):
+        pass
+
+    def close(self):
+        pass
+
+    def reset(self):
+        self.registers = [0] * 0x80
+        self.registers[MCP2515Emulator.CANCTRL] = 0x87
+        self.registers[MCP2515Emulator.CANSTAT] = MODE_CONFIG
+        self.mode = MODE_CONFIG
+        self.transmitting = None
+
+    def xfer(self, data):
+        with self.bus.lock:
+            self.stats["transactions"] += 1
+            self.stats["bytes"] += len(data)
+            self.update()
+            result = self.command(list(data))
+            self.update_interrupt()
+            return result
+
+    xfer2 = xfer
+
+    def command(self, data):
+        instruction = data[0]
+        result = [0] * len(data)
+        if instruction == MCP2515_RESET:
+            self.reset()
+        elif instruction == MCP2515_READ:
+            for index in range(2, len(data)):
+                result[index] = self.read_register((data[1] + index - 2) & 0x7F)
+        elif instruction == MCP2515_WRITE:
+            for index in range(2, len(data)):
+                self.write_register((data[1] + index - 2) & 0x7F, data[index])
+        elif instruction == MCP2515_BIT_MODIFY:
+            address, mask, value = data[1:4]
+            self.write_register(address, (self.read_register(address) & ~mask) | (value & mask))
+        elif instruction == MCP2515_READ_STATUS:
+            result[1:] = [self.read_status()] * (len(data) - 1)
+        elif instruction & 0xF8 == MCP2515_LOAD_TX_BUFFER and instruction & 0x07 < 6:
+            start = MCP2515Emulator.TX_LOAD_ADDRESS[instruction & 0x07]
+            for index in range(1, len(data)):
+                self.registers[(start + index - 1) & 0x7F] = data[index] & 0xFF
+        elif instruction & 0xF8 == MCP2515_RTS:
+            for buffer_id in range(3):
+                if instruction & (1 << buffer_id):
+                    self.write_register(TXB0CTRL + 0x10 * buffer_id, self.registers[TXB0CTRL + 0x10 * buffer_id] |
+                                        TXBCTRL_TXREQ)
+        elif instruction & 0xF9 == MCP2515_READ_RX_BUFFER:
+            start = MCP2515Emulator.RX_READ_ADDRESS[(instruction >> 1) & 0x03]
+            for index in range(1, len(data)):
+                result[index] = self.registers[(start + index - 1) & 0x7F]
+            # RXnIF is cleared when chip select goes high
+            self.registers[CANINTF] &= ~(CANINTF_RX1IF if instruction & 0x04 else CANINTF_RX0IF)
+        return result
+
+    def read_register(self, address):
+        # CANSTAT and CANCTRL are mirrored at the end of every row
+        if address & 0x0F in (MCP2515Emulator.CANSTAT, MCP2515Emulator.CANCTRL):
+            address &= 0x0F
+        return self.registers[address]
+
+    def write_register(self, address, value):
+        value &= 0xFF
+        if address & 0x0F == MCP2515Emulator.CANCTRL:
+            self.registers[MCP2515Emulator.CANCTRL] = value
+            self.mode = value & 0xE0
+            self.registers[MCP2515Emulator.CANSTAT] = self.mode
+            if value & MCP2515Emulator.CANCTRL_ABAT:
+                for buffer_id in range(3):
+                    self.abort(buffer_id)
+        elif address & 0x0F == MCP2515Emulator.CANSTAT or address in (MCP2515Emulator.TEC,
+                                                                      MCP2515Emulator.TEC + 1):
+            pass
+        elif address in (TXB0CTRL, TXB0CTRL + 0x10, TXB0CTRL + 0x20):
+            control = self.registers[address]
+            writable = TXBCTRL_TXREQ | TXBCTRL_TXP
+            new_control = (control & ~writable) | (value & writable)
+            if new_control & TXBCTRL_TXREQ and not control & TXBCTRL_TXREQ:
+                new_control &= ~(TXBCTRL_ABTF | TXBCTRL_MLOA | TXBCTRL_TXERR)
+            self.registers[address] = new_control
+            if control & TXBCTRL_TXREQ and not new_control & TXBCTRL_TXREQ:
+                # the frame already on the bus is still completed
+                self.registers[address] |= TXBCTRL_TXREQ
+                self.abort((address - TXB0CTRL) >> 4)
+        elif address == EFLG:
+            # only the overflow flags can be cleared
+            self.registers[EFLG] &= value | ~EFLG_RXOVR
+        else:
+            self.registers[address] = value
+
+    def read_status(self):
+        flags = self.registers[CANINTF]
+        status = flags & (CANINTF_RX0IF | CANINTF_RX1IF)
+        for buffer_id in range(3):
+            if self.registers[TXB0CTRL + 0x10 * buffer_id] & TXBCTRL_TXREQ:
+                status |= 0x04 << (2 * buffer_id)
+            if flags & (CANINTF_TX0IF << buffer_id):
+                status |= 0x08 << (2 * buffer_id)
+        return status
+
+    def abort(self, buffer_id):
+        address = TXB0CTRL + 0x10 * buffer_id
+        if self.transmitting is not None and self.transmitting[0] == buffer_id:
+            return
+        if self.registers[address] & TXBCTRL_TXREQ:
+            self.registers[address] = (self.registers[address] & ~TXBCTRL_TXREQ) | TXBCTRL_ABTF
+
+    def update_interrupt(self):
+        if self.gpio is not None:
+            active = self.registers[CANINTF] & self.registers[CANINTE]
+            self.gpio.drive(self.int_pin, self.gpio.LOW if active else self.gpio.HIGH)
+
+    def read_id(self, address):
+        return (self.registers[address] << 3) | (self.registers[address + 1] >> 5)
+
+    def update(self):
+        """
+        Completes the frame on the bus when its time has come and starts the next pending one
+        """
+        if self.mode not in (MODE_NORMAL, MODE_LOOPBACK):
+            return
+        while True:
+            now = self.bus.clock()
+            if self.transmitting is not None:
+                buffer_id, end_time = self.transmitting
+                if now < end_time:
+                    return
+                self.transmitting = None
+                self.complete(buffer_id)
+            pending = [buffer_id for buffer_id in range(3)
+                       if self.registers[TXB0CTRL + 0x10 * buffer_id] & TXBCTRL_TXREQ]
+            if not pending or now < self.bus.busy_until:
+                return
+            buffer_id = max(pending, key=lambda n: (self.registers[TXB0CTRL + 0x10 * n] & TXBCTRL_TXP, n))
+            dlc = self.registers[TXB0CTRL + 0x10 * buffer_id + 5] & 0x0F
+            end_time = now + self.bus.frame_time(dlc)
+            self.bus.busy_until = end_time
+            self.transmitting = (buffer_id, end_time)
+            if self.mode == MODE_NORMAL and not self.bus.acknowledged(self):
+                # nobody acknowledges: error frame, the controller retries on the next update
+                self.transmitting = None
+                self.ack_error(buffer_id)
+                return
+
+    def complete(self, buffer_id):
+        base = TXB0CTRL + 0x10 * buffer_id
+        can_id = self.read_id(base + 1)
+        data = self.registers[base + 6:base + 6 + min(self.registers[base + 5] & 0x0F, 8)]
+        self.registers[base] &= ~(TXBCTRL_TXREQ | TXBCTRL_TXERR | TXBCTRL_MLOA)
+        self.registers[CANINTF] |= CANINTF_TX0IF << buffer_id
+        self.registers[MCP2515Emulator.TEC] = max(self.registers[MCP2515Emulator.TEC] - 1, 0)
+        self.update_error_flags()
+        self.stats["sent"] += 1
+        if self.mode == MODE_LOOPBACK:
+            self.receive(can_id, data)
+        else:
+            self.bus.transmit(self, can_id, data)
+
+    def ack_error(self, buffer_id):
+        self.bus.stats["ack_errors"] += 1
+        self.registers[TXB0CTRL + 0x10 * buffer_id] |= TXBCTRL_TXERR
+        self.registers[CANINTF] |= CANINTF_MERRF
+        # an error passive transmitter does not count acknowledgement errors any further
+        self.registers[MCP2515Emulator.TEC] = min(self.registers[MCP2515Emulator.TEC] + 8, 128)
+        self.update_error_flags()
+
+    def update_error_flags(self):
+        tec = self.registers[MCP2515Emulator.TEC]
+        flags = self.registers[EFLG] & EFLG_RXOVR
+        if tec >= 96:
+            # EWARN, TXWAR
+            flags |= EFLG_EWARN | 0x04
+        if tec >= 128:
+            flags |= EFLG_TXEP
+        if flags & ~EFLG_RXOVR != self.registers[EFLG] & ~EFLG_RXOVR:
+            self.registers[CANINTF] |= CANINTF_ERRIF
+        self.registers[EFLG] = flags
+
+    def accepts(self, buffer_id, can_id):
+        if self.registers[0x60 + 0x10 * buffer_id] & RXBCTRL_RXM == RXBCTRL_RXM:
+            return True
+        mask = self.read_id(MCP2515Emulator.MASK_ADDRESS[buffer_id])
+        return any((can_id ^ self.read_id(MCP2515Emulator.FILTER_ADDRESS[filter_id])) & mask == 0
+                   for filter_id in MCP2515Emulator.RXB_FILTERS[buffer_id])
+
+    def receive(self, can_id, data):
+        """
+        A frame on the bus, stored in RXB0 or RXB1 if the masks and filters accept it
+        """
+        if self.mode == MODE_CONFIG:
+            return
+        flags = self.registers[CANINTF]
+        if self.accepts(0, can_id):
+            if not flags & CANINTF_RX0IF:
+                self.store(0, can_id, data)
+            elif self.registers[0x60] & RXBCTRL_BUKT and not flags & CANINTF_RX1IF:
+                self.store(1, can_id, data)
+            else:
+                self.overflow(0)
+        elif self.accepts(1, can_id):
+            if not flags & CANINTF_RX1IF:
+                self.store(1, can_id, data)
+            else:
+                self.overflow(1)
+        self.update_interrupt()
+
+    def store(self, buffer_id, can_id, data):
+        base = 0x60 + 0x10 * buffer_id
+        self.registers[base + 1:base + 6] = [(can_id >> 3) & 0xFF, (can_id << 5) & 0xE0, 0, 0, len(data)]
+        self.registers[base + 6:base + 6 + len(data)] = list(data)
+        self.registers[CANINTF] |= CANINTF_RX0IF << buffer_id
+        self.stats["received"] += 1
+
+    def overflow(self, buffer_id):
+        self.registers[EFLG] |= 0x40 << buffer_id
+        self.registers[CANINTF] |= CANINTF_ERRIF
+        self.stats["overflows"] += 1
@@ -0,0 +1,162 @@
+import time
+from multiprocessing import Lock, RawArray, RawValue
+
+
+class SensorReading:
+    """
+    Latest reading of a sensor shared between its producer process and the CAN process, published with a sequence
+    number and the acquisition time so the consumer knows whether it has already seen it and how old it is.
+
+    The values, sequence number and timestamp are written and read together under one lock, so a reader never
+    mixes two readings.
+    """
+
+    def __init__(self, count=1, typecode="i"):
+        """
+        :param int count: number of values of a reading
+        :param str typecode: array type code of the values
+        """
+        self.count = count
+        self.lock = Lock()
+        self.values = RawArray(typecode, count)
+        # 0 until the first reading
+        self.sequence = RawValue("Q", 0)
+        # acquisition time [s], time.time() like the frame ring timestamps
+        self.timestamp = RawValue("d", 0.0)
+
+    def publish(self, values, timestamp=None):
+        """
+        Producer: stores a new reading
+        :param values: count values
+        :param float timestamp: acquisition time [s], now by default
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            self.values[:] = values
+            self.timestamp.value = timestamp
+            self.sequence.value += 1
+
+    def read(self):
+        """
+        :return: tuple (sequence, timestamp, list of the values) of the latest reading, sequence 0 if none yet
+        """
+        with self.lock:
+            return self.sequence.value, self.timestamp.value, self.values[:]
+
+
+class FreshSender:
+    """
+    Encode function of a periodic message sending a SensorReading only when it is worth it, instead of every tick:
+
+    - ON_NEW_DATA: every reading not sent yet
+    - MAX_RATE: the latest new reading, at most once per min_interval
+    - DEADBAND: a new reading differing from the last sent one by more than deadband in one of its values
+
+    With a heartbeat, the latest reading is sent again after heartbeat seconds without a send, so the receiver can
+    tell a quiet sensor from a dead one. Readings older than max_age are never sent.
+
+    The last signal of the message is a 2 bit rolling counter incremented for every new reading sent, the receiving
+    ECU detects dropped readings by its gaps. A heartbeat repeats the counter of the reading it resends, so it is
+    seen as a duplicate rather than as new data.
+    """
+
+    ON_NEW_DATA = "on_new_data"
+    MAX_RATE = "max_rate"
+    DEADBAND = "deadband"
+
+    COUNTER_MASK = 0x03
+
+    def __init__(self, reading, message, mode=ON_NEW_DATA, fields=None, min_interval=0.0, deadband=0,
+                 heartbeat=None, max_age=None, clock=time.time):
+        """
+        :param SensorReading reading: source of the values
+        :param CanMessage message: signals of the values followed by the counter signal
+        :param mode: ON_NEW_DATA, MAX_RATE or DEADBAND
+        :param slice fields: values of the reading sent in this message, all by default
+        :param float min_interval: MAX_RATE: minimum time between two sends [s]
+        :param deadband: DEADBAND: change of a raw value needed to send
+        :param float heartbeat: resend period of an unchanged reading [s], None to never resend
+        :param float max_age: age above which a reading is not sent [s], None for no limit
+        :param clock: time source [s], the one of the reading timestamps
+        """
+        if mode not in (FreshSender.ON_NEW_DATA, FreshSender.MAX_RATE, FreshSender.DEADBAND):
+            raise ValueError("Unknown send mode {}".format(mode))
+        self.reading = reading
+        self.message = message
+        self.mode = mode
+        self.fields = fields if fields is not None else slice(None)
+        self.min_interval = min_interval
+        self.deadband = deadband
+        self.heartbeat = heartbeat
+        self.max_age = max_age
+        self.clock = clock
+
+        self.counter = 0
+        # sequence of the latest reading seen by a tick and of the latest one sent
+        self.seen_sequence = 0
+        self.sent_sequence = 0
+        self.last_values = None
+        self.last_send_time = None
+        self.stats = {
+            "sent": 0,
+            "heartbeats": 0,
+            # ticks without a new reading
+            "unchanged": 0,
+            # ticks holding a new reading back for the rate limit or the deadband
+            "suppressed": 0,
+            # readings overwritten by the producer before a tick saw them
+            "superseded": 0,
+            "stale": 0,
+        }
+
+    def encode(self):
+        """
+        :return: the payload to send, or None to skip this tick (PeriodicScheduler encode function)
+        """
+        sequence, timestamp, values = self.reading.read()
+        if sequence == 0:
+            return None
+        now = self.clock()
+        if self.max_age is not None and now - timestamp > self.max_age:
+            self.stats["stale"] += 1
+            return None
+
+        values = values[self.fields]
+        heartbeat_due = self.heartbeat is not None and self.last_send_time is not None and \
+            now - self.last_send_time >= self.heartbeat
+
+        if sequence != self.seen_sequence:
+            if self.seen_sequence:
+                self.stats["superseded"] += max(sequence - self.seen_sequence - 1, 0)
+            self.seen_sequence = sequence
+
+        if sequence == self.sent_sequence:
+            if not heartbeat_due:
+                self.stats["unchanged"] += 1
+                return None
+            self.stats["heartbeats"] += 1
+        elif not heartbeat_due and not self.worth_sending(values, now):
+            # stays pending: sent once the rate limit allows it or a later reading leaves the deadband
+            self.stats["suppressed"] += 1
+            return None
+
+        if sequence != self.sent_sequence:
+            self.sent_sequence = sequence
+            self.counter = (self.counter + 1) & FreshSender.COUNTER_MASK
+        self.last_values = values
+        self.last_send_time = now
+        self.stats["sent"] += 1
+        return self.message.encode_raw(*values, self.counter)
+
+    def worth_sending(self, values, now):
+        """
+        :return: whether a new reading is sent under the mode of the sender
+        """
+        if self.last_send_time is None:
+            return True
+        if self.mode == FreshSender.MAX_RATE:
+            return now - self.last_send_time >= self.min_interval
+        if self.mode == FreshSender.DEADBAND:
+            return any(abs(value - last) > self.deadband for value, last in zip(values, self.last_values))
+        return True
@@ -1,10 +1,21 @@
-import spidev  # type: ignore
-import RPi.GPIO as GPIO  # type: ignore
+# pylint: disable=import-error
+# Off the Pi these are missing, pass the fakes of mcp2515/emulator.py instead
+try:
+    import spidev  # type: ignore
+except ImportError:
+    spidev = None
+try:
+    import RPi.GPIO as GPIO  # type: ignore
+except ImportError:
+    GPIO = None
+# pylint: enable=import-error
 import time
 from threading import Thread
-# pylint: enable=import-error
 
-GPIO.setwarnings(False)  # Disable GPIO warnings
+from mcp2515.spi_transport import GpioCsTransport, HardwareCsTransport
+
+if GPIO is not None:
+    GPIO.setwarnings(False)  # Disable GPIO warnings
 
 # MCP2515 Registers and Commands
 MCP2515_RESET = 0xC0
@@ -12,6 +23,47 @@ MCP2515_READ = 0x03
 MCP2515_WRITE = 0x02
 MCP2515_BIT_MODIFY = 0x05
 MCP2515_READ_STATUS = 0xA0
+MCP2515_LOAD_TX_BUFFER = 0x40  # TXB0SIDH, | 0x02 for TXB1, | 0x04 for TXB2
+MCP2515_RTS = 0x80  # | 1 << buffer
+MCP2515_READ_RX_BUFFER = 0x90  # RXB0SIDH, | 0x04 for RXB1SIDH
+
+# READ STATUS bits, TXnREQ and TXnIF of TXB1 and TXB2 are 2 and 4 bits higher than those of TXB0
+STATUS_RX0IF = 0x01
+STATUS_RX1IF = 0x02
+STATUS_TX0REQ = 0x04
+STATUS_TX0IF = 0x08
+
+# TXBnCTRL of TXB0, + 0x10 per buffer
+TXB0CTRL = 0x30
+TXBCTRL_ABTF = 0x40
+TXBCTRL_MLOA = 0x20
+TXBCTRL_TXERR = 0x10
+TXBCTRL_TXREQ = 0x08
+TXBCTRL_TXP = 0x03
+
+# RXBnCTRL
+RXBCTRL_RXM = 0x60
+RXBCTRL_BUKT = 0x04
+
+# CANINTE / CANINTF, RXnIE / RXnIF is bit n, TXnIE / TXnIF is bit 2 + n
+CANINTE = 0x2B
+CANINTF = 0x2C
+CANINTF_RX0IF = 0x01
+CANINTF_RX1IF = 0x02
+CANINTF_TX0IF = 0x04
+CANINTF_ERRIF = 0x20
+CANINTF_MERRF = 0x80
+
+# EFLG, right after CANINTF
+EFLG = 0x2D
+EFLG_EWARN = 0x01
+EFLG_RXEP = 0x08
+EFLG_TXEP = 0x10
+EFLG_TXBO = 0x20
+EFLG_RXOVR = 0xC0
+
+# Interval of the TXREQ polls while waiting for a frame to go out, a frame takes about 0.5 ms at 250 kbit/s
+TX_POLL_PERIOD = 0.0002
 
 # MCP2515 CANCTRL Register Values
 MODE_NORMAL = 0x00
@@ -20,15 +72,30 @@ MODE_CONFIG = 0x80
 
 class MCP2515:
        
-    def __init__(self, spi_handle, cs_pin=5, retries=3, timeout=1.0):
+    def __init__(self, spi_handle, cs_pin=5, retries=3, timeout=1.0, gpio=GPIO, transport=None):
+        """
+        :param spi_handle: opened spidev.SpiDev, or anything with its xfer / xfer2
+        :param cs_pin: BCM number of the chip select pin driven from GPIO, None if CS is wired to CE0/CE1 and
+                       driven by the SPI controller
+        :param gpio: RPi.GPIO or a module with the same interface, e.g. a fake one for tests
+        :param transport: SPI transport replacing the one chosen from cs_pin
+        """
         self.spi = spi_handle
         self.cs_pin = cs_pin
+        self.gpio = gpio
+        if transport is not None:
+            self.transport = transport
+        elif cs_pin is None:
+            self.transport = HardwareCsTransport(spi_handle)
+        else:
+            self.transport = GpioCsTransport(spi_handle, cs_pin, gpio)
         self.retries = retries
         self.timeout = timeout
+        # a frame was requested in TXB0 and its completion has not been checked yet
+        self.tx_pending = False
+        # READ RX BUFFER burst: instruction, then SIDH, SIDL, EID8, EID0, DLC and 8 data bytes clocked out
+        self.rx_burst = [MCP2515_READ_RX_BUFFER] + [0x00] * 13
 
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(cs_pin, GPIO.OUT)
-        GPIO.output(cs_pin, GPIO.HIGH)
         self.reset()
         self.configure_baud_rate()
         
@@ -53,9 +120,7 @@ class MCP2515:
 
     def configure_baud_rate(self):
         # Set the baud rate to 250000 in configuration registers
-        self.write_register(0x2A, 0x00)
-        self.write_register(0x29, 0xB1)
-        self.write_register(0x28, 0x05)
+        self.write_registers([(0x2A, 0x00), (0x29, 0xB1), (0x28, 0x05)])
 
     def retry_operation(self, operation, *args, **kwargs):
         last_exception = None
@@ -73,36 +138,41 @@ class MCP2515:
 
     def reset(self):
         def _reset():
-            GPIO.output(self.cs_pin, GPIO.LOW)
-            self.spi.xfer([MCP2515_RESET])
-            GPIO.output(self.cs_pin, GPIO.HIGH)
+            self.transport.transfer([MCP2515_RESET])
             time.sleep(0.1)  # Wait for the reset to complete
 
         self.retry_operation(_reset)
 
     def read_register(self, address):
         def _read_register(address):
-            GPIO.output(self.cs_pin, GPIO.LOW)
-            self.spi.xfer([MCP2515_READ, address])
-            result = self.spi.xfer([0x00])[0]
-            GPIO.output(self.cs_pin, GPIO.HIGH)
-            return result
+            return self.transport.transfer([MCP2515_READ, address, 0x00])[2]
 
         return self.retry_operation(_read_register, address)
 
     def write_register(self, address, value):
         def _write_register(address, value):
-            GPIO.output(self.cs_pin, GPIO.LOW)
-            self.spi.xfer([MCP2515_WRITE, address, value])
-            GPIO.output(self.cs_pin, GPIO.HIGH)
+            self.transport.transfer([MCP2515_WRITE, address, value])
 
         self.retry_operation(_write_register, address, value)
 
+    def write_registers(self, values):
+        """
+        Writes several registers in one batch, i.e. one ioctl with the hardware chip select
+        :param values: list of (address, value)
+        """
+        self.batch([[MCP2515_WRITE, address, value] for address, value in values])
+
+    def batch(self, transfers):
+        """
+        Runs several commands, each in its own chip select cycle, as one batch of the transport
+        :param transfers: list of command byte lists
+        :return: list of the received byte lists
+        """
+        return self.retry_operation(self.transport.transfer_batch, transfers)
+
     def bit_modify(self, address, mask, value):
         def _bit_modify(address, mask, value):
-            GPIO.output(self.cs_pin, GPIO.LOW)
-            self.spi.xfer([MCP2515_BIT_MODIFY, address, mask, value])
-            GPIO.output(self.cs_pin, GPIO.HIGH)
+            self.transport.transfer([MCP2515_BIT_MODIFY, address, mask, value])
 
         self.retry_operation(_bit_modify, address, mask, value)
 
@@ -128,102 +198,215 @@ class MCP2515:
 
     def read_status(self):
         def _read_status():
-            GPIO.output(self.cs_pin, GPIO.LOW)
-            status = self.spi.xfer([MCP2515_READ_STATUS, 0x00])[1]
-            GPIO.output(self.cs_pin, GPIO.HIGH)
+            status = self.transport.transfer([MCP2515_READ_STATUS, 0x00])[1]
             return status
 
         return self.retry_operation(_read_status)
 
-    def send_message(self, can_id, data, timeout=0.2):
+    def read_status_and_flags(self):
+        """
+        READ STATUS, then CANINTF and EFLG with one sequential READ, in one batch
+        :return: tuple (status, canintf, eflg)
+        """
+        status, flags = self.batch([[MCP2515_READ_STATUS, 0x00], [MCP2515_READ, CANINTF, 0x00, 0x00]])
+        return status[1], flags[2], flags[3]
+
+    @staticmethod
+    def load_tx_buffer_command(buffer_id, can_id, data):
+        """
+        :return: the LOAD TX BUFFER burst writing ID, DLC and data of a standard frame into a TX buffer
+        """
+        sid_high = (can_id >> 3) & 0xFF  # Higher 8 bits of CAN ID
+        sid_low = (can_id << 5) & 0xE0   # Lower 3 bits of CAN ID
+
+        # SIDH, SIDL, EID8, EID0, DLC, data
+        return [MCP2515_LOAD_TX_BUFFER | (buffer_id << 1), sid_high, sid_low, 0x00, 0x00, len(data)] + list(data)
+
+    @staticmethod
+    def request_to_send_command(buffer_mask):
+        """
+        :return: the RTS instruction setting TXREQ of the TX buffers in buffer_mask (bit n for TXBn)
+        """
+        return [MCP2515_RTS | buffer_mask]
+
+    @staticmethod
+    def tx_priority_command(buffer_id, priority):
+        """
+        :param priority: 0 (lowest) to 3 (highest), pending buffers with a higher TXP are sent first
+        :return: the BIT MODIFY setting the TXP bits of a TX buffer
+        """
+        return [MCP2515_BIT_MODIFY, TXB0CTRL + 0x10 * buffer_id, TXBCTRL_TXP, priority]
+
+    def load_tx_buffer(self, buffer_id, can_id, data):
+        """
+        Writes ID, DLC and data of a standard frame into a TX buffer with one LOAD TX BUFFER burst
+        """
+        self.retry_operation(self.transport.transfer, MCP2515.load_tx_buffer_command(buffer_id, can_id, data))
+
+    def request_to_send(self, buffer_mask):
+        """
+        Sets TXREQ of the TX buffers in buffer_mask (bit n for TXBn) with one RTS instruction
+        """
+        self.retry_operation(self.transport.transfer, MCP2515.request_to_send_command(buffer_mask))
+
+    def set_tx_priority(self, buffer_id, priority):
+        """
+        Sets the TXP bits of a TX buffer
+        """
+        self.retry_operation(self.transport.transfer, MCP2515.tx_priority_command(buffer_id, priority))
+
+    def abort_tx_buffer(self, buffer_id):
+        """
+        Clears TXREQ of one TX buffer, a frame already being transmitted is still completed
+        """
+        self.bit_modify(TXB0CTRL + 0x10 * buffer_id, TXBCTRL_TXREQ, 0x00)
+
+    def enable_interrupts(self, interrupts):
+        """
+        Sets CANINTE, the INT pin goes low while one of these CANINTF flags is set
+        :param interrupts: mask of the CANINTF bits, e.g. CANINTF_RX0IF | CANINTF_RX1IF
+        """
+        self.write_register(CANINTE, interrupts)
+
+    def clear_interrupt_flags(self, flags):
+        """
+        :param flags: mask of the CANINTF bits to clear
+        """
+        self.bit_modify(CANINTF, flags, 0x00)
+
+    def wait_tx_complete(self, timeout=0.2):
+        """
+        Waits until the frame in TXB0 is sent and clears its TX0IF flag, aborts it after timeout
+        :return: True if it was sent, False if it was aborted
+        """
+        start_time = time.time()
+        while self.read_status() & STATUS_TX0REQ:
+            if time.time() - start_time > timeout:
+                # Abort the transmission if it's taking too long, TXB1 and TXB2 are left alone (no ABAT)
+                self.abort_tx_buffer(0)
+                self.tx_pending = False
+                return False
+            time.sleep(TX_POLL_PERIOD)
+
+        # Clear TX0IF, a stale flag would be taken for a later frame by anything checking CANINTF (TxScheduler)
+        self.bit_modify(CANINTF, CANINTF_TX0IF, 0x00)
+        self.tx_pending = False
+        return True
+
+    def send_message(self, can_id, data, timeout=0.2, wait=False):
+        """
+        Sends a standard frame from TXB0: one LOAD TX BUFFER and one RTS, i.e. two chip-select cycles. The
+        completion of a frame is checked before the next one is loaded, with a single READ STATUS. Its TX0IF is
+        left set unless waiting, a TxScheduler clears it when it is created.
+        :param can_id: 11 bit identifier
+        :param data: up to 8 bytes
+        :param timeout: seconds before a frame that can not be sent is aborted
+        :param wait: wait until the frame is sent and clear its TX0IF, instead of returning right after the request
+        :return: True if the frame was sent (or requested when not waiting), False if it was aborted
+        """
         if not 0 <= can_id <= 0x7FF:
             raise ValueError("CAN ID must be 11 bits (0x000 to 0x7FF)")
         if len(data) > 8:
             raise ValueError("CAN data length must be 8 bytes or less")
 
-        def _send_message(can_id, data):
-            # Load TX buffer with CAN ID (11 bits)
-            sid_high = (can_id >> 3) & 0xFF  # Higher 8 bits of CAN ID
-            sid_low = (can_id << 5) & 0xE0   # Lower 3 bits of CAN ID
-
-            # Set the standard identifier (SID) registers
-            self.write_register(0x31, sid_high)  # TXB0SIDH
-            self.write_register(0x32, sid_low)   # TXB0SIDL
-
-            # Set the Data Length Code (DLC)
-            dlc = len(data)
-            self.write_register(0x35, dlc)  # TXB0DLC
-
-            # Load data into the TX buffer
-            for i, value in enumerate(data):
-                self.write_register(0x36 + i, value)
+        # TXB0 must not be written while the previous frame is still pending
+        if self.tx_pending and self.read_status() & STATUS_TX0REQ:
+            self.wait_tx_complete(timeout)
 
-            # Request to send
-            # Set TXREQ to start transmission
-            self.bit_modify(0x30, 0x08, 0x08)
+        self.load_tx_buffer(0, can_id, data)
+        self.request_to_send(0x01)
+        self.tx_pending = True
 
-        self.retry_operation(_send_message, can_id, data)
-
-        # Wait for transmission to complete
-        start_time = time.time()
-        while self.read_register(0x30) & 0x08:  # TXB0CTRL - TXREQ bit
-            if time.time() - start_time > timeout:
-                # Abort the transmission if it's taking too long
-                # ABAT bit in CANCTRL register
-                self.bit_modify(0x0F, 0x10, 0x10)
-                return False    
-            time.sleep(0.01)  # Small delay to prevent busy-waiting
-
-        # Clear TX interrupt flag
-        self.bit_modify(0x2C, 0x1C, 0x00)  # Clear TXnIF flags
+        if wait:
+            return self.wait_tx_complete(timeout)
         return True
 
-    def read_message(self):
+    def read_message_into(self, data):
+        """
+        Reads the next received frame, RXB0 first, with one READ STATUS and one READ RX BUFFER burst. The burst
+        clears the RXnIF flag of the buffer when chip select goes high.
+        :param data: writable buffer of at least 8 bytes receiving the data bytes, reused by the caller
+        :return: tuple (can_id, length), (None, 0) if no frame was received
+        """
         status = self.read_status()
-        if status & 0x01:  # Check if RX0IF is set
-            try:
-                id_high = self.read_register(0x61)
-                id_low = self.read_register(0x62)
-                length = self.read_register(0x65) & 0x0F
-                data = []
-                for i in range(length):
-                    data.append(self.read_register(0x66 + i))
-                self.bit_modify(0x2C, 0x01, 0x00)  # Clear RX0IF
-                return (id_high << 3) | (id_low >> 5), data, length
-            except Exception as e:
-                raise RuntimeError(
-                    f"Failed to read CAN message: {e}") from e
-        return None, None, None
-    
+        if status & STATUS_RX0IF:
+            return self.read_rx_buffer_into(0, data)
+        if status & STATUS_RX1IF:
+            return self.read_rx_buffer_into(1, data)
+        return None, 0
+
+    def read_messages_into(self, buffers):
+        """
+        Drains both RX buffers with one READ STATUS and one READ RX BUFFER burst per full buffer. RXB0 is read first,
+        with rollover it holds the older frame.
+        :param buffers: two writable buffers of at least 8 bytes, for the frames of RXB0 and RXB1
+        :return: list of (can_id, data, length) of the frames read, data being one of buffers
+        """
+        status = self.read_status()
+        messages = []
+        for buffer_id, flag in enumerate((STATUS_RX0IF, STATUS_RX1IF)):
+            if status & flag:
+                can_id, length = self.read_rx_buffer_into(buffer_id, buffers[buffer_id])
+                messages.append((can_id, buffers[buffer_id], length))
+        return messages
+
+    def read_rx_buffer_into(self, buffer_id, data):
+        """
+        Reads a received frame with one READ RX BUFFER burst, which clears RXnIF when chip select goes high
+        :return: tuple (can_id, length)
+        """
+        self.rx_burst[0] = MCP2515_READ_RX_BUFFER | (buffer_id << 2)
+        try:
+            frame = self.retry_operation(self.transport.transfer, self.rx_burst)
+        except Exception as e:
+            raise RuntimeError(
+                f"Failed to read CAN message: {e}") from e
+
+        length = min(frame[5] & 0x0F, 8)
+        data[:length] = frame[6:6 + length]
+        return (frame[1] << 3) | (frame[2] >> 5), length
+
+    def read_message(self):
+        data = bytearray(8)
+        can_id, length = self.read_message_into(data)
+        if can_id is None:
+            return None, None, None
+        return can_id, list(data[:length]), length
+
     def set_acceptance_filter(self, filter_id, filter_value):
         filter_high = self.FILTER_MAP[filter_id]
         filter_low = filter_high + 1
         
-        self.write_register(filter_high, filter_value >> 3)
-        self.write_register(filter_low, filter_value << 5)
+        self.write_register(filter_high, (filter_value >> 3) & 0xFF)
+        self.write_register(filter_low, (filter_value << 5) & 0xE0)
         
     def set_acceptance_mask(self, mask_id, mask_value):
         mask_high = self.MASK_MAP[mask_id]
         mask_low = mask_high + 1
         
-        self.write_register(mask_high, mask_value >> 3)
-        self.write_register(mask_low, mask_value << 5)
+        self.write_register(mask_high, (mask_value >> 3) & 0xFF)
+        self.write_register(mask_low, (mask_value << 5) & 0xE0)
         
     def enable_filters(self, buffer_id, enable):
         ctrl_register = self.CTRL_MAP[buffer_id]
         
+        # RXM bits only, BUKT is left as it is
         if enable:
-            self.write_register(ctrl_register, 0x00)
+            self.bit_modify(ctrl_register, RXBCTRL_RXM, 0x00)
         else:
-            self.write_register(ctrl_register, 0x60)
-            
+            self.bit_modify(ctrl_register, RXBCTRL_RXM, 0x60)
+
+    def enable_rollover(self, enable):
+        """
+        BUKT of RXB0CTRL: a frame accepted by RXB0 while it is full is written to RXB1 instead of being lost
+        """
+        self.bit_modify(self.CTRL_MAP[0], RXBCTRL_BUKT, RXBCTRL_BUKT if enable else 0x00)
 
     def shutdown(self):
         def _shutdown():
             # Set MCP2515 to configuration mode before shutdown
             self.set_mode(MODE_CONFIG)
-            self.spi.close()  # Close SPI interface
-            GPIO.cleanup(self.cs_pin)  # Cleanup GPIO
+            self.transport.close()  # Close SPI interface and cleanup GPIO
         self.retry_operation(_shutdown)
 
 
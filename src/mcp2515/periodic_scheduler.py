@@ -0,0 +1,139 @@
+import heapq
+import time
+from threading import Condition, Thread
+
+
+class PeriodicMessage:
+    """
+    A periodic frame and its timing statistics
+    """
+
+    def __init__(self, can_id, period, encode):
+        self.can_id = can_id
+        self.period = period
+        self.encode = encode
+        self.sent = 0
+        self.skipped = 0
+        # encode raised, the last exception is kept
+        self.errors = 0
+        self.last_error = None
+        self.overruns = 0
+        # lateness of the sends behind their deadline [s]
+        self.total_lateness = 0.0
+        self.max_lateness = 0.0
+
+
+class PeriodicScheduler:
+    """
+    Sends a table of periodic messages from one thread. The deadlines are kept in a heap on the monotonic clock and
+    every next deadline is the previous one plus the period, so a late send does not shift the following ones.
+    The messages falling due together are encoded and queued to the transmit scheduler in one go, which loads them
+    into the TX buffers in one batch.
+
+    A message more than a whole period late skips the periods it missed, counted as overruns, instead of being sent
+    in a burst to catch up. An encode function raising is counted in the stats of its message, which stays
+    scheduled, and does not stop the thread sending the others.
+
+    Messages may be added while the thread runs, the thread waits on a condition while the table is empty and is
+    woken up by add in case the new message is due before the current deadline.
+    """
+
+    def __init__(self, tx_scheduler, clock=time.monotonic):
+        """
+        :param TxScheduler tx_scheduler: queue of the frames
+        :param clock: monotonic time source [s], the one of the condition waits
+        """
+        self.tx_scheduler = tx_scheduler
+        self.clock = clock
+        # guards messages and deadlines
+        self.condition = Condition()
+        self.messages = []
+        # heap of (deadline, index in messages)
+        self.deadlines = []
+        self.thread = Thread(target=self.run, daemon=True)
+
+    def add(self, can_id, period, encode, phase=0.0):
+        """
+        :param can_id: 11 bit identifier
+        :param float period: interval of the sends [s]
+        :param encode: called without arguments at every deadline, returns the data bytes or None to skip the send
+        :param float phase: delay of the first send [s], to spread messages of the same period
+        """
+        with self.condition:
+            self.messages.append(PeriodicMessage(can_id, period, encode))
+            heapq.heappush(self.deadlines, (self.clock() + phase, len(self.messages) - 1))
+            self.condition.notify()
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.deadlines:
+                    self.condition.wait()
+                delay = self.deadlines[0][0] - self.clock()
+                if delay > 0:
+                    # until the deadline or an add, then the earliest deadline is looked up again
+                    self.condition.wait(delay)
+                    continue
+            self.fire()
+
+    def fire(self):
+        """
+        Sends every message whose deadline has passed
+        """
+        now = self.clock()
+        frames = []
+        with self.condition:
+            while self.deadlines and self.deadlines[0][0] <= now:
+                deadline, index = heapq.heappop(self.deadlines)
+                message = self.messages[index]
+
+                lateness = now - deadline
+                message.total_lateness += lateness
+                message.max_lateness = max(message.max_lateness, lateness)
+
+                try:
+                    data = message.encode()
+                except Exception as e:  # pylint: disable=broad-exception-caught
+                    message.errors += 1
+                    message.last_error = e
+                else:
+                    if data is None:
+                        message.skipped += 1
+                    else:
+                        frames.append((message.can_id, data))
+                        message.sent += 1
+
+                deadline += message.period
+                if deadline <= now:
+                    missed = int((now - deadline) // message.period) + 1
+                    message.overruns += missed
+                    deadline += missed * message.period
+                heapq.heappush(self.deadlines, (deadline, index))
+
+        if frames:
+            self.tx_scheduler.send_many(frames)
+
+    def get_stats(self):
+        """
+        :return: dict of CAN ID -> sent, skipped, error and overrun counts, the last encode exception and the mean and
+                 max lateness [s]
+        """
+        stats = {}
+        with self.condition:
+            messages = list(self.messages)
+        for message in messages:
+            fired = message.sent + message.skipped + message.errors
+            stats[message.can_id] = {
+                "period": message.period,
+                "sent": message.sent,
+                "skipped": message.skipped,
+                "errors": message.errors,
+                "last_error": repr(message.last_error) if message.last_error is not None else None,
+                "overruns": message.overruns,
+                "lateness_mean": message.total_lateness / fired if fired else 0.0,
+                "lateness_max": message.max_lateness,
+            }
+        return stats
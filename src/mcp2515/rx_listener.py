@@ -0,0 +1,113 @@
+import time
+from threading import Event, Lock, Thread
+
+from mcp2515.mcp2515 import MCP2515, GPIO, CANINTF_RX0IF, CANINTF_RX1IF
+
+
+class RxListener:
+    """
+    Interrupt driven receive: the RX interrupts of the MCP2515 pull its INT pin low, a falling edge callback wakes
+    the receive thread which then drains both RX buffers, e.g. into CanDispatcher.dispatch. Nothing is read over SPI
+    while no frame arrives.
+
+    INT stays low until every flag is cleared, so a missed edge (or a frame arriving while draining) produces no new
+    edge. A poll every fallback_period catches those frames.
+    """
+
+    def __init__(self, mcp, int_pin, handler, lock=None, fallback_period=0.1, gpio=GPIO):
+        """
+        :param MCP2515 mcp: controller
+        :param int_pin: BCM number of the pin wired to INT
+        :param handler: called as handler(can_id, data, length) from the receive thread, data is a bytearray that
+                        is reused for the next frame
+        :param lock: lock shared with the other users of the controller, e.g. the transmit scheduler
+        :param float fallback_period: interval of the polls without an interrupt [s]
+        :param gpio: RPi.GPIO or a module with the same interface
+        """
+        self.mcp = mcp
+        self.int_pin = int_pin
+        self.handler = handler
+        self.lock = lock if lock is not None else Lock()
+        self.fallback_period = fallback_period
+        self.gpio = gpio
+
+        self.interrupt = Event()
+        self.stopping = False
+        # one buffer per RX buffer of the controller
+        self.data = [bytearray(8), bytearray(8)]
+        self.stats = {"interrupts": 0, "frames": 0, "fallback_frames": 0}
+        self.thread = Thread(target=self.run, daemon=True)
+
+    def start(self):
+        with self.lock:
+            self.mcp.enable_interrupts(CANINTF_RX0IF | CANINTF_RX1IF)
+        self.gpio.setup(self.int_pin, self.gpio.IN, pull_up_down=self.gpio.PUD_UP)
+        self.gpio.add_event_detect(self.int_pin, self.gpio.FALLING, callback=self.on_interrupt)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stops the receive thread and disables the RX interrupts, frames still in the RX buffers are left there
+        :param float timeout: longest wait for the thread to end [s], None to wait for as long as a drain takes
+        """
+        self.gpio.remove_event_detect(self.int_pin)
+        self.stopping = True
+        self.interrupt.set()
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+        with self.lock:
+            self.mcp.enable_interrupts(0x00)
+
+    def on_interrupt(self, channel):
+        self.stats["interrupts"] += 1
+        self.interrupt.set()
+
+    def run(self):
+        while not self.stopping:
+            signalled = self.interrupt.wait(self.fallback_period)
+            self.interrupt.clear()
+            if self.stopping:
+                break
+            # without an edge, only poll if INT is low: a frame is waiting and its edge was missed
+            if signalled or self.gpio.input(self.int_pin) == self.gpio.LOW:
+                frames = self.drain()
+                if not signalled:
+                    self.stats["fallback_frames"] += frames
+
+    def drain(self):
+        """
+        Reads frames until both RX buffers are empty, the lock is only held while reading them, not while handling
+        :return: number of frames read
+        """
+        frames = 0
+        while True:
+            with self.lock:
+                messages = self.mcp.read_messages_into(self.data)
+            if not messages:
+                break
+            frames += len(messages)
+            for can_id, data, length in messages:
+                self.handler(can_id, data, length)
+        self.stats["frames"] += frames
+        return frames
+
+
+if __name__ == "__main__":
+    import spidev  # type: ignore
+
+    spi = spidev.SpiDev()
+    spi.open(0, 0)
+    spi.max_speed_hz = 100000
+
+    mcp = MCP2515(spi, cs_pin=5)
+    mcp.set_loopback_mode()
+
+    listener = RxListener(mcp, int_pin=25, handler=lambda can_id, data, length: print(can_id, list(data[:length])))
+    listener.start()
+
+    data_val = 0
+    while True:
+        with listener.lock:
+            mcp.send_message(can_id=0x100, data=[data_val] * 4)
+        data_val = (data_val + 1) % 256
+        time.sleep(0.05)
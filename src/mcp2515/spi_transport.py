@@ -0,0 +1,124 @@
+import ctypes
+import fcntl
+
+
+# linux/spi/spidev.h
+SPI_IOC_MAGIC = ord("k")
+SPI_IOC_TRANSFER_SIZE = 32
+
+
+def spi_ioc_message(count):
+    # _IOW(SPI_IOC_MAGIC, 0, char[SPI_MSGSIZE(count)])
+    return (1 << 30) | ((count * SPI_IOC_TRANSFER_SIZE) << 16) | (SPI_IOC_MAGIC << 8)
+
+
+class SpiIocTransfer(ctypes.Structure):
+    """
+    struct spi_ioc_transfer
+    """
+    _fields_ = [
+        ("tx_buf", ctypes.c_uint64),
+        ("rx_buf", ctypes.c_uint64),
+        ("len", ctypes.c_uint32),
+        ("speed_hz", ctypes.c_uint32),
+        ("delay_usecs", ctypes.c_uint16),
+        ("bits_per_word", ctypes.c_uint8),
+        ("cs_change", ctypes.c_uint8),
+        ("tx_nbits", ctypes.c_uint8),
+        ("rx_nbits", ctypes.c_uint8),
+        ("word_delay_usecs", ctypes.c_uint8),
+        ("pad", ctypes.c_uint8),
+    ]
+
+
+class GpioCsTransport:
+    """
+    Chip select driven from a GPIO around every transfer, for boards where CS is not wired to CE0/CE1
+    """
+
+    def __init__(self, spi, cs_pin, gpio):
+        self.spi = spi
+        self.cs_pin = cs_pin
+        self.gpio = gpio
+        self.gpio.setmode(self.gpio.BCM)
+        self.gpio.setup(cs_pin, self.gpio.OUT)
+        self.gpio.output(cs_pin, self.gpio.HIGH)
+
+    def transfer(self, data):
+        """
+        One chip select cycle
+        :param data: bytes to send
+        :return: list of the bytes received
+        """
+        self.gpio.output(self.cs_pin, self.gpio.LOW)
+        result = self.spi.xfer(data)
+        self.gpio.output(self.cs_pin, self.gpio.HIGH)
+        return result
+
+    def transfer_batch(self, transfers):
+        """
+        One chip select cycle per transfer
+        :param transfers: list of byte lists
+        :return: list of the received byte lists
+        """
+        return [self.transfer(data) for data in transfers]
+
+    def close(self):
+        self.spi.close()
+        self.gpio.cleanup(self.cs_pin)
+
+
+class HardwareCsTransport:
+    """
+    Chip select driven by the SPI controller (CE0/CE1): a transfer is one xfer2 call, a batch is one
+    SPI_IOC_MESSAGE ioctl whose transfers are separated by a chip select release (cs_change).
+    """
+
+    def __init__(self, spi):
+        self.spi = spi
+        # a SpiDev without a file descriptor (e.g. a fake one) gets its batches as single transfers
+        self.fd = spi.fileno() if hasattr(spi, "fileno") else None
+        self.tx_buffer = ctypes.create_string_buffer(64)
+        self.rx_buffer = ctypes.create_string_buffer(64)
+        self.ioc_transfers = (SpiIocTransfer * 8)()
+
+    def transfer(self, data):
+        return self.spi.xfer2(data)
+
+    def transfer_batch(self, transfers):
+        if self.fd is None:
+            return [self.spi.xfer2(data) for data in transfers]
+
+        total = sum(len(data) for data in transfers)
+        if total > len(self.tx_buffer):
+            self.tx_buffer = ctypes.create_string_buffer(total)
+            self.rx_buffer = ctypes.create_string_buffer(total)
+        if len(transfers) > len(self.ioc_transfers):
+            self.ioc_transfers = (SpiIocTransfer * len(transfers))()
+
+        tx_address = ctypes.addressof(self.tx_buffer)
+        rx_address = ctypes.addressof(self.rx_buffer)
+        offset = 0
+        for index, data in enumerate(transfers):
+            self.tx_buffer[offset:offset + len(data)] = bytes(data)
+            ioc_transfer = self.ioc_transfers[index]
+            ioc_transfer.tx_buf = tx_address + offset
+            ioc_transfer.rx_buf = rx_address + offset
+            ioc_transfer.len = len(data)
+            ioc_transfer.speed_hz = self.spi.max_speed_hz
+            ioc_transfer.bits_per_word = 8
+            # release chip select after every transfer but the last, which releases it anyway
+            ioc_transfer.cs_change = 1 if index < len(transfers) - 1 else 0
+            offset += len(data)
+
+        fcntl.ioctl(self.fd, spi_ioc_message(len(transfers)), self.ioc_transfers, True)
+
+        results = []
+        offset = 0
+        for data in transfers:
+            results.append(list(self.rx_buffer.raw[offset:offset + len(data)]))
+            offset += len(data)
+        return results
+
+    def close(self):
+        self.spi.close()
@@ -0,0 +1,362 @@
+from concurrent.futures import Future
+import heapq
+import time
+from threading import Condition, Lock, Thread
+
+from mcp2515.mcp2515 import MCP2515, STATUS_TX0IF, STATUS_TX0REQ, TXB0CTRL, TXBCTRL_MLOA, TXBCTRL_TXERR, \
+    CANINTF_TX0IF, CANINTF_ERRIF, CANINTF_MERRF, EFLG, EFLG_RXEP, EFLG_TXEP, EFLG_TXBO, EFLG_RXOVR, TX_POLL_PERIOD
+
+# Results of the futures returned by TxScheduler.send
+TX_SENT = "sent"
+TX_ABORTED = "aborted"
+TX_DROPPED = "dropped"
+
+
+class TxFrame:
+    """
+    A frame loaded in a TX buffer
+    """
+
+    def __init__(self, can_id, sequence, enqueue_time, request_time, future):
+        self.can_id = can_id
+        self.sequence = sequence
+        self.enqueue_time = enqueue_time
+        self.request_time = request_time
+        self.future = future
+        # TXREQ was cleared after the timeout, the frame may still complete if it was already on the bus
+        self.aborting = False
+        # MLOA / TXERR were already counted for this frame
+        self.arbitration_lost = False
+        self.tx_error = False
+
+
+class TxScheduler:
+    """
+    Transmit scheduler keeping the three TX buffers of the MCP2515 loaded.
+
+    Senders enqueue frames and get a future back immediately. The scheduler thread loads the frames into the free
+    buffers, lowest CAN ID first, and requests them with a single RTS, all in one batch of the SPI transport. A buffer
+    gets its TXP bits when it is loaded, as TXP must not change while TXREQ is set: a level above the pending frames
+    of higher CAN IDs and below those of lower ones, so the controller sends them in the order the bus arbitration
+    would. A frame for which no level is left waits in the queue until one of the pending frames is done.
+
+    The same thread is the only poller of the controller for the transmit side: each poll reads READ STATUS, CANINTF
+    and EFLG in one batch. Completions come from the TXnIF bits and resolve the futures, outside the MCP lock. A frame
+    pending for longer than slow_period, or a message error (MERRF), has its TXBnCTRL read to count arbitration
+    losses (MLOA) and bus errors (TXERR), passed once per frame to on_arbitration_lost and on_tx_error. EFLG changes
+    (ERRIF), e.g. entering error passive or bus off, are passed to on_error. A frame still pending after the timeout is aborted in its own buffer only, the others keep going.
+    """
+
+    BUFFER_COUNT = 3
+
+    def __init__(self, mcp, lock=None, timeout=0.2, max_queue=64, poll_period=TX_POLL_PERIOD, slow_period=0.002,
+                 on_error=None, on_arbitration_lost=None, on_tx_error=None):
+        """
+        :param MCP2515 mcp: controller, in normal or loopback mode
+        :param lock: lock shared with the other users of the controller, e.g. the receive task
+        :param float timeout: seconds before a requested frame is aborted
+        :param int max_queue: frames waiting for a buffer, further frames are dropped
+        :param float poll_period: interval of the completion polls while frames are pending [s]
+        :param float slow_period: pending time after which the TXBnCTRL of a frame is checked [s], a frame of 8
+                                  bytes takes about 0.5 ms at 250 kbit/s
+        :param on_error: called as on_error(eflg) from the scheduler thread when the error flags change
+        :param on_arbitration_lost: called as on_arbitration_lost(can_id) from the scheduler thread when a pending
+                                    frame lost the arbitration, once per frame
+        :param on_tx_error: called as on_tx_error(can_id) from the scheduler thread when a bus error occurred while a
+                            pending frame was sent, once per frame
+        """
+        self.mcp = mcp
+        self.lock = lock if lock is not None else Lock()
+        self.timeout = timeout
+        self.max_queue = max_queue
+        self.poll_period = poll_period
+        self.slow_period = slow_period
+        self.on_error = on_error
+        self.on_arbitration_lost = on_arbitration_lost
+        self.on_tx_error = on_tx_error
+
+        # heap of (can_id, sequence, enqueue_time, data, future), the lowest CAN ID wins the bus first
+        self.queue = []
+        self.sequence = 0
+        self.condition = Condition()
+        self.in_flight = [None] * TxScheduler.BUFFER_COUNT
+        # TXP last written to each buffer, only ever written while its TXREQ is clear
+        self.tx_priority = [None] * TxScheduler.BUFFER_COUNT
+        # EFLG of the last poll
+        self.error_flags = 0
+
+        self.max_queue_depth = 0
+        self.sent = 0
+        self.aborted = 0
+        self.dropped = 0
+        self.arbitration_lost = 0
+        self.tx_errors = 0
+        self.error_passive = 0
+        self.bus_off = 0
+        # can_id -> [count, total latency, max latency] from enqueue to completion [s]
+        self.latency = {}
+
+        # TX flags left set by MCP2515.send_message would be taken for the completion of the first frames
+        with self.lock:
+            self.mcp.clear_interrupt_flags(CANINTF_TX0IF | CANINTF_TX0IF << 1 | CANINTF_TX0IF << 2)
+
+        self.thread = Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def send(self, can_id, data, callback=None):
+        """
+        Enqueues a standard frame and returns
+        :param can_id: 11 bit identifier
+        :param data: up to 8 bytes
+        :param callback: called with the future once the frame is sent, aborted or dropped, from the scheduler thread
+                         (or right away for a dropped frame)
+        :return: concurrent.futures.Future whose result is TX_SENT, TX_ABORTED or TX_DROPPED (queue full)
+        """
+        return self.send_many([(can_id, data)], callback)[0]
+
+    def send_many(self, frames, callback=None):
+        """
+        Enqueues several frames at once, so the scheduler loads them into the TX buffers together
+        :param frames: list of (can_id, data)
+        :param callback: called with the future of each frame, see send
+        :return: list of the futures of the frames
+        """
+        for can_id, data in frames:
+            if not 0 <= can_id <= 0x7FF:
+                raise ValueError("CAN ID must be 11 bits (0x000 to 0x7FF)")
+            if len(data) > 8:
+                raise ValueError("CAN data length must be 8 bytes or less")
+
+        futures = []
+        dropped = []
+        now = time.time()
+        with self.condition:
+            for can_id, data in frames:
+                future = Future()
+                if callback is not None:
+                    future.add_done_callback(callback)
+                futures.append(future)
+                if len(self.queue) >= self.max_queue:
+                    self.dropped += 1
+                    dropped.append(future)
+                    continue
+                heapq.heappush(self.queue, (can_id, self.sequence, now, list(data), future))
+                self.sequence += 1
+            self.max_queue_depth = max(self.max_queue_depth, len(self.queue))
+            self.condition.notify()
+        for future in dropped:
+            future.set_result(TX_DROPPED)
+        return futures
+
+    def busy(self):
+        return any(frame is not None for frame in self.in_flight)
+
+    def run(self):
+        while True:
+            with self.condition:
+                if self.busy():
+                    # an enqueued frame wakes the scheduler up to load a free buffer
+                    self.condition.wait(self.poll_period)
+                else:
+                    while not self.queue:
+                        self.condition.wait()
+            self.service()
+
+    def service(self):
+        """
+        One scheduling step: collects the completed frames, aborts the timed out ones and fills the free buffers.
+        The futures and the error callbacks are only called once the lock is released.
+        """
+        results = []
+        events = []
+        error_flags = None
+        with self.lock:
+            if self.busy():
+                status, canintf, eflg = self.mcp.read_status_and_flags()
+                results = self.collect(status, canintf, events)
+                if canintf & CANINTF_ERRIF:
+                    error_flags = self.update_error_flags(eflg)
+            self.fill()
+
+        for callback, can_id in events:
+            callback(can_id)
+        for future, result in results:
+            future.set_result(result)
+        if error_flags is not None and self.on_error is not None:
+            self.on_error(error_flags)
+
+    def collect(self, status, canintf, events):
+        """
+        :param events: list receiving the (callback, can_id) of the arbitration losses and bus errors
+        :return: list of (future, result) of the frames that are done
+        """
+        now = time.time()
+        results = []
+        completed_flags = 0
+        for buffer_id, frame in enumerate(self.in_flight):
+            if frame is None:
+                continue
+            shift = 2 * buffer_id
+            if status & (STATUS_TX0IF << shift):
+                completed_flags |= CANINTF_TX0IF << buffer_id
+                self.complete(buffer_id, frame, now)
+                results.append((frame.future, TX_SENT))
+            elif not status & (STATUS_TX0REQ << shift):
+                # aborted: by the timeout below or by the controller itself (ABAT, one shot mode)
+                self.in_flight[buffer_id] = None
+                with self.condition:
+                    self.aborted += 1
+                results.append((frame.future, TX_ABORTED))
+            else:
+                if canintf & CANINTF_MERRF or now - frame.request_time > self.slow_period:
+                    self.check_buffer(buffer_id, frame, events)
+                if not frame.aborting and now - frame.request_time > self.timeout:
+                    self.mcp.abort_tx_buffer(buffer_id)
+                    frame.aborting = True
+        if canintf & CANINTF_MERRF:
+            completed_flags |= CANINTF_MERRF
+        if completed_flags:
+            self.mcp.clear_interrupt_flags(completed_flags)
+        return results
+
+    def check_buffer(self, buffer_id, frame, events):
+        """
+        Counts the arbitration loss and the bus error of a pending frame and queues their callbacks, once per frame
+        :param events: list receiving the (callback, can_id) to call once the lock is released
+        """
+        control = self.mcp.read_register(TXB0CTRL + 0x10 * buffer_id)
+        with self.condition:
+            if control & TXBCTRL_MLOA and not frame.arbitration_lost:
+                frame.arbitration_lost = True
+                self.arbitration_lost += 1
+                if self.on_arbitration_lost is not None:
+                    events.append((self.on_arbitration_lost, frame.can_id))
+            if control & TXBCTRL_TXERR and not frame.tx_error:
+                frame.tx_error = True
+                self.tx_errors += 1
+                if self.on_tx_error is not None:
+                    events.append((self.on_tx_error, frame.can_id))
+
+    def update_error_flags(self, eflg):
+        """
+        :return: the new error flags
+        """
+        with self.condition:
+            if eflg & (EFLG_TXEP | EFLG_RXEP) and not self.error_flags & (EFLG_TXEP | EFLG_RXEP):
+                self.error_passive += 1
+            if eflg & EFLG_TXBO and not self.error_flags & EFLG_TXBO:
+                self.bus_off += 1
+            self.error_flags = eflg
+        # the receive overflow flags are the only ones that have to be cleared, the others follow the error counters
+        if eflg & EFLG_RXOVR:
+            self.mcp.bit_modify(EFLG, EFLG_RXOVR, 0x00)
+        self.mcp.clear_interrupt_flags(CANINTF_ERRIF)
+        return eflg
+
+    def complete(self, buffer_id, frame, now):
+        self.in_flight[buffer_id] = None
+        latency = now - frame.enqueue_time
+        with self.condition:
+            self.sent += 1
+            entry = self.latency.setdefault(frame.can_id, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += latency
+            entry[2] = max(entry[2], latency)
+
+    def fill(self):
+        """
+        Loads the free buffers, sets their priorities and requests the new frames in one batch of commands
+        """
+        commands = []
+        request_mask = 0
+        with self.condition:
+            for buffer_id in range(TxScheduler.BUFFER_COUNT):
+                if not self.queue:
+                    break
+                if self.in_flight[buffer_id] is not None:
+                    continue
+                priority = self.free_priority(self.queue[0][0], self.queue[0][1])
+                if priority is None:
+                    break
+                can_id, sequence, enqueue_time, data, future = heapq.heappop(self.queue)
+                commands.append(MCP2515.load_tx_buffer_command(buffer_id, can_id, data))
+                # TXREQ of the buffer is still clear, it is only set by the RTS below
+                if self.tx_priority[buffer_id] != priority:
+                    commands.append(MCP2515.tx_priority_command(buffer_id, priority))
+                    self.tx_priority[buffer_id] = priority
+                self.in_flight[buffer_id] = TxFrame(can_id, sequence, enqueue_time, time.time(), future)
+                request_mask |= 1 << buffer_id
+        if request_mask:
+            commands.append(MCP2515.request_to_send_command(request_mask))
+            self.mcp.batch(commands)
+
+    def free_priority(self, can_id, sequence):
+        """
+        :return: the TXP of a frame sent after the pending frames of lower CAN ID (or same CAN ID, enqueued earlier)
+                 and before the others, in the middle of the free levels to leave room on both sides, None if there
+                 is no such level
+        """
+        low, high = 0, 3
+        for buffer_id, frame in enumerate(self.in_flight):
+            if frame is None:
+                continue
+            if (frame.can_id, frame.sequence) < (can_id, sequence):
+                high = min(high, self.tx_priority[buffer_id] - 1)
+            else:
+                low = max(low, self.tx_priority[buffer_id] + 1)
+        if low > high:
+            return None
+        return (low + high + 1) // 2
+
+    def get_stats(self):
+        """
+        :return: dict with the queue depth (current and max), the frames in the buffers, the sent, aborted and
+                 dropped counts, the arbitration losses, bus errors, error passive and bus off events, the last EFLG
+                 and, per CAN ID, the count, mean and max latency from enqueue to completion [s]
+        """
+        with self.condition:
+            return {
+                "queue_depth": len(self.queue),
+                "max_queue_depth": self.max_queue_depth,
+                "in_flight": sum(frame is not None for frame in self.in_flight),
+                "sent": self.sent,
+                "aborted": self.aborted,
+                "dropped": self.dropped,
+                "arbitration_lost": self.arbitration_lost,
+                "tx_errors": self.tx_errors,
+                "error_passive": self.error_passive,
+                "bus_off": self.bus_off,
+                "error_flags": self.error_flags,
+                "latency": {can_id: {"count": count, "mean": total / count, "max": maximum}
+                            for can_id, (count, total, maximum) in self.latency.items()},
+            }
+
+
+if __name__ == "__main__":
+    import spidev  # type: ignore
+
+    spi = spidev.SpiDev()
+    spi.open(0, 0)
+    spi.max_speed_hz = 100000
+
+    mcp = MCP2515(spi, cs_pin=5)
+    mcp.set_loopback_mode()
+
+    scheduler = TxScheduler(mcp, on_error=lambda eflg: print("EFLG", hex(eflg)),
+                            on_arbitration_lost=lambda can_id: print("arbitration lost", hex(can_id)),
+                            on_tx_error=lambda can_id: print("bus error", hex(can_id)))
+    scheduler.start()
+
+    data_val = 0
+    while True:
+        for can_id in (0x100, 0x101, 0x200):
+            scheduler.send(can_id, [data_val] * 4)
+        # the result of one frame per round, without blocking the sender
+        scheduler.send(0x300, [data_val], callback=lambda future: future.result() != TX_SENT and print(
+            "0x300", future.result()))
+        data_val = (data_val + 1) % 256
+        if data_val == 0:
+            print(scheduler.get_stats())
+        time.sleep(0.005)
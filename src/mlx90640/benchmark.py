@@ -0,0 +1,183 @@
+"""
+Hardware free benchmark of the MLX90640 driver: EEPROM read and decode, every compensation engine and the full
+read path, on synthetic sensors in chess and interlaced mode behind the register level emulator.
+
+Run from the src directory:
+
+    python -m mlx90640.benchmark -o bench.json
+    python -m mlx90640.benchmark -o bench_new.json --compare bench.json
+
+Every path reports frames (calls) per second, latency percentiles and the memory allocated per call (tracemalloc,
+measured in a separate pass so it does not slow down the timed one). The results, with the commit and the library
+versions, are written as JSON.
+"""
+import argparse
+import json
+import platform
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from mlx90640.emulator import MLX90640Emulator
+from mlx90640.mlx90640 import MLX90640
+from mlx90640.synthetic import SyntheticSensor
+
+
+def measure(function, frames, iterations, warmup=3, alloc_iterations=10):
+    """
+    :param function: called with one frame per iteration, cycling through frames
+    :return: dict of the timing and allocation figures
+    """
+    for i in range(warmup):
+        function(frames[i % len(frames)])
+
+    latencies = np.zeros(iterations)
+    start = time.perf_counter()
+    for i in range(iterations):
+        call_start = time.perf_counter_ns()
+        function(frames[i % len(frames)])
+        latencies[i] = time.perf_counter_ns() - call_start
+    elapsed = time.perf_counter() - start
+
+    peak_bytes = 0
+    retained_bytes = 0
+    tracemalloc.start()
+    for i in range(alloc_iterations):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        function(frames[i % len(frames)])
+        current, peak = tracemalloc.get_traced_memory()
+        peak_bytes = max(peak_bytes, peak - before)
+        retained_bytes += current - before
+    tracemalloc.stop()
+
+    latencies /= 1000.0
+    return {
+        "iterations": iterations,
+        "fps": iterations / elapsed,
+        "latency_us": {
+            "mean": float(latencies.mean()),
+            "p50": float(np.percentile(latencies, 50)),
+            "p90": float(np.percentile(latencies, 90)),
+            "p99": float(np.percentile(latencies, 99)),
+            "max": float(latencies.max()),
+        },
+        "alloc_peak_bytes": int(peak_bytes),
+        "alloc_retained_bytes": int(retained_bytes // alloc_iterations),
+    }
+
+
+def benchmark_paths(sensor, frames):
+    """
+    :return: dict of path name -> (function taking a raw frame, relative number of iterations)
+    """
+    # measurements on demand, each read_frame path triggers one so it always finds new data
+    bus = MLX90640Emulator(sensor, frames=frames, free_running=False)
+    mlx = {engine: MLX90640(bus, frame_rate=64.0, engine=engine) for engine in MLX90640.ENGINES}
+    mlx_subpage = {engine: MLX90640(bus, frame_rate=64.0, engine=engine, subpage_incremental=True)
+                   for engine in (MLX90640.ENGINE_NUMPY, MLX90640.ENGINE_FIXED)}
+    numpy_mlx = mlx[MLX90640.ENGINE_NUMPY]
+
+    paths = {
+        "init": (lambda frame: MLX90640(bus, frame_rate=64.0, engine=MLX90640.ENGINE_NUMPY), 0.1),
+        "read_eeprom_from_device": (lambda frame: numpy_mlx.eeprom.read_eeprom_from_device(), 0.2),
+        "calculate_parameters": (lambda frame: numpy_mlx.calculate_parameters(), 0.2),
+        "compile_frame_plan": (lambda frame: numpy_mlx.compile_frame_plan(), 0.2),
+        "do_compensation": (lambda frame: mlx[MLX90640.ENGINE_PYTHON].do_compensation(frame.tolist()), 0.2),
+        "do_compensation_numpy": (lambda frame: numpy_mlx.do_compensation_numpy(frame), 1.0),
+        "do_compensation_numpy_subpage": (lambda frame: numpy_mlx.do_compensation_numpy(
+            frame, subpage=int(frame[833]) & 1), 1.0),
+        "do_compensation_fixed": (lambda frame: mlx[MLX90640.ENGINE_FIXED].do_compensation_fixed(frame), 1.0),
+        "do_compensation_fixed_subpage": (lambda frame: mlx[MLX90640.ENGINE_FIXED].do_compensation_fixed(
+            frame, subpage=int(frame[833]) & 1), 1.0),
+        "bad_pixel_correction": (lambda frame: numpy_mlx.bad_pixel_corrector.correct(frame[:768]), 1.0),
+    }
+    for engine in MLX90640.ENGINES:
+        scale = 0.2 if engine == MLX90640.ENGINE_PYTHON else 1.0
+        paths["process_frame_" + engine] = (lambda frame, engine=engine: mlx[engine].process_frame(frame), scale)
+        paths["read_frame_" + engine] = (lambda frame, engine=engine: (bus.measure(), mlx[engine].read_frame()),
+                                         scale)
+    for engine, instance in mlx_subpage.items():
+        paths["read_frame_{}_subpage".format(engine)] = (
+            lambda frame, instance=instance: (bus.measure(), instance.read_frame()), 1.0)
+    return paths
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(iterations=500, frame_count=64, seed=0, path_filter=None):
+    """
+    :param int iterations: iterations of the fast paths, the slow ones (init, python engine) run a fraction of it
+    :param int frame_count: distinct synthetic frames cycled through
+    :param int seed: seed of the synthetic sensors
+    :param path_filter: regular expression selecting the paths, None runs all of them
+    :return: the results as a JSON serializable dict
+    """
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "platform": platform.platform(),
+            "iterations": iterations,
+            "frame_count": frame_count,
+            "seed": seed,
+        },
+        "results": {},
+    }
+    for mode, chess in (("chess", True), ("interlaced", False)):
+        sensor = SyntheticSensor(seed=seed, chess=chess, broken_pixels=[37], outlier_pixels=[410])
+        frames = sensor.raw_frames(frame_count)
+        results["results"][mode] = {}
+        for name, (function, scale) in benchmark_paths(sensor, frames).items():
+            if path_filter is not None and not re.search(path_filter, name):
+                continue
+            results["results"][mode][name] = measure(function, frames, max(int(iterations * scale), 10))
+    return results
+
+
+def print_results(results, baseline=None):
+    print("{:<12} {:<32} {:>10} {:>10} {:>10} {:>12} {:>9}".format(
+        "mode", "path", "fps", "p50 us", "p99 us", "alloc peak", "vs base"))
+    for mode, paths in results["results"].items():
+        for name, result in paths.items():
+            ratio = ""
+            if baseline is not None and name in baseline["results"].get(mode, {}):
+                ratio = "{:.2f}x".format(result["fps"] / baseline["results"][mode][name]["fps"])
+            print("{:<12} {:<32} {:>10.1f} {:>10.1f} {:>10.1f} {:>12} {:>9}".format(
+                mode, name, result["fps"], result["latency_us"]["p50"], result["latency_us"]["p99"],
+                result["alloc_peak_bytes"], ratio))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the MLX90640 driver on synthetic sensors")
+    parser.add_argument("-o", "--output", help="JSON file receiving the results")
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--frames", type=int, default=64, help="distinct synthetic frames")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--paths", help="regular expression selecting the benchmarked paths")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare the frame rates against")
+    args = parser.parse_args()
+
+    results = run(iterations=args.iterations, frame_count=args.frames, seed=args.seed, path_filter=args.paths)
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as file_handle:
+            baseline = json.load(file_handle)
+    print_results(results, baseline)
+
+    if args.output is not None:
+        with open(args.output, "w") as file_handle:
+            json.dump(results, file_handle, indent=2)
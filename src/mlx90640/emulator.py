@@ -0,0 +1,235 @@
+"""
+Register level MLX90640 emulator with the interface of smbus2.SMBus used by HAL_MLX90640, to run the driver and
+the acquisition pipeline without the sensor.
+
+Load test, run from the src directory:
+
+    python -m mlx90640.emulator --frame-rate 64 --i2c-speed 1000000 --seconds 10
+"""
+import argparse
+import errno
+from ctypes import memmove
+import time
+
+import numpy as np
+from smbus2.smbus2 import I2C_M_RD
+
+from mlx90640.synthetic import SyntheticSensor
+
+
+class MLX90640Emulator:
+    """
+    Emulates the memory map of the sensor behind i2c_rdwr / write_i2c_block_data:
+
+    - 0x0400-0x073F RAM: pixels and service words, updated by every subpage measurement
+    - 0x2400-0x273F EEPROM: the image of the synthetic sensor (read only)
+    - 0x8000 status register: bit 0 last measured subpage, bit 3 new data available, bit 4 overwrite enable
+    - 0x800D control register 1: bit 0 subpage mode, bits 9:7 refresh rate, bit 12 chess pattern
+
+    Free running, a subpage is measured every 1 / refresh rate seconds, alternating subpages, and only the pixels of
+    that subpage (chess or interlaced pattern) are written to RAM. While the new data flag is still set and
+    overwrite is disabled the RAM is left untouched and the measurement is counted as missed. Otherwise call
+    measure() to complete one measurement on demand.
+
+    The I2C transfer time can be simulated for a given bus speed: every transfer then takes 9 bit times per byte,
+    address byte included.
+    """
+
+    RAM_ADDRESS = 0x0400
+    RAM_WORDS = 832
+    EEPROM_ADDRESS = 0x2400
+    STATUS_ADDRESS = 0x8000
+    CONTROL1_ADDRESS = 0x800D
+
+    STATUS_SUBPAGE = 0x0001
+    STATUS_NEW_DATA = 0x0008
+    STATUS_OVERWRITE = 0x0010
+    # bits the master can write, the others are read only
+    STATUS_WRITABLE = 0x0038
+    CONTROL1_SUBPAGE_MODE = 0x0001
+    CONTROL1_CHESS = 0x1000
+
+    def __init__(self, sensor=None, frames=None, i2c_addr=0x33, i2c_speed=None, free_running=True,
+                 clock=time.monotonic):
+        """
+        :param SyntheticSensor sensor: provides the EEPROM image and, without frames, the measured scene
+        :param frames: raw frames (834 words) measured in turn instead of the scene of the sensor
+        :param int i2c_addr: slave address
+        :param i2c_speed: bus speed [Hz] whose transfer time is simulated, e.g. 400000 or 1000000, None for none
+        :param bool free_running: measure at the refresh rate by itself, otherwise only in measure()
+        :param clock: time source [s]
+        """
+        self.sensor = sensor if sensor is not None else SyntheticSensor()
+        self.frames = frames
+        self.i2c_addr = i2c_addr
+        self.i2c_speed = i2c_speed
+        self.free_running = free_running
+        self.clock = clock
+
+        # the whole 16 bit word address space, big endian like on the bus
+        self.memory = np.zeros(0x10000, dtype=">u2")
+        eeprom = MLX90640Emulator.EEPROM_ADDRESS
+        self.memory[eeprom:eeprom + len(self.sensor.eeprom_image)] = self.sensor.eeprom_image
+        # control register 1 and the I2C configuration are loaded from the EEPROM at power up
+        self.memory[MLX90640Emulator.CONTROL1_ADDRESS] = self.memory[eeprom + 0x0C]
+        self.memory[0x800F] = self.memory[eeprom + 0x0E]
+        self.pointer = 0
+
+        pixel_idx = np.arange(768)
+        self.subpage_pixels = {
+            True: [np.flatnonzero(((pixel_idx & 1) ^ ((pixel_idx // 32) & 1)) == page) for page in range(2)],
+            False: [np.flatnonzero((pixel_idx // 32) % 2 == page) for page in range(2)],
+        }
+
+        self.measurement_count = 0
+        # the last measurement has not been read by the master yet
+        self.unread = False
+        self.next_measurement = self.clock() + self.measurement_period
+        self.stats = {"measured": 0, "missed": 0, "frames_read": 0, "transfers": 0, "bus_time": 0.0}
+
+    @property
+    def measurement_period(self):
+        # refresh rate code n of control register 1: 2^n / 2 Hz, one subpage per period
+        rate_code = (int(self.memory[MLX90640Emulator.CONTROL1_ADDRESS]) >> 7) & 0x7
+        return 2.0 / (1 << rate_code)
+
+    def measure(self):
+        """
+        Completes the measurement of the next subpage
+        """
+        status = int(self.memory[MLX90640Emulator.STATUS_ADDRESS])
+        control = int(self.memory[MLX90640Emulator.CONTROL1_ADDRESS])
+        index = self.measurement_count
+        self.measurement_count += 1
+        self.stats["measured"] += 1
+
+        # the new measurement is lost if the RAM is protected, the previous one if it is overwritten before it
+        # was read
+        if status & MLX90640Emulator.STATUS_NEW_DATA and not status & MLX90640Emulator.STATUS_OVERWRITE:
+            self.stats["missed"] += 1
+            return
+        if self.unread:
+            self.stats["missed"] += 1
+
+        subpage = index & 1 if control & MLX90640Emulator.CONTROL1_SUBPAGE_MODE else 0
+        if self.frames is not None:
+            frame = self.frames[index % len(self.frames)]
+        else:
+            frame = self.sensor.raw_frame(self.sensor.scene(index // 2), subpage=subpage)
+
+        ram = self.memory[MLX90640Emulator.RAM_ADDRESS:MLX90640Emulator.RAM_ADDRESS + MLX90640Emulator.RAM_WORDS]
+        pixels = self.subpage_pixels[bool(control & MLX90640Emulator.CONTROL1_CHESS)][subpage]
+        ram[pixels] = np.asarray(frame[:768])[pixels].astype(np.uint16)
+        ram[768:] = np.asarray(frame[768:832]).astype(np.uint16)
+
+        status = (status & ~MLX90640Emulator.STATUS_SUBPAGE) | MLX90640Emulator.STATUS_NEW_DATA | subpage
+        self.memory[MLX90640Emulator.STATUS_ADDRESS] = status
+        self.unread = True
+
+    def update(self):
+        """
+        Free running mode: completes the measurements that are due
+        """
+        if not self.free_running:
+            return
+        now = self.clock()
+        period = self.measurement_period
+        if now < self.next_measurement:
+            return
+        due = int((now - self.next_measurement) // period) + 1
+        # the RAM only keeps the last measurement of each subpage, older ones are just counted
+        for _ in range(due - 2):
+            self.measurement_count += 1
+            self.stats["measured"] += 1
+            self.stats["missed"] += 1
+        for _ in range(min(due, 2)):
+            self.measure()
+        self.next_measurement += due * period
+
+    def transfer_time(self, byte_count):
+        if self.i2c_speed:
+            duration = byte_count * 9 / self.i2c_speed
+            time.sleep(duration)
+            self.stats["bus_time"] += duration
+
+    def read(self, count):
+        addr = self.pointer
+        words = (count + 1) // 2
+        data = self.memory[addr:addr + words].tobytes()[:count]
+        if addr == MLX90640Emulator.RAM_ADDRESS and words >= MLX90640Emulator.RAM_WORDS:
+            self.stats["frames_read"] += 1
+            self.unread = False
+        self.pointer = addr + words
+        return data
+
+    def write(self, data):
+        self.pointer = (data[0] << 8) | data[1]
+        for offset in range(2, len(data) - 1, 2):
+            self.write_word(self.pointer, (data[offset] << 8) | data[offset + 1])
+            self.pointer += 1
+
+    def write_word(self, addr, value):
+        if addr == MLX90640Emulator.STATUS_ADDRESS:
+            status = int(self.memory[addr])
+            writable = MLX90640Emulator.STATUS_WRITABLE
+            self.memory[addr] = (status & ~writable) | (value & writable)
+        elif addr == MLX90640Emulator.CONTROL1_ADDRESS:
+            self.memory[addr] = value
+            self.next_measurement = self.clock() + self.measurement_period
+        elif 0x8000 < addr < 0x8020:
+            self.memory[addr] = value
+        # RAM and EEPROM are not writable
+
+    def check_address(self, i2c_addr):
+        if i2c_addr != self.i2c_addr:
+            raise OSError(errno.EREMOTEIO, "No device at address 0x{:02x}".format(i2c_addr))
+
+    def i2c_rdwr(self, *i2c_msgs):
+        self.update()
+        self.stats["transfers"] += 1
+        for msg in i2c_msgs:
+            self.check_address(msg.addr)
+            self.transfer_time(msg.len + 1)
+            if msg.flags & I2C_M_RD:
+                data = self.read(msg.len)
+                memmove(msg.buf, data, len(data))
+            else:
+                self.write(bytes(msg))
+
+    def write_i2c_block_data(self, i2c_addr, register, data, force=None):
+        self.update()
+        self.stats["transfers"] += 1
+        self.check_address(i2c_addr)
+        self.transfer_time(len(data) + 2)
+        self.write(bytes([register] + list(data)))
+
+    def close(self):
+        pass
+
+
+if __name__ == "__main__":
+    from mlx90640.mlx90640 import MLX90640
+
+    parser = argparse.ArgumentParser(description="Load test of the MLX90640 driver on the emulator")
+    parser.add_argument("--frame-rate", type=float, default=64.0)
+    parser.add_argument("--i2c-speed", type=int, default=1000000, help="simulated bus speed [Hz], 0 for none")
+    parser.add_argument("--engine", default=MLX90640.ENGINE_NUMPY, choices=MLX90640.ENGINES)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    args = parser.parse_args()
+
+    emulator = MLX90640Emulator(i2c_speed=args.i2c_speed or None)
+    mlx = MLX90640(emulator, frame_rate=args.frame_rate, engine=args.engine, subpage_incremental=True)
+
+    frames = 0
+    start_time = time.time()
+    while time.time() - start_time < args.seconds:
+        avg_temp, frame = mlx.read_frame()
+        if avg_temp is not None:
+            frames += 1
+        else:
+            time.sleep(0.001)
+    elapsed = time.time() - start_time
+
+    print("{} frames in {:.1f} s: {:.1f} fps, {} measurements, {} missed, {:.0f}% of the time on the bus".format(
+        frames, elapsed, frames / elapsed, emulator.stats["measured"], emulator.stats["missed"],
+        100.0 * emulator.stats["bus_time"] / elapsed))
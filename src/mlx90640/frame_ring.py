@@ -0,0 +1,136 @@
+from multiprocessing import shared_memory, Semaphore
+import struct
+import time
+
+
+class RawFrameRing:
+    """
+    Single producer / single consumer ring of raw MLX90640 frames in shared memory.
+
+    The acquisition stage pushes every frame it reads from the sensor together with its acquisition timestamp,
+    the compensation stage pops them in order. When the consumer falls more than `slots` frames behind, the oldest
+    frames are overwritten and counted as dropped instead of blocking the acquisition.
+
+    Layout: header (HEADER), then `slots` slots of SLOT_HEADER followed by the raw frame bytes (big endian words,
+    exactly as read from the sensor).
+    """
+
+    # write_count, read_count, acquisition_missed, compensation_dropped
+    HEADER = struct.Struct("<QQQQ")
+    # sequence number (write_count + 1 once the slot is complete, 0 while it is being written), timestamp
+    SLOT_HEADER = struct.Struct("<Qd")
+
+    def __init__(self, slots=8, frame_bytes=834 * 2):
+        self.slots = slots
+        self.frame_bytes = frame_bytes
+        self.slot_size = RawFrameRing.SLOT_HEADER.size + frame_bytes
+        self.shm = shared_memory.SharedMemory(create=True,
+                                              size=RawFrameRing.HEADER.size + slots * self.slot_size)
+        self.shm.buf[:RawFrameRing.HEADER.size] = bytes(RawFrameRing.HEADER.size)
+        # one release per pushed frame, lets the consumer sleep instead of polling
+        self.frame_available = Semaphore(0)
+
+    def get_counter(self, index):
+        return struct.unpack_from("<Q", self.shm.buf, index * 8)[0]
+
+    def set_counter(self, index, value):
+        struct.pack_into("<Q", self.shm.buf, index * 8, value)
+
+    def slot_offset(self, count):
+        return RawFrameRing.HEADER.size + (count % self.slots) * self.slot_size
+
+    def push(self, frame, timestamp):
+        """
+        Acquisition stage: copies a raw frame into the next slot
+        :param frame: bytes-like raw frame, e.g. HAL_MLX90640.frame_buffer
+        :param float timestamp: acquisition time [s]
+        :return: nothing
+        """
+        write_count = self.get_counter(0)
+        offset = self.slot_offset(write_count)
+
+        RawFrameRing.SLOT_HEADER.pack_into(self.shm.buf, offset, 0, timestamp)
+        data_offset = offset + RawFrameRing.SLOT_HEADER.size
+        self.shm.buf[data_offset:data_offset + self.frame_bytes] = frame
+        RawFrameRing.SLOT_HEADER.pack_into(self.shm.buf, offset, write_count + 1, timestamp)
+
+        self.set_counter(0, write_count + 1)
+        self.frame_available.release()
+
+    def record_missed(self, count):
+        """
+        Acquisition stage: counts sensor frames that were never read (e.g. the new data flag was seen too late)
+        """
+        self.set_counter(2, self.get_counter(2) + count)
+
+    def pop_into(self, frame, timeout=None):
+        """
+        Compensation stage: copies the oldest unread frame
+        :param frame: writable bytes-like of frame_bytes receiving the raw frame
+        :param timeout: seconds to wait for a frame, None waits forever
+        :return: the acquisition timestamp, or None if no frame arrived within the timeout
+        """
+        while True:
+            read_count = self.get_counter(1)
+            write_count = self.get_counter(0)
+
+            if read_count == write_count:
+                if not self.frame_available.acquire(timeout=timeout):
+                    return None
+                continue
+
+            # skip what has already been overwritten, keeping one slot of margin for the frame being written
+            if write_count - read_count >= self.slots:
+                dropped = write_count - read_count - self.slots + 1
+                self.set_counter(3, self.get_counter(3) + dropped)
+                read_count += dropped
+
+            offset = self.slot_offset(read_count)
+            data_offset = offset + RawFrameRing.SLOT_HEADER.size
+            frame[:] = self.shm.buf[data_offset:data_offset + self.frame_bytes]
+            sequence, timestamp = RawFrameRing.SLOT_HEADER.unpack_from(self.shm.buf, offset)
+
+            self.set_counter(1, read_count + 1)
+            if sequence == read_count + 1:
+                return timestamp
+
+            # overwritten while copying it
+            self.set_counter(3, self.get_counter(3) + 1)
+
+    def stats(self):
+        return {
+            "acquired": self.get_counter(0),
+            "compensated": self.get_counter(1) - self.get_counter(3),
+            "acquisition_missed": self.get_counter(2),
+            "compensation_dropped": self.get_counter(3),
+        }
+
+    def close(self, unlink=False):
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+if __name__ == "__main__":
+    from multiprocessing import Process
+
+    ring = RawFrameRing(slots=4, frame_bytes=16)
+
+    def consumer():
+        frame = bytearray(16)
+        while True:
+            timestamp = ring.pop_into(frame, timeout=1.0)
+            if timestamp is None:
+                break
+            time.sleep(0.002)
+        print(ring.stats())
+
+    consumer_process = Process(target=consumer)
+    consumer_process.start()
+
+    for i in range(1000):
+        ring.push(bytes([i % 256]) * 16, time.time())
+        time.sleep(0.001)
+
+    consumer_process.join()
+    ring.close(unlink=True)
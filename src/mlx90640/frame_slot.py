@@ -0,0 +1,134 @@
+from multiprocessing import shared_memory
+import struct
+import time
+
+import numpy as np
+
+
+class FrameSlot:
+    """
+    Latest compensated MLX90640 frame in shared memory, one writer and any number of readers, no lock.
+
+    The slot is double buffered: frame n is written into buffer n % 2 while the readers may still be using frame
+    n - 1 in the other one. Every buffer carries a seqlock sequence number, odd while the writer copies a frame into
+    it and 2 * n once frame n is complete, so a reader can tell whether the buffer it looked at was overwritten.
+
+    A reader gets a numpy view of the latest frame, without copying it. The view stays valid until the writer starts
+    frame n + 2, i.e. for at least one frame period; is_valid tells afterwards whether it was.
+
+    Layout: HEADER, then 2 buffers of BUFFER_HEADER followed by the frame (int32 pixels).
+    """
+
+    # write_count: number of complete frames
+    HEADER = struct.Struct("<Q")
+    # sequence number, timestamp
+    BUFFER_HEADER = struct.Struct("<Qd")
+
+    def __init__(self, pixels=32 * 24, dtype=np.int32):
+        self.pixels = pixels
+        self.dtype = np.dtype(dtype)
+        self.frame_bytes = pixels * self.dtype.itemsize
+        self.buffer_size = FrameSlot.BUFFER_HEADER.size + self.frame_bytes
+        size = FrameSlot.HEADER.size + 2 * self.buffer_size
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.shm.buf[:size] = bytes(size)
+
+    def get_write_count(self):
+        return FrameSlot.HEADER.unpack_from(self.shm.buf, 0)[0]
+
+    def buffer_offset(self, count):
+        return FrameSlot.HEADER.size + (count % 2) * self.buffer_size
+
+    def frame_view(self, count):
+        """
+        :return: numpy view of the buffer of frame count, straight on the shared memory
+        """
+        return np.ndarray(self.pixels, dtype=self.dtype, buffer=self.shm.buf,
+                          offset=self.buffer_offset(count) + FrameSlot.BUFFER_HEADER.size)
+
+    def write(self, frame, timestamp):
+        """
+        Writer: copies a whole frame into the free buffer and publishes it
+        :param frame: pixels, numpy array or list
+        :param float timestamp: acquisition time [s]
+        :return: frame number of the written frame
+        """
+        count = self.get_write_count() + 1
+        offset = self.buffer_offset(count)
+
+        FrameSlot.BUFFER_HEADER.pack_into(self.shm.buf, offset, 2 * count - 1, timestamp)
+        np.copyto(self.frame_view(count), frame, casting="unsafe")
+        FrameSlot.BUFFER_HEADER.pack_into(self.shm.buf, offset, 2 * count, timestamp)
+
+        FrameSlot.HEADER.pack_into(self.shm.buf, 0, count)
+        return count
+
+    def read(self):
+        """
+        Reader: latest complete frame, not copied
+        :return: tuple (frame number, timestamp, numpy view of the frame), (0, None, None) before the first frame
+        """
+        while True:
+            count = self.get_write_count()
+            if count == 0:
+                return 0, None, None
+
+            sequence, timestamp = FrameSlot.BUFFER_HEADER.unpack_from(self.shm.buf, self.buffer_offset(count))
+            if sequence == 2 * count:
+                return count, timestamp, self.frame_view(count)
+            # the writer already got two frames further and is overwriting this buffer, take the newer one
+
+    def is_valid(self, count):
+        """
+        Reader: whether the view of frame count returned by read was not overwritten while being used
+        """
+        sequence = FrameSlot.BUFFER_HEADER.unpack_from(self.shm.buf, self.buffer_offset(count))[0]
+        return sequence == 2 * count
+
+    def read_into(self, frame):
+        """
+        Reader: copies the latest complete frame
+        :param frame: numpy array of pixels elements receiving the frame
+        :return: tuple (frame number, timestamp), (0, None) before the first frame
+        """
+        while True:
+            count, timestamp, view = self.read()
+            if count == 0:
+                return 0, None
+            np.copyto(frame, view)
+            if self.is_valid(count):
+                return count, timestamp
+
+    def close(self, unlink=False):
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+if __name__ == "__main__":
+    from multiprocessing import Process
+
+    slot = FrameSlot()
+
+    def reader():
+        frame = np.empty(slot.pixels, dtype=slot.dtype)
+        last_count = 0
+        frames = 0
+        torn = 0
+        while last_count < 1000:
+            count, timestamp = slot.read_into(frame)
+            if count != last_count:
+                frames += 1
+                torn += int((frame != frame[0]).any())
+                last_count = count
+        print("frames read: {}, torn: {}".format(frames, torn))
+
+    reader_process = Process(target=reader)
+    reader_process.start()
+
+    for i in range(1, 1001):
+        slot.write(np.full(slot.pixels, i, dtype=np.int32), time.time())
+        time.sleep(0.0005)
+
+    reader_process.join()
+    slot.close(unlink=True)
@@ -3,9 +3,14 @@ import struct
 import enum
 from ctypes import *
 import time
+import os
+import mmap
+import zlib
 from statistics import median
 from math import fabs
 
+import numpy as np
+
 
 class I2CAcknowledgeError(Exception):
     pass
@@ -16,6 +21,34 @@ class HAL_MLX90640:
         self.i2c = i2c_handle
         self.i2c_addr = i2c_addr
 
+        # Preallocated big endian frame: 832 RAM words, control register 1 and the status register, filled in
+        # place by read_frame_into. The i2c messages point straight into the buffers and are reused as well.
+        self.frame_buffer = bytearray(834 * 2)
+        self.frame_words = np.frombuffer(self.frame_buffer, dtype=">i2")
+        self.status_buffer = bytearray(2)
+        self.status_write_buffer = bytearray([0x80, 0x00, 0x00, 0x00])
+
+        self.status_addr_msg = self.address_msg(0x8000)
+        self.status_read_msg = self.read_msg(self.status_buffer, 0, 2)
+        self.status_write_msg = self.write_msg(self.status_write_buffer)
+        self.frame_addr_msg = self.address_msg(0x0400)
+        self.frame_read_msg = self.read_msg(self.frame_buffer, 0, 832 * 2)
+        self.control_addr_msg = self.address_msg(0x800D)
+        self.control_read_msg = self.read_msg(self.frame_buffer, 832 * 2, 2)
+
+    def address_msg(self, addr):
+        return i2c_msg.write(self.i2c_addr, [addr >> 8 & 0x00FF, addr & 0x00FF])
+
+    def read_msg(self, buffer, offset, count):
+        msg = i2c_msg.read(self.i2c_addr, count)
+        msg.buf = (c_char * count).from_buffer(buffer, offset)
+        return msg
+
+    def write_msg(self, buffer):
+        msg = i2c_msg.write(self.i2c_addr, buffer)
+        msg.buf = (c_char * len(buffer)).from_buffer(buffer)
+        return msg
+
     def i2c_read(self, addr, count=2):
         addr_msb = addr >> 8 & 0x00FF
         addr_lsb = addr & 0x00FF
@@ -46,13 +79,13 @@ class HAL_MLX90640:
         status_reg = struct.unpack(">H", status_reg[0:2])[0]
         if status_reg & 0x0008:
             # 2. read frame data
-            self.i2c_write( 0x8000, struct.pack("<H", 0x0030))
+            self.i2c_write( 0x8000, struct.pack(">H", 0x0030))
 
             frame_data, status = self.i2c_read(0x0400, 832*2)  # 32 * 26 * 2
             frame_data = list(struct.unpack(">832h", frame_data))
 
             # 3. clear new data available bit.
-            self.i2c_write(0x8000, struct.pack("<H", status_reg & ~0x0008))
+            self.i2c_write(0x8000, struct.pack(">H", status_reg & ~0x0008))
 
             control_reg1, status = self.i2c_read(0x800D, 2)
             control_reg1 = struct.unpack(">H", control_reg1[0:2])[0]
@@ -60,26 +93,131 @@ class HAL_MLX90640:
             return frame_data + [control_reg1, status_reg]   
         else:
             return None    
+
+    def write_status(self, status_reg):
+        struct.pack_into(">H", self.status_write_buffer, 2, status_reg)
+        self.i2c.i2c_rdwr(self.status_write_msg)
+
+    def read_frame_into(self):
+        """
+        Same as read_frame, but the I2C transfers land directly in frame_buffer, so nothing is allocated
+        :return: frame_words, a big endian int16 view of frame_buffer, if a new frame was read, None otherwise.
+                 The view is overwritten by the next frame.
+        """
+        self.i2c.i2c_rdwr(self.status_addr_msg, self.status_read_msg)
+        status_reg = (self.status_buffer[0] << 8) | self.status_buffer[1]
+        if status_reg & 0x0008:
+            self.write_status(0x0030)
+            self.i2c.i2c_rdwr(self.frame_addr_msg, self.frame_read_msg)
+            self.write_status(status_reg & ~0x0008)
+            self.i2c.i2c_rdwr(self.control_addr_msg, self.control_read_msg)
+            self.frame_buffer[833 * 2:834 * 2] = self.status_buffer
+            return self.frame_words
+        else:
+            return None
         
     
 class MLX90640:
     DAQ_CONT_16x12 = 5
     MIN_TEMP_DEGC = -273.15
     LSB_DEGC = 50.0
-
-    def __init__(self, i2c_handle, i2c_addr=0x33, frame_rate=2.0):
+    # pixels, service words and control / status registers of a raw frame
+    FRAME_WORDS = 834
+    # service words of the cyclops (TGC) pixels of each subpage
+    CYCLOPS_INFO_INDEX = ((8, 9), (0x28, 0x29))
+
+    # Compensation engines, do_compensation is the reference
+    ENGINE_PYTHON = "python"
+    ENGINE_NUMPY = "numpy"
+    ENGINE_FIXED = "fixed"
+    ENGINES = [ENGINE_PYTHON, ENGINE_NUMPY, ENGINE_FIXED]
+    # Worst case difference of do_compensation_numpy against do_compensation, in deci-celsius
+    NUMPY_TOLERANCE = 1e-6
+
+    # Fixed point formats of do_compensation_fixed, the values are integers scaled by 2^shift
+    FIXED_PIX_SHIFT = 8                  # offset free pixel data [LSB]
+    FIXED_GAIN_SHIFT = 20                # gain drift compensation
+    FIXED_KSTA_SHIFT = 20                # 1 / dKsTa
+    FIXED_KSTO_SHIFT = 20                # dKsTo = 1 + KsTo * (To1 - To_0_Alpha)
+    FIXED_KSTO_COEF_SHIFT = 30           # KsTo [1/degC]
+    FIXED_TEMP_SHIFT = 16                # temperatures [K]
+    # IR signal in K^4 is clamped to +-2^40 so the following products stay within int64
+    FIXED_SIGNAL_LIMIT = 1 << 40
+    # Fourth root lookup table: 2^13 intervals of 2^25 K^4, so it covers up to 2^38 K^4 (451 degC). Linear
+    # interpolation between the entries is off by less than 0.001 K above -40 degC.
+    FIXED_ROOT_STEP_SHIFT = 25
+    FIXED_ROOT_BITS = 13
+    FIXED_ROOT_LUT = np.rint((np.arange((1 << FIXED_ROOT_BITS) + 1) * float(1 << FIXED_ROOT_STEP_SHIFT)) ** 0.25 *
+                             (1 << FIXED_TEMP_SHIFT)).astype(np.int64)
+    FIXED_ROOT_SLOPE = np.diff(FIXED_ROOT_LUT)
+
+    def __init__(self, i2c_handle, i2c_addr=0x33, frame_rate=2.0, engine=ENGINE_PYTHON, calibration_cache=None,
+                 subpage_incremental=False):
+        self.init_compensation(engine, subpage_incremental)
         self.hw = HAL_MLX90640(i2c_handle, i2c_addr)
         self.i2c_addr = i2c_addr
-        self.calc_params = TCalcParams()
-        self.m_lFilterTgcDepth = 8
-        self.m_arrLastTgc = [[0] * TCalcParams.NUM_PAGES] * TCalcParams.NUM_TGC
-        self.emissivity = 1.0
 
         self.frame_rate = frame_rate
         self.frame_length_bytes = 32 * 26 * 2
         self.eeprom = Mlx90640EEPROM(self)
-        self.eeprom.read_eeprom_from_device()
-        self.calculate_parameters()
+        # memory map of the calibration cache, the calc_params arrays are views on it after a cache hit
+        self.calibration_cache_map = None
+        if calibration_cache is None:
+            self.eeprom.read_eeprom_from_device()
+            self.calculate_parameters()
+        else:
+            # a single read is enough on a hit: its checksum has to match the one of the merged image of the cache
+            self.eeprom.read_eeprom_from_device(consecutive_reads=0)
+            if not self.load_calibration_cache(calibration_cache):
+                self.eeprom.read_eeprom_from_device(merge=True)
+                self.calculate_parameters()
+                self.save_calibration_cache(calibration_cache)
+        self.compile_frame_plan()
+        self.bad_pixel_corrector = BadPixelCorrector(self.eeprom.bad_pixels)
+
+    @classmethod
+    def from_eeprom_image(cls, eeprom_words, engine=ENGINE_PYTHON):
+        """
+        Creates an instance for offline compensation of logged raw frames (process_frame and the do_compensation
+        methods), without any I2C access. read_frame and frame_rate are not available.
+        :param eeprom_words: the 832 EEPROM words, e.g. Mlx90640EEPROM.eeprom of the sensor that took the frames
+        :param engine: compensation engine, one of ENGINES
+        :return: the MLX90640 instance
+        """
+        mlx = cls.__new__(cls)
+        mlx.init_compensation(engine, subpage_incremental=False)
+        mlx.hw = None
+        mlx.i2c_addr = None
+        mlx.frame_length_bytes = 32 * 26 * 2
+        mlx.eeprom = Mlx90640EEPROM(mlx)
+        mlx.eeprom.load_image(eeprom_words)
+        mlx.calculate_parameters()
+        mlx.compile_frame_plan()
+        mlx.bad_pixel_corrector = BadPixelCorrector(mlx.eeprom.bad_pixels)
+        return mlx
+
+    def init_compensation(self, engine, subpage_incremental):
+        """
+        Sets up the compensation state shared by the sensor and offline instances
+        """
+        if engine not in MLX90640.ENGINES:
+            raise ValueError("Invalid compensation engine: {}; valid values are {}".format(engine, MLX90640.ENGINES))
+        self.engine = engine
+        # numpy and fixed engines only: recompensate just the subpage that was measured last and merge it into the frame
+        self.subpage_incremental = subpage_incremental
+        self.calc_params = TCalcParams()
+        self.m_lDaqFrameIdx = 0
+        self.m_lFilterTgcDepth = 8
+        self.m_arrLastTgc = [[0] * TCalcParams.NUM_PAGES] * TCalcParams.NUM_TGC
+        # cyclops compensation of the last frame, filled in place by compensation_constants
+        self.arrdCyclops = [0.0] * TCalcParams.NUM_PAGES
+        self.arrdAlphaCyclops = [0.0] * TCalcParams.NUM_PAGES
+        self.emissivity = 1.0
+        self.frame_plan = None
+        # Ambient temperature [degC] and supply [V] drift tolerated before the frame plan offsets are refolded,
+        # at these values the folded offsets cost well under 0.05 degC
+        self.frame_plan_ta_tolerance = 0.01
+        self.frame_plan_vdd_tolerance = 0.001
 
 
     @property
@@ -119,17 +257,16 @@ class MLX90640:
         else:
             return None
 
-    def do_compensation(self, raw_frame, add_ambient_temperature=False):
+    def compensation_constants(self, info_data):
         """
-        Calculates the temperatures for each pixel
-        :param raw_frame: the raw frame
-        :param add_ambient_temperature: flag to add ambient temperature at the end of the frame array.
-        :return: the calculated frame as a one dimensional array
+        Calculates the per-frame scalars shared by every pixel (ambient temperature, supply and gain drift,
+        cyclops compensation). Used by all compensation engines.
+        :param info_data: the service words of the raw frame (everything after the pixel data), a list or an int64
+                          numpy array
+        :return: tuple (Tamb, tidx, dDeltaTa, dDeltaV, dGainComp, arrdCyclops, arrdAlphaCyclops, dKsTa, dTaPow4),
+                 the two lists are owned by the instance and overwritten by the next call
         """
 
-        np = 32 * 24
-        info_data = raw_frame[np:]
-
         # Calculation of actual Vdd [V] by MLX90640
         if fabs(self.calc_params.Kv_Vdd) < 1e-6:
             raise ValueError("Kv_Vdd is too small")
@@ -155,8 +292,6 @@ class MLX90640:
         Tamb = (VPTAT_virt / d2 - self.calc_params.VPTAT_25) / self.calc_params.Kt_PTAT + 25
         info_data[2] = round((Tamb - MLX90640.MIN_TEMP_DEGC) * MLX90640.LSB_DEGC)
 
-        lControl1 = self.eeprom.get_parameter_code(ParameterCodesEEPROM.CodeControl1)
-
         tidx = 0
         if self.calc_params.version >= 2:
             minTdiff = 9999.0
@@ -182,22 +317,20 @@ class MLX90640:
         dGainComp = self.calc_params.GainMeas_25_3v2 / info_data[10]
 
         # Compensate cyclops
-        pCyclopIdx0 = [8, 9]
-        pCyclopIdx1 = [0x28, 0x29]
         # int page = m_lDaqFrameIdx & 1;
-        arrdCyclops = [0 for i in range(TCalcParams.NUM_PAGES)]  # accumulates all cyclops
+        arrdCyclops = self.arrdCyclops  # accumulates all cyclops
         dKsTa = 1.0
-        arrdAlphaCyclops = [0 for i in range(TCalcParams.NUM_PAGES)]
+        arrdAlphaCyclops = self.arrdAlphaCyclops
         for page in range(TCalcParams.NUM_PAGES):
-            arrdCyclops[page] = 0
-            arrdAlphaCyclops[page] = 0
+            arrdCyclops[page] = 0.0
+            arrdAlphaCyclops[page] = 0.0
 
         if self.calc_params.version >= 2:
             dKsTa = 1 + self.calc_params.KsTa * (Tamb - self.calc_params.Ta_0_Alpha)
             if fabs(dKsTa) < 1e-12:
                 raise ValueError("Calculated KsTa is zero")
             for page in range(TCalcParams.NUM_PAGES):
-                pCyclopIdx = pCyclopIdx1 if page else pCyclopIdx0
+                pCyclopIdx = MLX90640.CYCLOPS_INFO_INDEX[page]
                 for i in range(TCalcParams.NUM_TGC):
                     if fabs(self.calc_params.TGC[i]) > 1e-12:
                         tgcValue = info_data[pCyclopIdx[i]]
@@ -229,11 +362,30 @@ class MLX90640:
 
         dTaPow4 = pow(Tamb - MLX90640.MIN_TEMP_DEGC, 4)
 
+        return Tamb, tidx, dDeltaTa, dDeltaV, dGainComp, arrdCyclops, arrdAlphaCyclops, dKsTa, dTaPow4
+
+    def do_compensation(self, raw_frame, add_ambient_temperature=False):
+        """
+        Calculates the temperatures for each pixel. This is the scalar reference implementation, the other
+        engines are checked against it.
+        :param raw_frame: the raw frame
+        :param add_ambient_temperature: flag to add ambient temperature at the end of the frame array.
+        :return: the calculated frame as a one dimensional array
+        """
+
+        num_pixels = 32 * 24
+        info_data = raw_frame[num_pixels:]
+
+        Tamb, tidx, dDeltaTa, dDeltaV, dGainComp, arrdCyclops, arrdAlphaCyclops, dKsTa, dTaPow4 = \
+            self.compensation_constants(info_data)
+
+        lControl1 = self.eeprom.get_parameter_code(ParameterCodesEEPROM.CodeControl1)
+
         # resulting frame without service data
 
         result_frame = [0] * (32 * 24)
 
-        for i in range(np):
+        for i in range(num_pixels):
             if lControl1 & (1 << 12):
                 page = (i & 1) ^ ((i // 32) & 1)  # Chess pattern mode
             else:
@@ -284,6 +436,398 @@ class MLX90640:
             result_frame.append(Tamb)
         return result_frame
 
+    def compile_frame_plan(self):
+        """
+        Compiles the per-pixel calibration in calc_params into a TFramePlan for the numpy and fixed engines: page map,
+        effective alpha per page and the offset coefficients as contiguous arrays, both for the whole frame and
+        gathered per subpage. Needs to be called again whenever calc_params changes.
+        :return: nothing
+        """
+        plan = TFramePlan()
+        num_pixels = 32 * 24
+        pixel_idx = np.arange(num_pixels)
+        lControl1 = self.eeprom.get_parameter_code(ParameterCodesEEPROM.CodeControl1)
+        if lControl1 & (1 << 12):
+            plan.page_map = (pixel_idx & 1) ^ ((pixel_idx // 32) & 1)  # Chess pattern mode
+        else:
+            plan.page_map = (pixel_idx // 32) % 2  # Interlaced  mode
+
+        # The cyclops alpha only depends on the calibration, fold it into the pixel alpha once
+        arrdAlphaCyclops = [0.0] * TCalcParams.NUM_PAGES
+        if self.calc_params.version >= 2:
+            for page in range(TCalcParams.NUM_PAGES):
+                for i in range(TCalcParams.NUM_TGC):
+                    if fabs(self.calc_params.TGC[i]) > 1e-12:
+                        arrdAlphaCyclops[page] += self.calc_params.alpha_TGC[page][i] * self.calc_params.TGC[i]
+        alpha = np.array(self.calc_params.alpha, dtype=np.float64) - np.array(arrdAlphaCyclops)[plan.page_map]
+        plan.alpha_valid = np.abs(alpha) >= 1e-12
+        plan.inv_alpha = np.zeros(num_pixels)
+        plan.inv_alpha[plan.alpha_valid] = 1.0 / alpha[plan.alpha_valid]
+
+        plan.Pix_os_ref = np.array(self.calc_params.Pix_os_ref, dtype=np.float64)
+        plan.Kta = np.array(self.calc_params.Kta, dtype=np.float64)
+        plan.Kv = np.array(self.calc_params.Kv, dtype=np.float64)
+        plan.Pix_os = np.zeros(num_pixels)
+
+        plan.page_pixels = [np.flatnonzero(plan.page_map == page) for page in range(TCalcParams.NUM_PAGES)]
+        plan.page_alpha_valid = [plan.alpha_valid[idx] for idx in plan.page_pixels]
+        plan.page_inv_alpha = [plan.inv_alpha[idx] for idx in plan.page_pixels]
+        plan.page_Pix_os = [np.zeros(len(idx)) for idx in plan.page_pixels]
+
+        plan.page_cyclops = np.zeros(TCalcParams.NUM_PAGES)
+        plan.Pix_GainComp = np.zeros(num_pixels)
+        plan.work = TPixelWork(num_pixels)
+        plan.page_work = [TPixelWork(len(idx)) for idx in plan.page_pixels]
+        plan.result_frame = np.zeros(num_pixels)
+        plan.result_frame_ambient = np.zeros(num_pixels + 1)
+        plan.result_frame_int = np.zeros(num_pixels, dtype=int)
+        # int32 holds both the signed pixels and the unsigned service words of a list frame
+        plan.raw_words = np.zeros(MLX90640.FRAME_WORDS, dtype=np.int32)
+        plan.raw_words16 = np.zeros(MLX90640.FRAME_WORDS, dtype=np.int16)
+        plan.raw_pixels = plan.raw_words[:num_pixels]
+        plan.raw_info = plan.raw_words[num_pixels:]
+        plan.info_data = np.zeros(MLX90640.FRAME_WORDS - num_pixels, dtype=np.int64)
+
+        # Same coefficients scaled to integers for the fixed point engine
+        plan.inv_alpha_q = np.rint(plan.inv_alpha).astype(np.int64)
+        plan.page_inv_alpha_q = [plan.inv_alpha_q[idx] for idx in plan.page_pixels]
+        plan.Pix_os_q = np.zeros(num_pixels, dtype=np.int64)
+        plan.page_Pix_os_q = [np.zeros(len(idx), dtype=np.int64) for idx in plan.page_pixels]
+        plan.page_cyclops_q = np.zeros(TCalcParams.NUM_PAGES, dtype=np.int64)
+        plan.Pix_GainComp_q = np.zeros(num_pixels, dtype=np.int64)
+        plan.KsTo_q = round(self.calc_params.KsTo * (1 << MLX90640.FIXED_KSTO_COEF_SHIFT))
+        plan.To_0_Alpha_q = round((self.calc_params.To_0_Alpha - MLX90640.MIN_TEMP_DEGC) *
+                                  (1 << MLX90640.FIXED_TEMP_SHIFT))
+        plan.result_frame_fixed = np.zeros(num_pixels, dtype=np.int64)
+        plan.result_frame_fixed_ambient = np.zeros(num_pixels + 1, dtype=np.int64)
+        self.frame_plan = plan
+
+    def fold_frame_plan(self, tidx, dDeltaTa, dDeltaV):
+        """
+        Folds the offset compensation of the frame plan for the given ambient temperature and supply voltage.
+        :param int tidx: calibration range
+        :param float dDeltaTa: ambient temperature delta [degC]
+        :param float dDeltaV: supply voltage delta [V]
+        :return: nothing
+        """
+        plan = self.frame_plan
+        np.multiply(plan.Pix_os_ref[tidx] * (1 + plan.Kta[tidx] * dDeltaTa), 1 + plan.Kv[tidx] * dDeltaV,
+                    out=plan.Pix_os)
+        np.copyto(plan.Pix_os_q, np.rint(plan.Pix_os * (1 << MLX90640.FIXED_PIX_SHIFT)), casting="unsafe")
+        for page in range(TCalcParams.NUM_PAGES):
+            np.take(plan.Pix_os, plan.page_pixels[page], out=plan.page_Pix_os[page])
+            np.take(plan.Pix_os_q, plan.page_pixels[page], out=plan.page_Pix_os_q[page])
+        plan.tidx = tidx
+        plan.dDeltaTa = dDeltaTa
+        plan.dDeltaV = dDeltaV
+
+    def compensate_pixels(self, work, inv_alpha, alpha_valid, dKsTa, dTaPow4):
+        """
+        Object temperature of offset free pixels, the part of do_compensation_numpy shared by the whole frame and
+        single subpage paths
+        :param TPixelWork work: Pix_comp holds the offset and cyclops compensated pixels, result receives the
+                                temperatures in deci-celsius
+        :param inv_alpha: 1 / effective alpha of the pixels
+        :param alpha_valid: False where the effective alpha is zero
+        :param float dKsTa: KsTa and emissivity compensation of the frame
+        :param float dTaPow4: (Tamb - MIN_TEMP_DEGC) ^ 4
+        :return: work.result
+        """
+        Pix_comp, d, To, valid, invalid = work.Pix_comp, work.d, work.To, work.valid, work.invalid
+
+        np.multiply(Pix_comp, inv_alpha, out=Pix_comp)
+        np.divide(Pix_comp, dKsTa, out=Pix_comp)
+
+        # Calculate object temperature, pixels failing any check are clamped to MIN_TEMP_DEGC
+
+        # pass1
+        np.add(Pix_comp, dTaPow4, out=d)
+        np.greater_equal(d, 0.0, out=valid)
+        np.logical_and(valid, alpha_valid, out=valid)
+        np.logical_not(valid, out=invalid)
+        np.copyto(d, 0.0, where=invalid)
+        np.power(d, 0.25, out=To)
+        np.add(To, MLX90640.MIN_TEMP_DEGC, out=To)
+
+        # pass2
+        if self.calc_params.version >= 2:
+            # dKsTo = 1 + KsTo * (To1 - To_0_Alpha)
+            np.subtract(To, self.calc_params.To_0_Alpha, out=d)
+            np.multiply(d, self.calc_params.KsTo, out=d)
+            np.add(d, 1.0, out=d)
+            np.divide(Pix_comp, d, out=d)
+            np.add(d, dTaPow4, out=d)
+            np.greater_equal(d, 0.0, out=invalid)
+            np.logical_and(valid, invalid, out=valid)
+            np.logical_not(valid, out=invalid)
+            np.copyto(d, 0.0, where=invalid)
+            np.power(d, 0.25, out=To)
+            np.add(To, MLX90640.MIN_TEMP_DEGC, out=To)
+
+        np.copyto(To, MLX90640.MIN_TEMP_DEGC, where=invalid)
+
+        # Convert to deci-celsiuis
+        return np.multiply(To, 10.0, out=work.result)
+
+    def load_raw_frame(self, raw_frame):
+        """
+        Copies a raw frame into the raw_words of the frame plan, native integers instead of the big endian words
+        :param raw_frame: the raw frame (FRAME_WORDS words), a list or an integer numpy array
+        :return: plan.info_data, the service words in int64 so the scalar math cannot overflow
+        """
+        plan = self.frame_plan
+        # A 16 bit frame is byte swapped on its own first: a cast combined with the swap needs a temporary buffer
+        if isinstance(raw_frame, np.ndarray) and raw_frame.dtype.itemsize == 2:
+            np.copyto(plan.raw_words16, raw_frame, casting="unsafe")
+            np.copyto(plan.raw_words, plan.raw_words16)
+        else:
+            np.copyto(plan.raw_words, raw_frame, casting="unsafe")
+        np.copyto(plan.info_data, plan.raw_info)
+        return plan.info_data
+
+    def do_compensation_numpy(self, raw_frame, add_ambient_temperature=False, subpage=None):
+        """
+        Calculates the temperatures for each pixel on the whole frame at once using the frame plan. Same math
+        as do_compensation; with both frame plan tolerances at 0 the results agree with it within NUMPY_TOLERANCE
+        (deci-celsius). Larger tolerances trade a small offset error for folding the offsets less often.
+        All intermediate arrays live in the frame plan, so no pixel arrays are allocated per frame.
+        :param raw_frame: the raw frame (FRAME_WORDS words), a list or an integer numpy array
+                          (e.g. HAL_MLX90640.frame_words)
+        :param add_ambient_temperature: flag to add ambient temperature at the end of the frame array.
+        :param subpage: None to compensate every pixel, or 0/1 to only compensate the pixels of that subpage and
+                        merge them into the previous result (the other subpage keeps its last temperatures)
+        :return: the calculated frame as a float64 numpy array. It is owned by the frame plan and overwritten by
+                 the next call, copy it to keep it.
+        """
+
+        num_pixels = 32 * 24
+        plan = self.frame_plan
+        info_data = self.load_raw_frame(raw_frame)
+
+        Tamb, tidx, dDeltaTa, dDeltaV, dGainComp, arrdCyclops, arrdAlphaCyclops, dKsTa, dTaPow4 = \
+            self.compensation_constants(info_data)
+
+        if plan.tidx != tidx or fabs(plan.dDeltaTa - dDeltaTa) > self.frame_plan_ta_tolerance or \
+                fabs(plan.dDeltaV - dDeltaV) > self.frame_plan_vdd_tolerance:
+            self.fold_frame_plan(tidx, dDeltaTa, dDeltaV)
+
+        # Until both subpages have been compensated once there is nothing to merge into
+        if subpage is not None and not plan.result_complete:
+            subpage = None
+
+        # 1. Gain drift compensation
+        np.copyto(plan.Pix_GainComp, plan.raw_pixels)
+        np.multiply(plan.Pix_GainComp, dGainComp, out=plan.Pix_GainComp)
+
+        if subpage is None:
+            # 2. Pixel offset compensation, 3. offset free IR data
+            work = plan.work
+            np.subtract(plan.Pix_GainComp, plan.Pix_os, out=work.Pix_comp)
+            for page in range(TCalcParams.NUM_PAGES):
+                plan.page_cyclops[page] = arrdCyclops[page]
+            np.take(plan.page_cyclops, plan.page_map, out=work.d, mode="clip")
+            np.subtract(work.Pix_comp, work.d, out=work.Pix_comp)
+
+            np.copyto(plan.result_frame, self.compensate_pixels(work, plan.inv_alpha, plan.alpha_valid, dKsTa, dTaPow4))
+            plan.result_complete = True
+        else:
+            # Same on the subpage only, every pixel of it shares one cyclops value
+            work = plan.page_work[subpage]
+            np.take(plan.Pix_GainComp, plan.page_pixels[subpage], out=work.Pix_comp, mode="clip")
+            np.subtract(work.Pix_comp, plan.page_Pix_os[subpage], out=work.Pix_comp)
+            np.subtract(work.Pix_comp, arrdCyclops[subpage], out=work.Pix_comp)
+
+            plan.result_frame[plan.page_pixels[subpage]] = self.compensate_pixels(
+                work, plan.page_inv_alpha[subpage], plan.page_alpha_valid[subpage], dKsTa, dTaPow4)
+
+        if add_ambient_temperature:
+            plan.result_frame_ambient[:num_pixels] = plan.result_frame
+            plan.result_frame_ambient[num_pixels] = Tamb
+            return plan.result_frame_ambient
+        return plan.result_frame
+
+    def fourth_root_fixed(self, d, work):
+        """
+        Fourth root by table lookup and linear interpolation
+        :param d: int64 array [K^4], clamped in place to the range of FIXED_ROOT_LUT
+        :param TPixelWork work: provides the index scratch arrays, T_q receives the result
+        :return: work.T_q, d^(1/4) [K] scaled by 2^FIXED_TEMP_SHIFT
+        """
+        step_shift = MLX90640.FIXED_ROOT_STEP_SHIFT
+        np.minimum(d, (1 << (MLX90640.FIXED_ROOT_BITS + step_shift)) - 1, out=d)
+        np.right_shift(d, step_shift, out=work.idx)
+        np.bitwise_and(d, (1 << step_shift) - 1, out=work.frac)
+        np.take(MLX90640.FIXED_ROOT_SLOPE, work.idx, out=work.slope, mode="clip")
+        np.multiply(work.slope, work.frac, out=work.slope)
+        np.right_shift(work.slope, step_shift, out=work.slope)
+        np.take(MLX90640.FIXED_ROOT_LUT, work.idx, out=work.T_q, mode="clip")
+        return np.add(work.T_q, work.slope, out=work.T_q)
+
+    def compensate_pixels_fixed(self, work, inv_alpha_q, alpha_valid, dKsTa, dTaPow4):
+        """
+        Fixed point version of compensate_pixels: integer multiplies and shifts with the scaled coefficients of
+        the frame plan, one integer division per pixel for KsTo and fourth_root_fixed for the roots
+        :param TPixelWork work: Pix_comp_q holds the offset and cyclops compensated pixels scaled by
+                                2^FIXED_PIX_SHIFT, result_q receives the temperatures in deci-celsius
+        :param inv_alpha_q: 1 / effective alpha of the pixels, rounded to integer
+        :param alpha_valid: False where the effective alpha is zero
+        :param float dKsTa: KsTa and emissivity compensation of the frame
+        :param float dTaPow4: (Tamb - MIN_TEMP_DEGC) ^ 4
+        :return: work.result_q
+        """
+        plan = self.frame_plan
+        x, d, T = work.x_q, work.d_q, work.T_q
+        valid, invalid = work.valid, work.invalid
+        TaPow4_q = round(dTaPow4)
+
+        # IR signal [K^4]
+        np.multiply(work.Pix_comp_q, inv_alpha_q, out=x)
+        np.right_shift(x, MLX90640.FIXED_PIX_SHIFT, out=x)
+        np.clip(x, -MLX90640.FIXED_SIGNAL_LIMIT, MLX90640.FIXED_SIGNAL_LIMIT, out=x)
+        np.multiply(x, round((1 << MLX90640.FIXED_KSTA_SHIFT) / dKsTa), out=x)
+        np.right_shift(x, MLX90640.FIXED_KSTA_SHIFT, out=x)
+
+        # pass1
+        np.add(x, TaPow4_q, out=d)
+        np.greater_equal(d, 0, out=valid)
+        np.logical_and(valid, alpha_valid, out=valid)
+        np.logical_not(valid, out=invalid)
+        np.copyto(d, 0, where=invalid)
+        self.fourth_root_fixed(d, work)
+
+        # pass2
+        if self.calc_params.version >= 2:
+            # dKsTo = 1 + KsTo * (To1 - To_0_Alpha)
+            np.subtract(T, plan.To_0_Alpha_q, out=d)
+            np.multiply(d, plan.KsTo_q, out=d)
+            np.right_shift(d, MLX90640.FIXED_KSTO_COEF_SHIFT + MLX90640.FIXED_TEMP_SHIFT -
+                           MLX90640.FIXED_KSTO_SHIFT, out=d)
+            np.add(d, 1 << MLX90640.FIXED_KSTO_SHIFT, out=d)
+            np.maximum(d, 1, out=d)
+            np.left_shift(x, MLX90640.FIXED_KSTO_SHIFT, out=x)
+            np.floor_divide(x, d, out=d)
+            np.add(d, TaPow4_q, out=d)
+            np.greater_equal(d, 0, out=invalid)
+            np.logical_and(valid, invalid, out=valid)
+            np.logical_not(valid, out=invalid)
+            np.copyto(d, 0, where=invalid)
+            self.fourth_root_fixed(d, work)
+
+        # Convert to deci-celsius, rounded to nearest
+        np.multiply(T, 10, out=T)
+        np.subtract(T, round(-MLX90640.MIN_TEMP_DEGC * 10 * (1 << MLX90640.FIXED_TEMP_SHIFT)) -
+                    (1 << (MLX90640.FIXED_TEMP_SHIFT - 1)), out=T)
+        np.right_shift(T, MLX90640.FIXED_TEMP_SHIFT, out=work.result_q)
+        np.copyto(work.result_q, int(MLX90640.MIN_TEMP_DEGC * 10), where=invalid)
+        return work.result_q
+
+    def do_compensation_fixed(self, raw_frame, add_ambient_temperature=False, subpage=None):
+        """
+        Calculates the temperatures for each pixel like do_compensation_numpy, but in fixed point integer
+        arithmetic: the frame plan holds the offsets and 1 / alpha scaled to integers and the fourth roots come
+        from FIXED_ROOT_LUT. Only the per-frame scalars (compensation_constants) are still computed in floating
+        point. Use fixed_point_error_bound to check the accuracy against the float engines.
+        :param raw_frame: the raw frame, a list or an integer numpy array (e.g. HAL_MLX90640.frame_words)
+        :param add_ambient_temperature: flag to add ambient temperature (deci-celsius) at the end of the frame array.
+        :param subpage: None to compensate every pixel, or 0/1 to only compensate the pixels of that subpage and
+                        merge them into the previous result
+        :return: the calculated frame as an int64 numpy array in deci-celsius. It is owned by the frame plan and
+                 overwritten by the next call, copy it to keep it.
+        """
+
+        num_pixels = 32 * 24
+        plan = self.frame_plan
+        info_data = self.load_raw_frame(raw_frame)
+
+        Tamb, tidx, dDeltaTa, dDeltaV, dGainComp, arrdCyclops, arrdAlphaCyclops, dKsTa, dTaPow4 = \
+            self.compensation_constants(info_data)
+
+        if plan.tidx != tidx or fabs(plan.dDeltaTa - dDeltaTa) > self.frame_plan_ta_tolerance or \
+                fabs(plan.dDeltaV - dDeltaV) > self.frame_plan_vdd_tolerance:
+            self.fold_frame_plan(tidx, dDeltaTa, dDeltaV)
+
+        if subpage is not None and not plan.result_fixed_complete:
+            subpage = None
+
+        # 1. Gain drift compensation, scaled to FIXED_PIX_SHIFT
+        np.copyto(plan.Pix_GainComp_q, plan.raw_pixels)
+        np.multiply(plan.Pix_GainComp_q, round(dGainComp * (1 << MLX90640.FIXED_GAIN_SHIFT)),
+                    out=plan.Pix_GainComp_q)
+        np.right_shift(plan.Pix_GainComp_q, MLX90640.FIXED_GAIN_SHIFT - MLX90640.FIXED_PIX_SHIFT,
+                       out=plan.Pix_GainComp_q)
+        for page in range(TCalcParams.NUM_PAGES):
+            plan.page_cyclops_q[page] = round(arrdCyclops[page] * (1 << MLX90640.FIXED_PIX_SHIFT))
+
+        if subpage is None:
+            # 2. Pixel offset compensation, 3. offset free IR data
+            work = plan.work
+            np.subtract(plan.Pix_GainComp_q, plan.Pix_os_q, out=work.Pix_comp_q)
+            np.take(plan.page_cyclops_q, plan.page_map, out=work.d_q, mode="clip")
+            np.subtract(work.Pix_comp_q, work.d_q, out=work.Pix_comp_q)
+
+            np.copyto(plan.result_frame_fixed,
+                      self.compensate_pixels_fixed(work, plan.inv_alpha_q, plan.alpha_valid, dKsTa, dTaPow4))
+            plan.result_fixed_complete = True
+        else:
+            work = plan.page_work[subpage]
+            np.take(plan.Pix_GainComp_q, plan.page_pixels[subpage], out=work.Pix_comp_q, mode="clip")
+            np.subtract(work.Pix_comp_q, plan.page_Pix_os_q[subpage], out=work.Pix_comp_q)
+            np.subtract(work.Pix_comp_q, plan.page_cyclops_q[subpage], out=work.Pix_comp_q)
+
+            plan.result_frame_fixed[plan.page_pixels[subpage]] = self.compensate_pixels_fixed(
+                work, plan.page_inv_alpha_q[subpage], plan.page_alpha_valid[subpage], dKsTa, dTaPow4)
+
+        if add_ambient_temperature:
+            plan.result_frame_fixed_ambient[:num_pixels] = plan.result_frame_fixed
+            plan.result_frame_fixed_ambient[num_pixels] = round(Tamb * 10)
+            return plan.result_frame_fixed_ambient
+        return plan.result_frame_fixed
+
+    def fixed_point_error_bound(self, raw_frame, min_temp=-40.0, max_temp=300.0, step=5.0):
+        """
+        Measures the error of do_compensation_fixed against the float engine (do_compensation_numpy, itself within
+        NUMPY_TOLERANCE of do_compensation) over a range of object temperatures. Every pixel is fed synthetic
+        readings, computed backwards from the target temperatures, with the service words (ambient temperature,
+        supply, gain, cyclops) of raw_frame.
+        The results of both engines are restored afterwards, the frame plan stays folded for raw_frame.
+        :param raw_frame: a raw frame of the sensor providing the operating conditions
+        :param float min_temp: lowest object temperature [degC]
+        :param float max_temp: highest object temperature [degC]
+        :param float step: object temperature step [degC]
+        :return: worst absolute difference in deci-celsius over all valid pixels, rounding included
+        """
+        num_pixels = 32 * 24
+        info_data = [int(v) for v in raw_frame[num_pixels:]]
+
+        Tamb, tidx, dDeltaTa, dDeltaV, dGainComp, arrdCyclops, arrdAlphaCyclops, dKsTa, dTaPow4 = \
+            self.compensation_constants(info_data)
+
+        plan = self.frame_plan
+        self.fold_frame_plan(tidx, dDeltaTa, dDeltaV)
+        saved = (plan.result_frame.copy(), plan.result_complete,
+                 plan.result_frame_fixed.copy(), plan.result_fixed_complete)
+
+        # offset free signal of each pixel for an object temperature, ignoring KsTo
+        alpha = np.zeros(num_pixels)
+        alpha[plan.alpha_valid] = 1.0 / plan.inv_alpha[plan.alpha_valid]
+        offset = plan.Pix_os + np.array(arrdCyclops)[plan.page_map]
+
+        frame = np.zeros(len(raw_frame), dtype=np.int64)
+        frame[num_pixels:] = info_data
+        worst = 0.0
+        for temp in np.arange(min_temp, max_temp + step / 2, step):
+            signal = (pow(temp - MLX90640.MIN_TEMP_DEGC, 4) - dTaPow4) * dKsTa * alpha
+            frame[:num_pixels] = np.clip(np.rint((signal + offset) / dGainComp), -32768, 32767)
+
+            reference = self.do_compensation_numpy(frame)
+            fixed = self.do_compensation_fixed(frame)
+            checked = plan.alpha_valid & (reference >= min_temp * 10) & (reference <= max_temp * 10)
+            if np.any(checked):
+                worst = max(worst, float(np.max(np.abs(fixed[checked] - reference[checked]))))
+
+        plan.result_frame[:], plan.result_complete, plan.result_frame_fixed[:], plan.result_fixed_complete = saved
+        return worst
+
     @property
     def emissivity(self):
         return self.m_fEmissivity
@@ -328,24 +872,15 @@ class MLX90640:
         Scale_occ_col = 1 << l
         l = self.eeprom.get_parameter_code(ParameterCodesEEPROM.CodeScale_Occ_row)
         Scale_occ_row = 1 << l
-        OccRow = [0] * 24
-        OccCol = [0] * 32
-        for r in range(24):
-            l = self.eeprom.get_parameter_code(ParameterCodesEEPROM.CodeOCC_row, r)
-            OccRow[r] = ((l - 16) if (l > 7) else l) * Scale_occ_row
-
-        for c in range(32):
-            l = self.eeprom.get_parameter_code(ParameterCodesEEPROM.CodeOCC_column, c)
-            OccCol[c] = ((l - 16) if (l > 7) else l) * Scale_occ_col
-
-        for r in range(24):
-            for c in range(32):
-                idx = r * 32 + c
-                l = self.eeprom.get_parameter_code(ParameterCodesEEPROM.CodePixel_Offset, idx)
-                self.calc_params.Pix_os_ref[0][idx] = Pix_os_average + OccRow[r] + OccCol[c] + \
-                                                        ((l - 64) if (l > 31) else l) * Scale_occ_rem
-                for t in range(1, TCalcParams.MAX_CAL_RANGES):
-                    self.calc_params.Pix_os_ref[t][idx] = self.calc_params.Pix_os_ref[0][idx]
+        l = self.eeprom.get_parameter_codes(ParameterCodesEEPROM.CodeOCC_row)
+        OccRow = np.where(l > 7, l - 16, l) * Scale_occ_row
+        l = self.eeprom.get_parameter_codes(ParameterCodesEEPROM.CodeOCC_column)
+        OccCol = np.where(l > 7, l - 16, l) * Scale_occ_col
+
+        l = self.eeprom.get_parameter_codes(ParameterCodesEEPROM.CodePixel_Offset).reshape(24, 32)
+        Pix_os_ref = Pix_os_average + OccRow[:, None] + OccCol[None, :] + np.where(l > 31, l - 64, l) * Scale_occ_rem
+        for t in range(TCalcParams.MAX_CAL_RANGES):
+            self.calc_params.Pix_os_ref[t] = Pix_os_ref.ravel().tolist()
 
         l = self.eeprom.get_parameter_code(ParameterCodesEEPROM.CodeAlpha_scale)
         Alpha_scale = (1 << l) * (1 << 30)
@@ -357,22 +892,15 @@ class MLX90640:
         Scale_Acc_col = 1 << l
         l = self.eeprom.get_parameter_code(ParameterCodesEEPROM.CodeScale_Acc_row)
         Scale_Acc_row = 1 << l
-        AccRow = [0] * 24
-        AccCol = [0] * 32
-        for r in range(24):
-            l = self.eeprom.get_parameter_code(ParameterCodesEEPROM.CodeACC_row, r)
-            AccRow[r] = ((l - 16) if (l > 7) else l) * Scale_Acc_row
-
-        for c in range(32):
-            l = self.eeprom.get_parameter_code(ParameterCodesEEPROM.CodeACC_column, c)
-            AccCol[c] = ((l - 16) if (l > 7) else l) * Scale_Acc_col
-
-        for r in range(24):
-            for c in range(32):
-                idx = r * 32 + c
-                l = self.eeprom.get_parameter_code(ParameterCodesEEPROM.CodePixel_Alpha, idx)
-                self.calc_params.alpha[idx] = (Pix_sens_average + AccRow[r] + AccCol[c] +
-                                                ((l - 64) if (l > 31) else l) * Scale_Acc_rem) / Alpha_scale
+        l = self.eeprom.get_parameter_codes(ParameterCodesEEPROM.CodeACC_row)
+        AccRow = np.where(l > 7, l - 16, l) * Scale_Acc_row
+        l = self.eeprom.get_parameter_codes(ParameterCodesEEPROM.CodeACC_column)
+        AccCol = np.where(l > 7, l - 16, l) * Scale_Acc_col
+
+        l = self.eeprom.get_parameter_codes(ParameterCodesEEPROM.CodePixel_Alpha).reshape(24, 32)
+        alpha = (Pix_sens_average + AccRow[:, None] + AccCol[None, :] +
+                 np.where(l > 31, l - 64, l) * Scale_Acc_rem) / Alpha_scale
+        self.calc_params.alpha = alpha.ravel().tolist()
 
         Kta = [[0, 0], [0, 0]]
         l = self.eeprom.get_parameter_code(ParameterCodesEEPROM.CodeKta_scale1)
@@ -387,13 +915,12 @@ class MLX90640:
         Kta[1][0] = c_int8(l).value
         l = self.eeprom.get_parameter_code(ParameterCodesEEPROM.CodeKta_Avg_RE_CE)
         Kta[1][1] = c_int8(l).value
-        for r in range(24):
-            for c in range(32):
-                idx = r * 32 + c
-                l = self.eeprom.get_parameter_code(ParameterCodesEEPROM.CodePixel_Kta, idx)
-                self.calc_params.Kta[0][idx] = (((l - 8) if (l > 3) else l) * Kta_scale2 + Kta[r % 2][c % 2]) / Kta_scale1
-                for t in range(1, TCalcParams.MAX_CAL_RANGES):
-                    self.calc_params.Kta[t][idx] = self.calc_params.Kta[0][idx]
+        # Kta[r % 2][c % 2] for every pixel
+        Kta = np.tile(np.array(Kta), (12, 16))
+        l = self.eeprom.get_parameter_codes(ParameterCodesEEPROM.CodePixel_Kta).reshape(24, 32)
+        Pixel_Kta = (np.where(l > 3, l - 8, l) * Kta_scale2 + Kta) / Kta_scale1
+        for t in range(TCalcParams.MAX_CAL_RANGES):
+            self.calc_params.Kta[t] = Pixel_Kta.ravel().tolist()
 
         Kv = [[0, 0], [0, 0]]
         l = self.eeprom.get_parameter_code(ParameterCodesEEPROM.CodeKv_scale)
@@ -406,12 +933,9 @@ class MLX90640:
         Kv[1][0] = ((l - 16) if (l > 7) else l) / Kv_scale
         l = self.eeprom.get_parameter_code(ParameterCodesEEPROM.CodeKv_Avg_RE_CE)
         Kv[1][1] = ((l - 16) if (l > 7) else l) / Kv_scale
-        for r in range(24):
-            for c in range(32):
-                idx = r * 32 + c
-                self.calc_params.Kv[0][idx] = Kv[r % 2][c % 2]
-                for t in range(1, TCalcParams.MAX_CAL_RANGES):
-                    self.calc_params.Kv[t][idx] = self.calc_params.Kv[0][idx]
+        Pixel_Kv = np.tile(np.array(Kv), (12, 16))
+        for t in range(TCalcParams.MAX_CAL_RANGES):
+            self.calc_params.Kv[t] = Pixel_Kv.ravel().tolist()
 
         # as of v.2
         # self.calc_params.Vdd_V0 = 3.3;             # actual value doesn't affect the results
@@ -471,24 +995,142 @@ class MLX90640:
         self.calc_params.KsTo = c_int8(l).value / ScaleKsTo
         # To_0_Alpha;            // default 0.0
 
+    def calibration_cache_path(self, directory):
+        """
+        :param str directory: directory holding the calibration cache files
+        :return: the cache file of the connected sensor, named after its chip ID
+        """
+        return os.path.join(directory, "mlx90640_{:04x}{:04x}{:04x}.cal".format(
+            self.eeprom.get_parameter_code(ParameterCodesEEPROM.CodeID1),
+            self.eeprom.get_parameter_code(ParameterCodesEEPROM.CodeID2),
+            self.eeprom.get_parameter_code(ParameterCodesEEPROM.CodeID3)))
+
+    def save_calibration_cache(self, directory):
+        """
+        Stores calc_params in the calibration cache, keyed by the chip ID and the EEPROM checksum.
+        :param str directory: directory holding the calibration cache files
+        :return: nothing
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = self.calibration_cache_path(directory)
+
+        header = TCalcParams.CACHE_HEADER.pack(TCalcParams.CACHE_MAGIC, TCalcParams.CACHE_VERSION,
+                                               self.calc_params.Id0, self.calc_params.Id1, self.calc_params.Id2,
+                                               self.eeprom.checksum())
+        ints = [getattr(self.calc_params, name) for name in TCalcParams.CACHE_INT_SCALARS]
+        floats = [getattr(self.calc_params, name) for name in TCalcParams.CACHE_FLOAT_SCALARS]
+        arrays = [np.asarray(getattr(self.calc_params, name), dtype="<f8").tobytes()
+                  for name, shape in TCalcParams.CACHE_ARRAYS]
+
+        # write to a temporary file first so a power cut never leaves a truncated cache behind
+        with open(path + ".tmp", "wb") as file_handle:
+            file_handle.write(header)
+            file_handle.write(struct.pack("<{}q".format(len(ints)), *ints))
+            file_handle.write(struct.pack("<{}d".format(len(floats)), *floats))
+            for array in arrays:
+                file_handle.write(array)
+        os.replace(path + ".tmp", path)
+
+    def load_calibration_cache(self, directory):
+        """
+        If the calibration cache holds an entry with the same chip ID and EEPROM checksum as the EEPROM image
+        already read, memory-maps it into calc_params instead of decoding the EEPROM. The arrays are read only
+        numpy views on the mapped file, which stays mapped for the lifetime of the instance, except for the python
+        engine: it indexes single elements, which is about 3 times faster on lists, so it gets lists like
+        calculate_parameters gives it.
+        :param str directory: directory holding the calibration cache files
+        :return: True on a cache hit, False if the EEPROM still has to be decoded
+        """
+        path = self.calibration_cache_path(directory)
+        if not os.path.isfile(path):
+            return False
+
+        with open(path, "rb") as file_handle:
+            cache = mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(cache) != TCalcParams.CACHE_SIZE:
+            cache.close()
+            return False
+        magic, version, id0, id1, id2, checksum = TCalcParams.CACHE_HEADER.unpack_from(cache, 0)
+        if magic != TCalcParams.CACHE_MAGIC or version != TCalcParams.CACHE_VERSION or \
+                checksum != self.eeprom.checksum():
+            cache.close()
+            return False
+
+        offset = TCalcParams.CACHE_HEADER.size
+        ints = struct.unpack_from("<{}q".format(len(TCalcParams.CACHE_INT_SCALARS)), cache, offset)
+        offset += 8 * len(ints)
+        floats = struct.unpack_from("<{}d".format(len(TCalcParams.CACHE_FLOAT_SCALARS)), cache, offset)
+        offset += 8 * len(floats)
+        arrays = []
+        for name, shape in TCalcParams.CACHE_ARRAYS:
+            count = int(np.prod(shape))
+            arrays.append(np.frombuffer(cache, dtype="<f8", count=count, offset=offset).reshape(shape))
+            offset += 8 * count
+
+        for name, value in zip(TCalcParams.CACHE_INT_SCALARS, ints):
+            setattr(self.calc_params, name, value)
+        for name, value in zip(TCalcParams.CACHE_FLOAT_SCALARS, floats):
+            setattr(self.calc_params, name, value)
+        if self.engine == MLX90640.ENGINE_PYTHON:
+            arrays = [array.tolist() for array in arrays]
+            cache.close()
+        else:
+            self.calibration_cache_map = cache
+        for (name, shape), value in zip(TCalcParams.CACHE_ARRAYS, arrays):
+            setattr(self.calc_params, name, value)
+        return True
+
     # Returns average temperature in deci-celsius
     def read_frame(self):
-        raw_frame = self.hw.read_frame()
-        
-        if raw_frame:
-            frame = self.do_compensation(raw_frame)
-            
-            pixel_count = 32 * 24
-            total_temperature = 0
-            for i in range(pixel_count):
-                total_temperature += frame[i]
-            
-            avg_temperature = int(total_temperature / pixel_count)
+        if self.engine != MLX90640.ENGINE_PYTHON:
+            raw_frame = self.hw.read_frame_into()
+        else:
+            raw_frame = self.hw.read_frame()
         
-            return avg_temperature, map(int, frame)
+        if raw_frame is not None:
+            return self.process_frame(raw_frame)
         else:
             return None, None
 
+    # Compensates a raw frame read by HAL_MLX90640, returns average temperature in deci-celsius and the frame
+    def process_frame(self, raw_frame):
+        pixel_count = 32 * 24
+
+        if self.engine == MLX90640.ENGINE_NUMPY:
+            # status register bit 0 holds the subpage that was just measured
+            subpage = int(raw_frame[833]) & 0x0001 if self.subpage_incremental else None
+            frame = self.do_compensation_numpy(raw_frame, subpage=subpage)
+            if self.bad_pixel_corrector.enabled:
+                frame = self.bad_pixel_corrector.correct(frame)
+            avg_temperature = int(frame.sum() / pixel_count)
+            frame_int = self.frame_plan.result_frame_int
+            np.copyto(frame_int, frame, casting="unsafe")
+            return avg_temperature, frame_int
+
+        if self.engine == MLX90640.ENGINE_FIXED:
+            subpage = int(raw_frame[833]) & 0x0001 if self.subpage_incremental else None
+            frame = self.do_compensation_fixed(raw_frame, subpage=subpage)
+            if self.bad_pixel_corrector.enabled:
+                frame_int = self.frame_plan.result_frame_int
+                corrected = self.bad_pixel_corrector.correct(frame)
+                np.copyto(frame_int, np.rint(corrected, out=corrected), casting="unsafe")
+                frame = frame_int
+            return int(frame.sum() / pixel_count), frame
+
+        if isinstance(raw_frame, np.ndarray):
+            raw_frame = raw_frame.tolist()
+        frame = self.do_compensation(raw_frame)
+        if self.bad_pixel_corrector.enabled:
+            frame = self.bad_pixel_corrector.correct(frame)
+        
+        total_temperature = 0
+        for i in range(pixel_count):
+            total_temperature += frame[i]
+        
+        avg_temperature = int(total_temperature / pixel_count)
+    
+        return avg_temperature, [int(value) for value in frame]
+
             
     
 class ParameterCodesEEPROM(enum.Enum):
@@ -632,6 +1274,32 @@ class TCalcParams:
 
         self.set_defaults()
 
+    # Calibration cache layout: header, integer scalars, float scalars, then the arrays as little endian doubles.
+    # calculate_parameters fills the CACHE_ARRAYS fields with (nested) lists, a cache hit with read only numpy arrays
+    # of their shape on the mapped file, or with lists again for the python engine (MLX90640.load_calibration_cache)
+    CACHE_MAGIC = b"MLXC"
+    CACHE_VERSION = 1
+    CACHE_HEADER = struct.Struct("<4sHHHHI")  # magic, version, Id0, Id1, Id2, EEPROM crc32
+    CACHE_INT_SCALARS = ["version", "Id0", "Id1", "Id2", "Vdd_25", "Kv_Vdd", "Res_scale", "VPTAT_25",
+                         "GainMeas_25_3v2"]
+    CACHE_FLOAT_SCALARS = ["Kv_PTAT", "Kt_PTAT", "alpha_ptat", "Vdd_V0", "KsTa", "Ta_0_Alpha", "KsTo", "To_0_Alpha"]
+    CACHE_ARRAYS = [
+        ("Pix_os_ref", (MAX_CAL_RANGES, MAX_IR_PIXELS)),
+        ("Kta", (MAX_CAL_RANGES, MAX_IR_PIXELS)),
+        ("Kv", (MAX_CAL_RANGES, MAX_IR_PIXELS)),
+        ("alpha", (MAX_IR_PIXELS,)),
+        ("Ta_min", (MAX_CAL_RANGES,)),
+        ("Ta_max", (MAX_CAL_RANGES,)),
+        ("Ta0", (MAX_CAL_RANGES,)),
+        ("TGC", (NUM_TGC,)),
+        ("Pix_os_ref_TGC", (MAX_CAL_RANGES, NUM_PAGES, NUM_TGC)),
+        ("Kta_TGC", (MAX_CAL_RANGES, NUM_PAGES, NUM_TGC)),
+        ("Kv_TGC", (MAX_CAL_RANGES, NUM_PAGES, NUM_TGC)),
+        ("alpha_TGC", (NUM_PAGES, NUM_TGC)),
+    ]
+    CACHE_SIZE = CACHE_HEADER.size + 8 * (len(CACHE_INT_SCALARS) + len(CACHE_FLOAT_SCALARS)) + \
+        8 * sum(int(np.prod(shape)) for name, shape in CACHE_ARRAYS)
+
     def set_defaults(self):
         self.version = 0
         self.Id0 = 0
@@ -678,6 +1346,141 @@ class TCalcParams:
                     self.Kv_TGC[t][page][i] = 0
 
 
+class TFramePlan:
+    """
+    Per-pixel calibration folded into contiguous arrays for the numpy and fixed engines, see
+    MLX90640.compile_frame_plan
+    """
+
+    def __init__(self):
+        self.page_map = None                 # 32x24 array,subpage of each pixel (chess or interlaced)
+        self.alpha_valid = None              # 32x24 array,False where the effective alpha is zero
+        self.inv_alpha = None                # 32x24 array,K^4/LSB,1 / (alpha - cyclops alpha of the page)
+        self.Pix_os_ref = None               # MAX_CAL_RANGES x 768 array,LSB,offset at Tamb=25 degC and 3.2V
+        self.Kta = None                      # MAX_CAL_RANGES x 768 array,LSB/degC,offset dependence vs Tamb
+        self.Kv = None                       # MAX_CAL_RANGES x 768 array,LSB/V,offset dependence vs supply
+
+        # Offsets folded for the ambient temperature and supply below
+        self.Pix_os = None                   # 32x24 array,LSB,Pix_os_ref * (1 + Kta*dDeltaTa) * (1 + Kv*dDeltaV)
+        self.tidx = -1
+        self.dDeltaTa = 0.0
+        self.dDeltaV = 0.0
+
+        # Per subpage copies, gathered with page_pixels
+        self.page_pixels = None              # NUM_PAGES arrays,indices of the pixels of each subpage
+        self.page_alpha_valid = None
+        self.page_inv_alpha = None
+        self.page_Pix_os = None
+
+        # Work arrays reused by every frame
+        self.page_cyclops = None             # NUM_PAGES array,LSB,cyclops compensation of the current frame
+        self.Pix_GainComp = None             # 32x24 array,LSB,gain compensated pixels
+        self.work = None                     # TPixelWork for the whole frame
+        self.page_work = None                # NUM_PAGES TPixelWork, one per subpage
+        self.result_frame = None             # 32x24 array,deci-celsius
+        self.result_frame_ambient = None     # 32x24+1 array,result_frame followed by Tamb [degC]
+        self.result_frame_int = None         # 32x24 array,deci-celsius truncated like int()
+        self.raw_words = None                # FRAME_WORDS int32 array,native copy of the raw frame
+        self.raw_words16 = None              # FRAME_WORDS int16 array,byte swapped copy of a 16 bit raw frame
+        self.raw_pixels = None               # views of raw_words: the pixels and the service words
+        self.raw_info = None
+        self.info_data = None                # service words in int64, scratch of compensation_constants
+        self.result_complete = False         # result_frame holds both subpages
+
+        # Fixed point engine, see MLX90640.FIXED_*_SHIFT for the scaling
+        self.inv_alpha_q = None              # 32x24 int64 array,K^4/LSB,inv_alpha rounded
+        self.page_inv_alpha_q = None
+        self.Pix_os_q = None                 # 32x24 int64 array,LSB,Pix_os scaled by FIXED_PIX_SHIFT
+        self.page_Pix_os_q = None
+        self.page_cyclops_q = None           # NUM_PAGES int64 array,LSB,scaled by FIXED_PIX_SHIFT
+        self.Pix_GainComp_q = None           # 32x24 int64 array,LSB,scaled by FIXED_PIX_SHIFT
+        self.KsTo_q = 0                      # 1/degC,scaled by FIXED_KSTO_COEF_SHIFT
+        self.To_0_Alpha_q = 0                # K,scaled by FIXED_TEMP_SHIFT
+        self.result_frame_fixed = None       # 32x24 int64 array,deci-celsius
+        self.result_frame_fixed_ambient = None  # 32x24+1 int64 array,result_frame_fixed followed by Tamb
+        self.result_fixed_complete = False   # result_frame_fixed holds both subpages
+
+
+class TPixelWork:
+    """
+    Scratch arrays of MLX90640.compensate_pixels and compensate_pixels_fixed for a set of pixels
+    """
+
+    def __init__(self, num_pixels):
+        self.Pix_comp = np.zeros(num_pixels)
+        self.d = np.zeros(num_pixels)
+        self.To = np.zeros(num_pixels)
+        self.valid = np.zeros(num_pixels, dtype=bool)
+        self.invalid = np.zeros(num_pixels, dtype=bool)
+        self.result = np.zeros(num_pixels)
+
+        # fixed point engine
+        self.Pix_comp_q = np.zeros(num_pixels, dtype=np.int64)
+        self.x_q = np.zeros(num_pixels, dtype=np.int64)
+        self.d_q = np.zeros(num_pixels, dtype=np.int64)
+        self.T_q = np.zeros(num_pixels, dtype=np.int64)
+        self.idx = np.zeros(num_pixels, dtype=np.int64)
+        self.frac = np.zeros(num_pixels, dtype=np.int64)
+        self.slope = np.zeros(num_pixels, dtype=np.int64)
+        self.result_q = np.zeros(num_pixels, dtype=np.int64)
+
+
+class BadPixelCorrector:
+    """
+    Replaces the bad pixels of a frame by the average of their good neighbours: the 4 adjacent pixels, or the
+    diagonal ones if none of those is good. A bad pixel without any good neighbour is left as it is.
+
+    The neighbour tables cover every pixel of the frame, good pixels simply refer to themselves with weight 1, so
+    correct costs one gather, one multiply and one sum of the same size whatever the number of bad pixels.
+    """
+
+    def __init__(self, bad_pixels, rows=24, cols=32):
+        self.rows = rows
+        self.cols = cols
+        num_pixels = rows * cols
+        self.bad_pixels = sorted(set(int(pixel) for pixel in bad_pixels))
+        good = np.ones(num_pixels, dtype=bool)
+        good[self.bad_pixels] = False
+
+        neighbours = {}
+        for pixel in self.bad_pixels:
+            row, col = divmod(pixel, cols)
+            for offsets in (((-1, 0), (1, 0), (0, -1), (0, 1)), ((-1, -1), (-1, 1), (1, -1), (1, 1))):
+                neighbours[pixel] = [(row + dr) * cols + col + dc for dr, dc in offsets
+                                     if 0 <= row + dr < rows and 0 <= col + dc < cols and
+                                     good[(row + dr) * cols + col + dc]]
+                if neighbours[pixel]:
+                    break
+        width = max([len(idx) for idx in neighbours.values()] + [1])
+
+        self.neighbour_index = np.repeat(np.arange(num_pixels)[:, None], width, axis=1)
+        self.neighbour_weight = np.zeros((num_pixels, width))
+        self.neighbour_weight[:, 0] = 1.0
+        for pixel, idx in neighbours.items():
+            if idx:
+                self.neighbour_index[pixel, :len(idx)] = idx
+                self.neighbour_weight[pixel, :] = 0.0
+                self.neighbour_weight[pixel, :len(idx)] = 1.0 / len(idx)
+
+        self.frame = np.zeros(num_pixels)
+        self.gathered = np.zeros((num_pixels, width))
+        self.corrected = np.zeros(num_pixels)
+
+    @property
+    def enabled(self):
+        return len(self.bad_pixels) > 0
+
+    def correct(self, frame):
+        """
+        :param frame: flat frame of rows * cols temperatures, a list or a numpy array
+        :return: the corrected frame as a float64 numpy array, reused by the next call
+        """
+        np.copyto(self.frame, frame)
+        np.take(self.frame, self.neighbour_index, out=self.gathered, mode="clip")
+        np.multiply(self.gathered, self.neighbour_weight, out=self.gathered)
+        return np.sum(self.gathered, axis=1, out=self.corrected)
+
+
 class Mlx90640EEPROM:
     eeprom_map = {
         ParameterCodesEEPROM.CodeOscTrim: 0,
@@ -748,6 +1551,7 @@ class Mlx90640EEPROM:
         ParameterCodesEEPROM.CodePixel_Alpha: (0, 32 * 24, lambda index: [0x40 + index, 4, 6]),
         ParameterCodesEEPROM.CodePixel_Offset: (0, 32 * 24, lambda index: [0x40 + index, 10, 6])
     }
+    bulk_map = {}
 
     def __init__(self, device: MLX90640):
         self.device = device
@@ -756,6 +1560,8 @@ class Mlx90640EEPROM:
         self.outlier_pixels = []
         self.broken_pixels = []
         self.bad_pixels = []
+        self.outlier_pixel_mask = None
+        self.broken_pixel_mask = None
 
     def get_bit(self, index, lsb):
         return (self.eeprom[index] & (1 << lsb)) != 0
@@ -774,19 +1580,25 @@ class Mlx90640EEPROM:
         else:
             return 1
 
-    def read_eeprom_from_device(self):
+    def read_eeprom_from_device(self, consecutive_reads=2, merge=False):
         """
         Perform consecutive reads of the EEPROM to ensure a correct read, sets self.eeprom as a list of 16 bit
         integers read in big endian
+        :param int consecutive_reads: number of reads merged into the first one
+        :param bool merge: the image already in self.eeprom is the first read, e.g. a single read that did not match
+                           the calibration cache
         :returns: nothing
         :raises: ValueError - error during read from chip
         """
-        first_read, status = self.device.hw.i2c_read(0x2400, self.eeprom_size)
-        if status != 0:
-            raise ValueError("Error during initial read of eeprom")
-        first_read = list(struct.unpack(">" + str(self.eeprom_size // 2) + "H", first_read))
+        if merge and self.eeprom is not None:
+            first_read = list(self.eeprom)
+        else:
+            first_read, status = self.device.hw.i2c_read(0x2400, self.eeprom_size)
+            if status != 0:
+                raise ValueError("Error during initial read of eeprom")
+            first_read = list(struct.unpack(">" + str(self.eeprom_size // 2) + "H", first_read))
 
-        for m in range(2):
+        for m in range(consecutive_reads):
             consecutive_read, status = self.device.hw.i2c_read(0x2400, self.eeprom_size)
             if status != 0:
                 raise ValueError("Error during consecutive read of eeprom")
@@ -794,11 +1606,33 @@ class Mlx90640EEPROM:
 
             for i in range(self.eeprom_size // 2):
                 first_read[i] |= consecutive_read[i]
-        self.eeprom = first_read
+        self.load_image(first_read)
+
+    def load_image(self, eeprom_words):
+        """
+        Sets self.eeprom from an EEPROM image instead of reading the device
+        :param eeprom_words: the 16 bit EEPROM words
+        :returns: nothing
+        :raises: ValueError - the image does not have the size of the EEPROM
+        """
+        if len(eeprom_words) != self.eeprom_size // 2:
+            raise ValueError("EEPROM image has {} words instead of {}".format(len(eeprom_words),
+                                                                              self.eeprom_size // 2))
+        self.eeprom = [int(word) for word in eeprom_words]
         self.extract_broken_pixels()
         self.extract_outlier_pixels()
         self.get_bad_pixels()
 
+    def checksum(self):
+        """
+        :return: crc32 of the EEPROM image, used to validate the calibration cache: it is saved with the checksum of
+                 the merged image and looked up with the one of a single read, which is equal unless that read lost
+                 a bit
+        """
+        if self.eeprom is None:
+            raise ValueError("EEPROM is not read from device")
+        return zlib.crc32(struct.pack(">" + str(self.eeprom_size // 2) + "H", *self.eeprom))
+
     def get_parameter_code(self, param_id: ParameterCodesEEPROM, index=None):
         """
         Gets a named parameter from the eeprom. If it is an indexed parameter the index will be checked.
@@ -828,25 +1662,44 @@ class Mlx90640EEPROM:
         else:
             ValueError("invalid eeprom parameter at {}".format(param_id))
 
+    def get_parameter_codes(self, param_id: ParameterCodesEEPROM):
+        """
+        Gets all values of an indexed parameter at once with a single shift and mask over the EEPROM words.
+        :param ParameterCodesEEPROM param_id: the id of the indexed parameter
+        :return: int64 numpy array, element i holds the parameter at index i
+        :raises: ValueError - missing eeprom (not read from device), or the parameter is not indexed
+        """
+        if self.eeprom is None:
+            raise ValueError("EEPROM is not read from device")
+        params = Mlx90640EEPROM.eeprom_map[param_id]
+        if type(params) is not tuple:
+            raise ValueError("{} is not an indexed parameter".format(param_id))
+
+        # word index, lsb and mask of every index, expanded once from eeprom_map
+        if param_id not in Mlx90640EEPROM.bulk_map:
+            fields = np.array([params[2](index) for index in range(params[0], params[1])])
+            Mlx90640EEPROM.bulk_map[param_id] = (fields[:, 0], fields[:, 1], (1 << fields[:, 2]) - 1)
+        word_idx, lsb, mask = Mlx90640EEPROM.bulk_map[param_id]
+
+        return (np.asarray(self.eeprom, dtype=np.int64)[word_idx] >> lsb) & mask
+
     def extract_outlier_pixels(self):
-        self.outlier_pixels = []
-        for pixel_i in range(768):
-            if self.eeprom[pixel_i + 64] & 0x0001:
-                self.outlier_pixels.append(pixel_i)
+        pixel_words = np.asarray(self.eeprom[64:64 + 768])
+        self.outlier_pixel_mask = (pixel_words & 0x0001) != 0
+        self.outlier_pixels = np.flatnonzero(self.outlier_pixel_mask).tolist()
         return self.outlier_pixels
 
     def extract_broken_pixels(self):
-        self.broken_pixels = []
-        for pixel_i in range(768):
-            if self.eeprom[pixel_i + 64] == 0:
-                self.broken_pixels.append(pixel_i)
+        pixel_words = np.asarray(self.eeprom[64:64 + 768])
+        self.broken_pixel_mask = pixel_words == 0
+        self.broken_pixels = np.flatnonzero(self.broken_pixel_mask).tolist()
         return self.broken_pixels
 
     def get_bad_pixels(self):
-        self.bad_pixels = self.broken_pixels
-        for pixel_i in self.outlier_pixels:
-            if pixel_i not in self.bad_pixels:
-                self.bad_pixels.append(pixel_i)
+        """
+        :return: sorted indices of the pixels that are broken or outliers
+        """
+        self.bad_pixels = np.flatnonzero(self.broken_pixel_mask | self.outlier_pixel_mask).tolist()
         return self.bad_pixels
     
     
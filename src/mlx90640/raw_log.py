@@ -0,0 +1,77 @@
+import os
+import struct
+
+import numpy as np
+
+
+class RawFrameLog:
+    """
+    Binary log of raw MLX90640 frames, so a test can be compensated again offline (see replay.py), e.g. with
+    another emissivity.
+
+    Layout: FILE_HEADER, the EEPROM image of the sensor (EEPROM_WORDS big endian words, as read from the device),
+    then one record per frame: RECORD_HEADER followed by the FRAME_WORDS big endian words of the raw frame, exactly
+    as in HAL_MLX90640.frame_buffer (pixels, service words, control register 1, status register).
+    """
+
+    MAGIC = b"MLXR"
+    VERSION = 1
+    # magic, version, test id, EEPROM words, frame words
+    FILE_HEADER = struct.Struct("<4sHHHH")
+    # acquisition timestamp [s]
+    RECORD_HEADER = struct.Struct("<d")
+    EEPROM_WORDS = 832
+    FRAME_WORDS = 834
+    RECORD_DTYPE = np.dtype([("timestamp", "<f8"), ("frame", ">i2", (FRAME_WORDS,))])
+
+    def __init__(self, path, eeprom_words, test_id=0):
+        """
+        Creates the log file and writes its header
+        :param str path: log file
+        :param eeprom_words: the EEPROM_WORDS words of Mlx90640EEPROM.eeprom
+        :param int test_id: test the frames belong to
+        """
+        self.file_handle = open(path, "wb")
+        self.file_handle.write(RawFrameLog.FILE_HEADER.pack(RawFrameLog.MAGIC, RawFrameLog.VERSION, test_id,
+                                                            RawFrameLog.EEPROM_WORDS, RawFrameLog.FRAME_WORDS))
+        self.file_handle.write(struct.pack(">{}H".format(RawFrameLog.EEPROM_WORDS), *eeprom_words))
+
+    def write(self, frame, timestamp):
+        """
+        :param frame: bytes-like raw frame, FRAME_WORDS big endian words
+        :param float timestamp: acquisition time [s]
+        :return: nothing
+        """
+        self.file_handle.write(RawFrameLog.RECORD_HEADER.pack(timestamp))
+        self.file_handle.write(frame)
+
+    def close(self):
+        self.file_handle.close()
+
+    @staticmethod
+    def read(path):
+        """
+        Opens a raw frame log without loading the frames into memory
+        :param str path: log file
+        :return: tuple (test_id, eeprom_words, records), records is a read only memory map of RECORD_DTYPE with
+                 the fields "timestamp" and "frame"
+        :raises: ValueError - not a raw frame log, or written with another layout
+        """
+        header_size = RawFrameLog.FILE_HEADER.size + 2 * RawFrameLog.EEPROM_WORDS
+        with open(path, "rb") as file_handle:
+            header = file_handle.read(header_size)
+        if len(header) != header_size:
+            raise ValueError("{} is too short for a raw frame log".format(path))
+
+        magic, version, test_id, eeprom_words, frame_words = RawFrameLog.FILE_HEADER.unpack_from(header, 0)
+        if magic != RawFrameLog.MAGIC or version != RawFrameLog.VERSION or \
+                eeprom_words != RawFrameLog.EEPROM_WORDS or frame_words != RawFrameLog.FRAME_WORDS:
+            raise ValueError("{} is not a raw frame log of version {}".format(path, RawFrameLog.VERSION))
+        eeprom = list(struct.unpack_from(">{}H".format(eeprom_words), header, RawFrameLog.FILE_HEADER.size))
+
+        # a record being written when the log was cut is ignored
+        count = (os.path.getsize(path) - header_size) // RawFrameLog.RECORD_DTYPE.itemsize
+        if count == 0:
+            return test_id, eeprom, np.zeros(0, dtype=RawFrameLog.RECORD_DTYPE)
+        records = np.memmap(path, dtype=RawFrameLog.RECORD_DTYPE, mode="r", offset=header_size, shape=(count,))
+        return test_id, eeprom, records
@@ -0,0 +1,111 @@
+"""
+Offline compensation of raw MLX90640 frame logs (see raw_log.py), spread over all cores.
+
+Run from the src directory, e.g. to redo a test with another emissivity:
+
+    python -m mlx90640.replay ../log/2024-05-01_14:02_17.mlxraw --emissivity 0.95 -o test_17.log
+
+The output is the text format of main.log_process, or a numpy archive (timestamps, frames, avg_temp) if the output
+file ends with .npz.
+"""
+import argparse
+from datetime import datetime
+from multiprocessing import Pool
+import os
+import time
+
+import numpy as np
+
+from mlx90640.mlx90640 import MLX90640
+from mlx90640.raw_log import RawFrameLog
+
+
+# State of each pool worker, set up once by init_worker
+worker_mlx = None
+worker_records = None
+
+
+def init_worker(path, eeprom_words, engine, emissivity):
+    global worker_mlx, worker_records
+    worker_mlx = MLX90640.from_eeprom_image(eeprom_words, engine=engine)
+    worker_mlx.emissivity = emissivity
+    # every worker maps the log itself, so only the chunk bounds and the results cross process boundaries
+    _, _, worker_records = RawFrameLog.read(path)
+
+
+def compensate_chunk(bounds):
+    """
+    :param bounds: (start, stop) record indices
+    :return: tuple (start, average temperatures, frames), both in deci-celsius
+    """
+    start, stop = bounds
+    avg_temp = np.zeros(stop - start, dtype=np.int32)
+    frames = np.zeros((stop - start, 32 * 24), dtype=np.int16)
+    for i in range(start, stop):
+        avg_temp[i - start], frame = worker_mlx.process_frame(worker_records[i]["frame"])
+        frames[i - start] = frame
+    return start, avg_temp, frames
+
+
+def replay(path, engine=MLX90640.ENGINE_PYTHON, emissivity=1.0, eeprom_words=None, processes=None, chunk_size=256):
+    """
+    Compensates every frame of a raw frame log
+    :param str path: raw frame log
+    :param engine: compensation engine, one of MLX90640.ENGINES
+    :param float emissivity: emissivity used instead of the one of the test
+    :param eeprom_words: EEPROM image replacing the one stored in the log, None keeps it
+    :param processes: number of worker processes, None uses every core
+    :param int chunk_size: frames per task
+    :return: tuple (test_id, timestamps, avg_temp, frames), frames is a frame count x 768 array in deci-celsius
+    """
+    test_id, log_eeprom_words, records = RawFrameLog.read(path)
+    if eeprom_words is None:
+        eeprom_words = log_eeprom_words
+
+    count = len(records)
+    timestamps = np.array(records["timestamp"])
+    avg_temp = np.zeros(count, dtype=np.int32)
+    frames = np.zeros((count, 32 * 24), dtype=np.int16)
+
+    chunks = [(start, min(start + chunk_size, count)) for start in range(0, count, chunk_size)]
+    with Pool(processes, initializer=init_worker, initargs=(path, eeprom_words, engine, emissivity)) as pool:
+        for start, chunk_avg_temp, chunk_frames in pool.imap_unordered(compensate_chunk, chunks):
+            avg_temp[start:start + len(chunk_avg_temp)] = chunk_avg_temp
+            frames[start:start + len(chunk_frames)] = chunk_frames
+
+    return test_id, timestamps, avg_temp, frames
+
+
+def write_text_log(path, test_id, timestamps, frames):
+    with open(path, "w") as file_handle:
+        for timestamp, frame in zip(timestamps, frames):
+            file_handle.write(datetime.fromtimestamp(timestamp).strftime("%H:%M:%S.%f") + " ; ")
+            file_handle.write(f"{test_id} ; ")
+            file_handle.write("".join(f"{value}," for value in frame.tolist()))
+            file_handle.write("\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compensate a raw MLX90640 frame log")
+    parser.add_argument("log", help="raw frame log written by main.log_process")
+    parser.add_argument("-o", "--output", help="output file, .npz for a numpy archive, text log otherwise")
+    parser.add_argument("--engine", default=MLX90640.ENGINE_PYTHON, choices=MLX90640.ENGINES)
+    parser.add_argument("--emissivity", type=float, default=1.0)
+    parser.add_argument("--eeprom", help="raw frame log whose EEPROM image replaces the one of the log")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes, every core by default")
+    args = parser.parse_args()
+
+    eeprom_words = RawFrameLog.read(args.eeprom)[1] if args.eeprom else None
+
+    start_time = time.time()
+    test_id, timestamps, avg_temp, frames = replay(args.log, engine=args.engine, emissivity=args.emissivity,
+                                                   eeprom_words=eeprom_words, processes=args.processes)
+    elapsed = time.time() - start_time
+    print(f"{len(frames)} frames of test {test_id} compensated in {elapsed:.2f} s "
+          f"({len(frames) / max(elapsed, 1e-9):.0f} frames/s on {args.processes or os.cpu_count()} processes)")
+
+    if args.output is not None:
+        if args.output.endswith(".npz"):
+            np.savez(args.output, timestamps=timestamps, frames=frames, avg_temp=avg_temp)
+        else:
+            write_text_log(args.output, test_id, timestamps, frames)
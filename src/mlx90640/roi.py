@@ -0,0 +1,77 @@
+import numpy as np
+
+
+class RoiEngine:
+    """
+    Min / mean / max statistics of rectangular or masked zones of a thermal frame (e.g. inner, middle and outer
+    tire bands), all zones in one vectorized pass.
+
+    Zones are registered with add_rect_zone / add_mask_zone and compiled once into a single pixel index array,
+    sorted by zone, with the bad pixels of the sensor left out. compute then needs one gather and one reduceat per
+    statistic regardless of the number of zones.
+    """
+
+    def __init__(self, rows=24, cols=32):
+        self.rows = rows
+        self.cols = cols
+        self.names = []
+        self.masks = []
+
+        self.pixel_index = None
+        self.zone_start = None
+        self.zone_size = None
+        self.stats = None
+
+    def add_rect_zone(self, name, row_start, row_stop, col_start, col_stop):
+        """
+        Adds a zone covering rows [row_start, row_stop) and columns [col_start, col_stop)
+        """
+        mask = np.zeros((self.rows, self.cols), dtype=bool)
+        mask[row_start:row_stop, col_start:col_stop] = True
+        self.add_mask_zone(name, mask)
+
+    def add_mask_zone(self, name, mask):
+        """
+        Adds a zone covering every pixel set in mask (rows x cols booleans, or a flat array of pixel count)
+        """
+        mask = np.asarray(mask, dtype=bool).reshape(self.rows, self.cols)
+        self.names.append(name)
+        self.masks.append(mask)
+        self.pixel_index = None
+
+    def compile(self, bad_pixels=()):
+        """
+        Precomputes the pixel index of every zone
+        :param bad_pixels: pixel indices excluded from all zones, e.g. Mlx90640EEPROM.bad_pixels
+        :return: nothing
+        :raises: ValueError - a zone has no usable pixels left
+        """
+        good = np.ones(self.rows * self.cols, dtype=bool)
+        good[np.asarray(bad_pixels, dtype=int)] = False
+
+        zone_pixels = []
+        for name, mask in zip(self.names, self.masks):
+            pixels = np.flatnonzero(mask.ravel() & good)
+            if len(pixels) == 0:
+                raise ValueError("Zone {} has no usable pixels".format(name))
+            zone_pixels.append(pixels)
+
+        self.zone_size = np.array([len(pixels) for pixels in zone_pixels])
+        self.zone_start = np.concatenate(([0], np.cumsum(self.zone_size)[:-1]))
+        self.pixel_index = np.concatenate(zone_pixels)
+        self.stats = np.zeros((len(self.names), 3))
+
+    def compute(self, frame):
+        """
+        :param frame: flat frame of rows * cols temperatures
+        :return: zones x 3 array of (min, mean, max), reused by the next call
+        """
+        if self.pixel_index is None:
+            raise ValueError("Zones are not compiled")
+
+        values = np.asarray(frame)[self.pixel_index]
+        np.minimum.reduceat(values, self.zone_start, out=self.stats[:, 0])
+        np.add.reduceat(values, self.zone_start, out=self.stats[:, 1])
+        np.divide(self.stats[:, 1], self.zone_size, out=self.stats[:, 1])
+        np.maximum.reduceat(values, self.zone_start, out=self.stats[:, 2])
+        return self.stats
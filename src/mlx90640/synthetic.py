@@ -0,0 +1,132 @@
+import numpy as np
+
+from mlx90640.mlx90640 import MLX90640, TCalcParams
+
+
+class SyntheticSensor:
+    """
+    A made up but consistent MLX90640: an EEPROM image built around the calibration example of the datasheet with
+    random per-row, per-column and per-pixel corrections, and raw frames computed backwards from a scene of object
+    temperatures, so the compensation engines see realistic values (valid pixels, offsets, cyclops, KsTo).
+
+    Everything is derived from the seed, two sensors with the same arguments produce the same images and frames.
+    """
+
+    # Calibration words of the datasheet example EEPROM
+    EXAMPLE_WORDS = {
+        0x10: 0x4210, 0x11: 0xFFBB, 0x20: 0x7766, 0x21: 0x2F44, 0x30: 0x18EF, 0x31: 0x2FF1, 0x32: 0x5952,
+        0x33: 0x9D68, 0x34: 0x5454, 0x35: 0x0000, 0x36: 0x5E5E, 0x37: 0x5B5B, 0x38: 0x2363, 0x39: 0xE446,
+        0x3A: 0xFBB5, 0x3B: 0x044B, 0x3C: 0xF020, 0x3D: 0x9797, 0x3E: 0x9797, 0x3F: 0x2889,
+    }
+    # Control register 1: 2 Hz, 18 bit resolution, chess pattern (bit 12)
+    CONTROL1 = 0x1901
+    CONTROL1_CHESS = 0x1000
+    # Status register: new data available
+    STATUS_NEW_DATA = 0x0008
+
+    def __init__(self, seed=0, chess=True, broken_pixels=(), outlier_pixels=()):
+        """
+        :param int seed: seed of every random value
+        :param bool chess: chess pattern readout if True, interlaced otherwise
+        :param broken_pixels: pixel indices stored as broken (zero EEPROM word)
+        :param outlier_pixels: pixel indices flagged as outliers
+        """
+        self.seed = seed
+        self.chess = chess
+        self.rng = np.random.default_rng(seed)
+        self.control = SyntheticSensor.CONTROL1 if chess else SyntheticSensor.CONTROL1 & ~SyntheticSensor.CONTROL1_CHESS
+        self.eeprom_image = self.make_eeprom_image(broken_pixels, outlier_pixels)
+        # private instance, folding its frame plan does not disturb the instances under test
+        self.mlx = MLX90640.from_eeprom_image(self.eeprom_image, engine=MLX90640.ENGINE_NUMPY)
+
+    def make_eeprom_image(self, broken_pixels, outlier_pixels):
+        words = np.zeros(832, dtype=np.int64)
+        for index, word in SyntheticSensor.EXAMPLE_WORDS.items():
+            words[index] = word
+        words[0x07:0x0A] = self.rng.integers(0, 1 << 16, 3)
+        words[0x0C] = self.control
+
+        # OCC / ACC rows and columns: 4 signed 4 bit values per word
+        nibbles = self.rng.integers(-3, 4, (2, 14, 4)) & 0xF
+        row_col_words = (nibbles << np.array([0, 4, 8, 12])).sum(axis=2)
+        words[0x12:0x20] = row_col_words[0]
+        words[0x22:0x30] = row_col_words[1]
+
+        # pixels: offset (15:10) and alpha (9:4) 6 bit signed, Kta (3:1) 3 bit signed, outlier (0)
+        offset = self.rng.integers(-20, 21, 768) & 0x3F
+        alpha = self.rng.integers(-15, 16, 768) & 0x3F
+        kta = self.rng.integers(-2, 3, 768) & 0x7
+        pixel_words = (offset << 10) | (alpha << 4) | (kta << 1)
+        pixel_words[pixel_words == 0] = 1 << 10
+        pixel_words[list(outlier_pixels)] |= 1
+        pixel_words[list(broken_pixels)] = 0
+        words[0x40:] = pixel_words
+        return words.tolist()
+
+    def scene(self, index, ambient_temp=30.0):
+        """
+        Tire-like test scene: a warm band moving slowly across the columns over a gradient background
+        :param int index: frame index
+        :param float ambient_temp: background temperature [degC]
+        :return: 768 object temperatures [degC]
+        """
+        rows, cols = np.mgrid[0:24, 0:32]
+        center = 16 + 10 * np.sin(index / 50.0)
+        band = 45.0 * np.exp(-((cols - center) / 6.0) ** 2)
+        return (ambient_temp + 0.2 * rows + band).ravel()
+
+    def raw_frame(self, object_temps, ambient_temp=30.0, vdd=3.3, subpage=0, noise=0.5):
+        """
+        Computes the raw frame the sensor would read for a scene, inverting the compensation of MLX90640
+        :param object_temps: 768 object temperatures [degC] or a single one for every pixel
+        :param float ambient_temp: sensor temperature [degC]
+        :param float vdd: supply voltage [V]
+        :param int subpage: subpage of the status register
+        :param float noise: standard deviation of the pixel noise [LSB]
+        :return: 834 int16 words: pixels, service words, control register 1, status register
+        """
+        mlx = self.mlx
+        params = mlx.calc_params
+        plan = mlx.frame_plan
+
+        frame = np.zeros(834, dtype=np.int64)
+        info = frame[768:832]
+        info[42] = round(params.Vdd_25 + (vdd - params.Vdd_V0) * params.Kv_Vdd)
+        vdd_meas = params.Vdd_V0 + (info[42] - params.Vdd_25) / params.Kv_Vdd
+        ptat = 1711
+        vptat_virt = ((ambient_temp - 25) * params.Kt_PTAT + params.VPTAT_25) * \
+                     (1 + (vdd_meas - params.Vdd_V0) * params.Kv_PTAT)
+        info[32] = ptat
+        info[0] = round(ptat * (1 << 18) / vptat_virt - ptat * params.alpha_ptat)
+        info[10] = params.GainMeas_25_3v2
+        # compensation pixels close to their offset, i.e. the cyclops compensation stays small
+        info[9] = round(params.Pix_os_ref_TGC[0][0][1]) + 10
+        info[0x29] = round(params.Pix_os_ref_TGC[0][1][1]) + 10
+        frame[832] = self.control
+        frame[833] = SyntheticSensor.STATUS_NEW_DATA | subpage
+
+        Tamb, tidx, dDeltaTa, dDeltaV, dGainComp, arrdCyclops, arrdAlphaCyclops, dKsTa, dTaPow4 = \
+            mlx.compensation_constants(info.tolist())
+        mlx.fold_frame_plan(tidx, dDeltaTa, dDeltaV)
+
+        # IR signal [K^4], iterating on the KsTo compensation of the second pass
+        target = (np.broadcast_to(np.asarray(object_temps, dtype=np.float64), 768) - MLX90640.MIN_TEMP_DEGC) ** 4
+        signal = target - dTaPow4
+        if params.version >= 2:
+            for _ in range(3):
+                To1 = np.maximum(signal + dTaPow4, 0.0) ** 0.25 + MLX90640.MIN_TEMP_DEGC
+                signal = (target - dTaPow4) * (1 + params.KsTo * (To1 - params.To_0_Alpha))
+
+        alpha = np.zeros(768)
+        alpha[plan.alpha_valid] = 1.0 / plan.inv_alpha[plan.alpha_valid]
+        pixels = (signal * dKsTa * alpha + plan.Pix_os + np.array(arrdCyclops)[plan.page_map]) / dGainComp
+        pixels += self.rng.normal(0.0, noise, 768) if noise > 0 else 0.0
+        frame[:768] = np.clip(np.rint(pixels), -32768, 32767)
+        return frame.astype(np.int16)
+
+    def raw_frames(self, count, ambient_temp=30.0, noise=0.5):
+        """
+        :return: count consecutive raw frames of the test scene, alternating subpages
+        """
+        return [self.raw_frame(self.scene(index, ambient_temp), ambient_temp=ambient_temp, subpage=index & 1,
+                               noise=noise) for index in range(count)]